@@ -2,6 +2,13 @@
 Application package initialization
 """
 
-from app import core, models, utils
+import importlib
 
 __all__ = ["core", "models", "utils"]
+
+
+# 子包按需加载，见 app.utils 与 app.core
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"app.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
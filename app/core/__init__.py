@@ -2,6 +2,13 @@
 Core module initialization
 """
 
-from app.core import config, response_handlers, openai
+import importlib
 
-__all__ = ["config", "response_handlers", "openai"]
+__all__ = ["config", "response_handlers", "fanout", "resumable", "read_ahead", "openai", "batch", "scheduler", "startup", "lifecycle", "health", "heartbeat", "routing"]
+
+
+# 子模块按需加载，路由模块由 main.py 显式导入
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"app.core.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,280 @@
+"""
+Batch chat completions
+
+POST /v1/batch/completions 接收 OpenAI Batch 格式的 JSONL（每行 {"custom_id", "body"}，
+body 为 chat completions 请求），在 worker 内以有限并发调用上游，按完成顺序以 JSONL 流式返回结果。
+
+- 并发上限：BATCH_CONCURRENCY（不超过 UPSTREAM_POOL_SIZE，保证每个请求都能复用连接池中的连接），
+  可用查询参数 concurrency 调低
+- 续跑：配置 BATCH_RESULTS_DIR 后，结果同时追加写入 <目录>/<key 哈希>/<batch_id>.jsonl；以同一个
+  key 与 batch_id 重新提交时跳过已成功的 custom_id，GET /v1/batch/completions/{batch_id} 下载已保存的全部结果。
+  结果按下游 key 隔离，其他 key 使用相同的 batch_id 既读不到也不会跳过这些结果
+- 排空：服务开始排空后不再提交新的条目，进行中的条目完成后结束响应，客户端可到其他实例续跑
+- 限流：每个条目在请求上游前计入下游 key 的 RATE_LIMIT_PER_MINUTE，超出的条目返回 429 结果行
+  （可稍后以同一 batch_id 续跑）；提交本身不计数。条目不支持 n > 1
+"""
+
+import json
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Generator, List, Optional, Set, Tuple
+
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import ValidationError
+
+from app.core.config import settings
+from app.core.lifecycle import drain_controller
+from app.core.openai import PreparedCompletion, authorize
+from app.core.response_handlers import NonStreamResponseHandler
+from app.core.scheduler import acquire_upstream_slot_sync
+from app.models.schemas import OpenAIRequest
+from app.utils.helpers import check_rate_limit, debug_log, key_digest
+
+router = APIRouter()
+
+_BATCH_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# (custom_id, 请求体, 解析错误)
+BatchItem = Tuple[str, Optional[Dict[str, Any]], Optional[str]]
+
+
+def parse_batch_lines(data: bytes) -> List[BatchItem]:
+    """Parse the JSONL input; malformed lines become items carrying an error"""
+    items: List[BatchItem] = []
+    seen: Set[str] = set()
+    for number, raw in enumerate(data.splitlines(), 1):
+        if not raw.strip():
+            continue
+        try:
+            line = json.loads(raw)
+        except ValueError:
+            items.append((f"line-{number}", None, "Invalid JSON"))
+            continue
+        if not isinstance(line, dict):
+            items.append((f"line-{number}", None, "Each line must be a JSON object"))
+            continue
+        custom_id = line.get("custom_id")
+        if not isinstance(custom_id, str) or not custom_id:
+            items.append((f"line-{number}", None, "Missing custom_id"))
+        elif custom_id in seen:
+            items.append((custom_id, None, "Duplicate custom_id"))
+        elif line.get("url", "/v1/chat/completions") != "/v1/chat/completions":
+            items.append((custom_id, None, f"Unsupported url: {line.get('url')}"))
+        elif not isinstance(line.get("body"), dict):
+            items.append((custom_id, None, "Missing body"))
+        else:
+            items.append((custom_id, line["body"], None))
+        if isinstance(custom_id, str):
+            seen.add(custom_id)
+    return items
+
+
+class BatchResultStore:
+    """Append-only JSONL results of one batch"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def completed_ids(self) -> Set[str]:
+        """custom_ids that already have a successful result"""
+        completed: Set[str] = set()
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path, "rb") as f:
+            for raw in f:
+                try:
+                    result = json.loads(raw)
+                except ValueError:
+                    # 上次中断时可能留下不完整的最后一行
+                    continue
+                if result.get("response") is not None:
+                    completed.add(result["custom_id"])
+        return completed
+
+    def append(self, line: str) -> None:
+        with self._lock:
+            if self._file is None:
+                # 目录在首次写入时创建，查询不存在的结果不会留下空目录
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, "a+", encoding="utf-8")
+                # 上次中断留下的不完整行单独成行，不与新结果拼接
+                if self._file.tell() > 0:
+                    self._file.seek(self._file.tell() - 1)
+                    if self._file.read(1) != "\n":
+                        self._file.write("\n")
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def result_store(batch_id: str, downstream_key: Optional[str]) -> Optional[BatchResultStore]:
+    """Result store of a batch, namespaced by the hash of the downstream key that owns it"""
+    if not settings.BATCH_RESULTS_DIR:
+        return None
+    return BatchResultStore(os.path.join(settings.BATCH_RESULTS_DIR, key_digest(downstream_key), f"{batch_id}.jsonl"))
+
+
+def _result_line(custom_id: str, response: Optional[Dict[str, Any]] = None, status_code: int = 200,
+                 message: Optional[str] = None) -> str:
+    result = {
+        "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+        "custom_id": custom_id,
+        "response": {"status_code": status_code, "body": response} if response is not None else None,
+        "error": {"code": str(status_code), "message": message} if response is None else None,
+    }
+    return json.dumps(result, ensure_ascii=False) + "\n"
+
+
+class BatchRun:
+    """Runs batch items with bounded concurrency, yielding result lines as they complete"""
+
+    def __init__(self, items: List[BatchItem], downstream_key: Optional[str], concurrency: int,
+                 store: Optional[BatchResultStore] = None, priority: str = "batch"):
+        self.items = items
+        self.downstream_key = downstream_key
+        self.priority = priority
+        self.concurrency = concurrency
+        self.store = store
+        self.aborted = False
+        self._handlers: Set[NonStreamResponseHandler] = set()
+        self._lock = threading.Lock()
+
+    def _execute(self, item: BatchItem) -> str:
+        custom_id, body, error = item
+        if error is not None:
+            line = _result_line(custom_id, status_code=400, message=error)
+        else:
+            line = self._complete(custom_id, body)
+        if self.store is not None:
+            self.store.append(line)
+        return line
+
+    def _complete(self, custom_id: str, body: Dict[str, Any]) -> str:
+        try:
+            request = OpenAIRequest(**body)
+        except ValidationError as e:
+            return _result_line(custom_id, status_code=400, message=str(e))
+        request.stream = False
+        if request.n is not None and request.n != 1:
+            return _result_line(custom_id, status_code=400, message="n must be 1 in batch requests")
+
+        # 每个条目都是一次上游补全，与普通请求一样计入限流
+        retry_after = check_rate_limit(self.downstream_key)
+        if retry_after:
+            return _result_line(custom_id, status_code=429, message=f"Rate limit exceeded, retry after {retry_after}s")
+
+        handler = None
+        slot = None
+        try:
+            # 批量条目默认以 batch 类别排队，不挤占交互请求的上游并发
+            slot = acquire_upstream_slot_sync(self.downstream_key, self.priority)
+            handler = PreparedCompletion(request, self.downstream_key).non_stream_handler()
+            with self._lock:
+                if self.aborted:
+                    return _result_line(custom_id, status_code=503, message="Batch aborted")
+                self._handlers.add(handler)
+            response = handler.handle()
+            return _result_line(custom_id, json.loads(response.body))
+        except HTTPException as e:
+            return _result_line(custom_id, status_code=e.status_code, message=str(e.detail))
+        except Exception as e:
+            debug_log(f"批量条目 {custom_id} 处理失败: {e}")
+            return _result_line(custom_id, status_code=500, message=str(e))
+        finally:
+            if slot is not None:
+                slot.release()
+            if handler is not None:
+                with self._lock:
+                    self._handlers.discard(handler)
+
+    def abort(self) -> None:
+        """Stop submitting items and abort the upstream calls in flight"""
+        with self._lock:
+            self.aborted = True
+            handlers = list(self._handlers)
+        for handler in handlers:
+            handler.abort()
+
+    def run(self) -> Generator[str, None, None]:
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch")
+        pending = iter(self.items)
+        in_flight: set = set()
+        try:
+            while True:
+                # 排空开始后不再提交新条目，让客户端到其他实例续跑
+                while not self.aborted and not drain_controller.draining and len(in_flight) < self.concurrency:
+                    item = next(pending, None)
+                    if item is None:
+                        break
+                    in_flight.add(pool.submit(self._execute, item))
+                if not in_flight:
+                    break
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            if in_flight:
+                # 客户端断开：中断进行中的上游调用，未开始的条目直接取消
+                self.abort()
+            pool.shutdown(wait=False, cancel_futures=True)
+            if self.store is not None:
+                self.store.close()
+
+
+@router.post("/v1/batch/completions")
+async def batch_completions(
+    request: Request,
+    authorization: str = Header(...),
+    batch_id: Optional[str] = None,
+    concurrency: Optional[int] = None,
+    x_priority: Optional[str] = Header(None),
+):
+    """Run a JSONL batch of chat completion requests, streaming results as JSONL"""
+    # 限流按条目计数，见 BatchRun._complete
+    downstream_key = authorize(authorization, rate_limit=False)
+
+    batch_id = batch_id or uuid.uuid4().hex
+    if not _BATCH_ID.match(batch_id):
+        raise HTTPException(status_code=400, detail="batch_id must match [A-Za-z0-9_-]{1,64}")
+
+    items = parse_batch_lines(await request.body())
+    store = result_store(batch_id, downstream_key)
+    completed = store.completed_ids() if store is not None else set()
+    pending = [item for item in items if item[0] not in completed]
+
+    limit = max(1, min(settings.BATCH_CONCURRENCY, settings.UPSTREAM_POOL_SIZE))
+    workers = max(1, min(concurrency or limit, limit))
+    debug_log(f"批量任务 {batch_id}: {len(items)} 条，跳过已完成 {len(items) - len(pending)} 条，并发 {workers}")
+
+    run = BatchRun(pending, downstream_key, workers, store, x_priority or "batch")
+    return StreamingResponse(
+        drain_controller.track(run.run(), run.abort),
+        media_type="application/x-ndjson",
+        headers={
+            "X-Batch-Id": batch_id,
+            "X-Batch-Total": str(len(items)),
+            "X-Batch-Skipped": str(len(items) - len(pending)),
+        },
+    )
+
+
+@router.get("/v1/batch/completions/{batch_id}")
+async def batch_results(batch_id: str, authorization: str = Header(...)):
+    """Download every stored result line of a batch"""
+    downstream_key = authorize(authorization)
+    # 其他 key 的结果不在该 key 的目录下，与不存在一样返回 404
+    store = result_store(batch_id, downstream_key) if _BATCH_ID.match(batch_id) else None
+    if store is None or not os.path.exists(store.path):
+        raise HTTPException(status_code=404, detail="Batch results not found")
+    return FileResponse(store.path, media_type="application/x-ndjson")
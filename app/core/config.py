@@ -23,6 +23,17 @@ class Settings(BaseSettings):
     
     # Server Configuration
     LISTEN_PORT: int = int(os.getenv("LISTEN_PORT", "8080"))
+    LISTEN_HOST: str = os.getenv("LISTEN_HOST", "0.0.0.0")
+    # Production Server Configuration (serve.py)
+    WORKERS: int = int(os.getenv("WORKERS", "0"))  # 0 表示按可用 CPU 自动设置
+    SERVER_LOOP: str = os.getenv("SERVER_LOOP", "auto")  # auto: 优先 uvloop
+    SERVER_HTTP: str = os.getenv("SERVER_HTTP", "auto")  # auto: 优先 httptools
+    SERVER_BACKLOG: int = int(os.getenv("SERVER_BACKLOG", "2048"))
+    SERVER_KEEPALIVE_TIMEOUT: int = int(os.getenv("SERVER_KEEPALIVE_TIMEOUT", "65"))  # 需大于前端负载均衡的空闲超时
+    SERVER_SHUTDOWN_TIMEOUT: float = float(os.getenv("SERVER_SHUTDOWN_TIMEOUT", "30"))  # 停止 worker 时的等待上限（秒）
+    DRAIN_TIMEOUT: float = float(os.getenv("DRAIN_TIMEOUT", "120"))  # 收到 SIGTERM 后等待进行中的流完成的上限（秒）
+    DRAIN_GRACE: float = float(os.getenv("DRAIN_GRACE", "0"))  # 排空开始后继续接受连接（返回 503）的时间，供负载均衡感知 /health/ready
+    SERVER_RELOAD: bool = os.getenv("SERVER_RELOAD", "false").lower() == "true"  # python main.py 以单进程自动重载运行（仅开发）
     DEBUG_LOGGING: bool = os.getenv("DEBUG_LOGGING", "true").lower() == "true"
     
     # Feature Configuration
@@ -30,14 +41,73 @@ class Settings(BaseSettings):
     ANONYMOUS_MODE: bool = os.getenv("ANONYMOUS_MODE", "true").lower() == "true"
     TOOL_SUPPORT: bool = os.getenv("TOOL_SUPPORT", "true").lower() == "true"
     SCAN_LIMIT: int = int(os.getenv("SCAN_LIMIT", "200000"))
+    MAX_TOKENS_COUNT_REASONING: bool = os.getenv("MAX_TOKENS_COUNT_REASONING", "false").lower() == "true"  # 本地执行 max_tokens 时是否计入思考内容
+    MAX_CHOICES: int = int(os.getenv("MAX_CHOICES", "8"))  # 单个请求 n 的上限，n 个候选并发请求上游
+    TOOL_PROMPT_MODE: str = os.getenv("TOOL_PROMPT_MODE", "full").lower()  # full: 详细 Markdown; compact: 每个函数一行签名
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))  # 转发给上游的历史消息估算 token 上限，0 表示不裁剪
+    CONTEXT_TOKEN_BUDGETS: str = os.getenv("CONTEXT_TOKEN_BUDGETS", "")  # 按模型覆盖，如 "GLM-4.5=120000,GLM-4.5-Air=60000"
+    TOOL_RESULT_MAX_TOKENS: int = int(os.getenv("TOOL_RESULT_MAX_TOKENS", "0"))  # 单条工具结果的估算 token 上限，超出时截去中间部分，0 表示不截断
     SKIP_AUTH_TOKEN: bool = os.getenv("SKIP_AUTH_TOKEN", "false").lower() == "true"
     
     # Upstream/Deployment Configuration
     # UPSTREAM_TYPE: zai 使用站点流; openai 使用标准OpenAI兼容流（官方2API）
     UPSTREAM_TYPE: str = os.getenv("UPSTREAM_TYPE", "zai").lower()
+    OPENAI_PASSTHROUGH: bool = os.getenv("OPENAI_PASSTHROUGH", "false").lower() == "true"  # openai 上游：原样转发响应字节，仅改写 model 字段
     # Render Deployment Configuration - 已移除USE_DOWNSTREAM_KEYS，改为基于key格式自动检测
     RENDER_DEPLOYMENT: bool = os.getenv("RENDER_DEPLOYMENT", "true").lower() == "true"
     
+    # Upstream Connection Configuration
+    UPSTREAM_POOL_SIZE: int = int(os.getenv("UPSTREAM_POOL_SIZE", "64"))  # 每个上游主机保持的最大连接数
+    UPSTREAM_CONNECT_TIMEOUT: float = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "10"))  # 建立上游连接的上限（秒），0 表示不限制
+    UPSTREAM_FIRST_BYTE_TIMEOUT: float = float(os.getenv("UPSTREAM_FIRST_BYTE_TIMEOUT", "60"))  # 发出请求到读到首块响应的上限（秒）
+    UPSTREAM_IDLE_TIMEOUT: float = float(os.getenv("UPSTREAM_IDLE_TIMEOUT", "60"))  # 响应中相邻两块数据的最大间隔（秒）
+    UPSTREAM_TOTAL_TIMEOUT: float = float(os.getenv("UPSTREAM_TOTAL_TIMEOUT", "0"))  # 单个请求的总时长上限（秒），客户端可用 X-Request-Timeout 缩短
+    UPSTREAM_RETRIES: int = int(os.getenv("UPSTREAM_RETRIES", "1"))  # 首字节之前失败时换 token / 端点重试的次数
+    UPSTREAM_FALLBACK_ENDPOINTS: str = os.getenv("UPSTREAM_FALLBACK_ENDPOINTS", "")  # 重试时依次使用的备用上游端点，逗号分隔
+    MESSAGE_CACHE_MAX_BYTES: int = int(os.getenv("MESSAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # 已编码消息前缀缓存上限（字节），0 表示关闭
+    STREAM_REPLAY_MAX_BYTES: int = int(os.getenv("STREAM_REPLAY_MAX_BYTES", "0"))  # 可接续流的重放缓冲区合计上限（字节），0 表示关闭
+    STREAM_REPLAY_STREAM_BYTES: int = int(os.getenv("STREAM_REPLAY_STREAM_BYTES", str(1024 * 1024)))  # 单个流保留的事件字节数上限
+    STREAM_REPLAY_TTL: float = float(os.getenv("STREAM_REPLAY_TTL", "60"))  # 流结束后保留重放缓冲区的秒数
+    READ_AHEAD_BYTES: int = int(os.getenv("READ_AHEAD_BYTES", str(1024 * 1024)))  # 每个流预读上游的缓冲上限（字节），0 表示不预读
+    READ_AHEAD_OVERFLOW: str = os.getenv("READ_AHEAD_OVERFLOW", "drop").lower()  # drop: 断开慢客户端；spill: 溢出部分写入临时文件
+    READ_AHEAD_SPILL_DIR: str = os.getenv("READ_AHEAD_SPILL_DIR", "")  # 溢出文件目录，为空时使用系统临时目录
+    DEGRADE_TTFT_SLO: float = float(os.getenv("DEGRADE_TTFT_SLO", "0"))  # 首字节时间平均值超过该秒数时降级模型，0 表示关闭
+    DEGRADE_MODELS: str = os.getenv("DEGRADE_MODELS", f"{THINKING_MODEL}={PRIMARY_MODEL},{SEARCH_MODEL}={PRIMARY_MODEL},{PRIMARY_MODEL}={AIR_MODEL}")  # 降级时的替代模型
+    DEGRADE_PROBE_INTERVAL: float = float(os.getenv("DEGRADE_PROBE_INTERVAL", "30"))  # 降级期间使用原模型探测的间隔（秒）
+    HEARTBEAT_INTERVAL: float = float(os.getenv("HEARTBEAT_INTERVAL", "15"))  # 流式响应无输出超过该秒数时发送 ": ping"，0 表示关闭
+    ANON_TOKEN_POOL_SIZE: int = int(os.getenv("ANON_TOKEN_POOL_SIZE", "0"))  # 预取的匿名token数量，0 表示按请求获取
+    ANON_TOKEN_TTL: float = float(os.getenv("ANON_TOKEN_TTL", "300"))  # 预取token的有效期（秒）
+    
+    # Shared State Configuration
+    # SHARED_STATE_BACKEND: auto 多 worker 时使用 sqlite、单 worker 时使用 memory; memory 进程内; sqlite 同主机多进程共享
+    SHARED_STATE_BACKEND: str = os.getenv("SHARED_STATE_BACKEND", "auto").lower()
+    SHARED_STATE_PATH: str = os.getenv("SHARED_STATE_PATH", "")  # 为空时使用 /dev/shm/zai2api-<端口>.db
+    RATE_LIMIT_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_PER_MINUTE", "0"))  # 每个下游key每分钟的请求上限，0 表示不限制
+    
+    # Batch Configuration
+    BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", "16"))  # 每个批量任务同时进行的上游请求数（不超过 UPSTREAM_POOL_SIZE）
+    BATCH_RESULTS_DIR: str = os.getenv("BATCH_RESULTS_DIR", "")  # 非空时保存批量结果，支持按 batch_id 续跑
+    
+    # Scheduler Configuration
+    UPSTREAM_CONCURRENCY: int = int(os.getenv("UPSTREAM_CONCURRENCY", "0"))  # 每个 worker 同时进行的上游请求上限，0 表示不排队
+    SCHEDULER_WEIGHTS: str = os.getenv("SCHEDULER_WEIGHTS", "interactive=8,batch=1")  # 各流量类别的调度权重
+    SCHEDULER_KEY_CLASSES: str = os.getenv("SCHEDULER_KEY_CLASSES", "")  # 为下游key指定类别，如 "sk-eval=batch"，未指定的为 interactive
+    UPSTREAM_QUEUE_TIMEOUT: float = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "60"))  # 排队等待上限（秒），超时返回 503
+    
+    # Startup Configuration
+    # WARMUP_MODE: background 启动后后台预热; blocking 预热完成后才就绪; off 不预热
+    WARMUP_MODE: str = os.getenv("WARMUP_MODE", "background").lower()
+    WARM_STATE_FILE: str = os.getenv("WARM_STATE_FILE", "")  # 非空时在退出时保存、启动时恢复预热状态
+    
+    # Header Profile Configuration
+    # HEADER_PROFILE_SOURCE: fake_useragent 启动时从 fake_useragent 数据构建; snapshot 使用内置快照; 其他值视为快照文件路径
+    HEADER_PROFILE_SOURCE: str = os.getenv("HEADER_PROFILE_SOURCE", "fake_useragent")
+    HEADER_PROFILE_COUNT: int = int(os.getenv("HEADER_PROFILE_COUNT", "64"))
+    
+    # Benchmark Configuration
+    # RECORD_DIR: 非空时将上游请求与原始SSE字节流录制到该目录，供 benchmarks.replay_server 回放
+    RECORD_DIR: str = os.getenv("RECORD_DIR", "")
+    
     # Browser Headers
     CLIENT_HEADERS: Dict[str, str] = {
         "Content-Type": "application/json",
@@ -48,7 +118,8 @@ class Settings(BaseSettings):
         "sec-ch-ua-mobile": "?0",
         "sec-ch-ua-platform": '"Windows"',
         "X-FE-Version": "prod-fe-1.0.70",
-        "Origin": "https://chat.z.ai",
+        # 站点 Origin，同时作为匿名token端点 {Origin}/api/v1/auths/ 的基址（压测时可指向本地模拟上游）
+        "Origin": os.getenv("ZAI_ORIGIN", "https://chat.z.ai"),
     }
     
     class Config:
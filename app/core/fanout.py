@@ -0,0 +1,138 @@
+"""
+Parallel fan-out for n > 1
+
+请求 n 个候选回答时并发发起 n 个上游请求（各自独立的 chat_id 与 token），
+总耗时接近最慢的单个候选，而不是 n 个之和。端点在开始前一次申请全部 n 个调度名额，
+候选线程不再单独排队，避免持有部分名额互相等待。
+- 流式：各候选的数据块按到达顺序合并到同一个 SSE 响应，choices[].index 标明候选序号，
+  最后只发送一次 [DONE]
+- 非流式：等待全部候选完成后合并为一个响应，usage 为各候选之和
+"""
+
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Generator, List
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from app.core.config import settings
+from app.core.response_handlers import ResponseHandler, create_openai_response_chunk
+from app.models.schemas import Delta
+from app.utils.helpers import debug_log
+
+_DONE = "data: [DONE]\n\n"
+_FINISHED = object()
+
+
+class FanOut:
+    """Runs the n choices of one request concurrently
+
+    first: 端点中已准备好的第 0 个候选（全部候选的调度名额由端点管理）
+    prepare: 按候选序号准备其余候选，在各自的线程中调用
+    """
+
+    def __init__(self, n: int, first: Any, prepare: Callable[[int], Any]):
+        self.n = n
+        self.first = first
+        self.prepare = prepare
+        self.aborted = False
+        self._handlers: List[ResponseHandler] = []
+        self._lock = threading.Lock()
+
+    def _prepare(self, index: int) -> Any:
+        if index == 0:
+            return self.first
+        prepared = self.prepare(index)
+        # 所有候选属于同一个响应，共用一个 id
+        prepared.completion_id = self.first.completion_id
+        return prepared
+
+    def _register(self, handler: ResponseHandler) -> bool:
+        with self._lock:
+            if self.aborted:
+                return False
+            self._handlers.append(handler)
+            return True
+
+    def abort(self) -> None:
+        """Abort every choice still streaming from upstream"""
+        with self._lock:
+            self.aborted = True
+            handlers = list(self._handlers)
+        for handler in handlers:
+            handler.abort()
+
+    def _run_stream(self, index: int, out: "queue.Queue") -> None:
+        try:
+            prepared = self._prepare(index)
+            handler = prepared.stream_handler()
+            # 合并时需要改写 choices[].index
+            handler.passthrough = False
+            if not self._register(handler):
+                return
+            for line in handler.handle():
+                if self.aborted:
+                    break
+                if line != _DONE:
+                    out.put(line)
+        except Exception as e:
+            message = e.detail if isinstance(e, HTTPException) else str(e)
+            debug_log(f"候选 {index} 失败: {message}")
+            error_chunk = create_openai_response_chunk(
+                model=settings.PRIMARY_MODEL,
+                delta=Delta(content=f"Error: {message}"),
+                finish_reason="stop",
+                index=index,
+                id=self.first.completion_id
+            )
+            out.put(f"data: {error_chunk.model_dump_json()}\n\n")
+        finally:
+            out.put(_FINISHED)
+
+    def stream(self) -> Generator[str, None, None]:
+        """Merged SSE stream of all choices, ending with a single [DONE]"""
+        out: "queue.Queue" = queue.Queue()
+        for index in range(self.n):
+            threading.Thread(target=self._run_stream, args=(index, out), name=f"fanout-{index}", daemon=True).start()
+        remaining = self.n
+        try:
+            while remaining:
+                item = out.get()
+                if item is _FINISHED:
+                    remaining -= 1
+                    continue
+                yield item
+            yield _DONE
+        finally:
+            if remaining:
+                # 客户端断开：中断仍在进行的候选
+                self.abort()
+
+    def _run_once(self, index: int) -> Dict[str, Any]:
+        handler = self._prepare(index).non_stream_handler()
+        if not self._register(handler):
+            raise HTTPException(status_code=503, detail="Request aborted")
+        return json.loads(handler.handle().body)
+
+    def complete(self) -> JSONResponse:
+        """Wait for every choice and merge them into one response"""
+        with ThreadPoolExecutor(max_workers=self.n, thread_name_prefix="fanout") as pool:
+            futures = [pool.submit(self._run_once, index) for index in range(self.n)]
+            try:
+                bodies = [future.result() for future in futures]
+            except Exception:
+                self.abort()
+                raise
+        merged = bodies[0]
+        merged["choices"] = [dict(body["choices"][0], index=index) for index, body in enumerate(bodies)]
+        usages = [body.get("usage") for body in bodies if body.get("usage")]
+        if usages:
+            merged["usage"] = {
+                key: sum(usage.get(key) or 0 for usage in usages)
+                for key in usages[0]
+                if isinstance(usages[0][key], int)
+            }
+        return JSONResponse(content=merged)
@@ -0,0 +1,55 @@
+"""
+Health check endpoints
+"""
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.core.lifecycle import drain_controller
+from app.core.resumable import get_replay_registry
+from app.core.routing import get_model_router
+from app.core.scheduler import get_scheduler
+
+router = APIRouter()
+
+
+@router.get("/health/live")
+async def live():
+    """Liveness: the process is running"""
+    return {"status": "ok"}
+
+
+@router.get("/health/ready")
+async def ready():
+    """Readiness: 503 while draining so load balancers stop routing here"""
+    status = drain_controller.status()
+    if status["draining"]:
+        return JSONResponse(status_code=503, content={"status": "draining", **status})
+    return {"status": "ok", **status}
+
+
+@router.get("/health/scheduler")
+async def scheduler_status():
+    """Upstream queue: slots in use, queued requests and wait times per traffic class"""
+    scheduler = get_scheduler()
+    if scheduler is None:
+        return {"enabled": False}
+    return {"enabled": True, **scheduler.stats()}
+
+
+@router.get("/health/streams")
+async def stream_replay_status():
+    """Replay buffers of resumable streams: count, bytes, resumes and evictions"""
+    registry = get_replay_registry()
+    if registry is None:
+        return {"enabled": False}
+    return {"enabled": True, **registry.stats()}
+
+
+@router.get("/health/routing")
+async def routing_status():
+    """Model degradation: routes past the TTFT SLO, substitutions and recoveries per model"""
+    model_router = get_model_router()
+    if model_router is None:
+        return {"enabled": False}
+    return {"enabled": True, **model_router.stats()}
@@ -0,0 +1,56 @@
+"""
+SSE keep-alive heartbeats
+
+GLM-4.5-Thinking / GLM-4.5-Search 在思考与搜索阶段可能几十秒没有客户端可见的输出
+（THINKING_PROCESSING=strip 时更明显），中间代理会关闭空闲连接，客户端重试又让上游负载翻倍。
+这里在流超过 HEARTBEAT_INTERVAL 秒没有输出时写入 SSE 注释帧 ": ping"，客户端会忽略它。
+
+所有流共用一个时间轮（app/utils/timer_wheel.py），每个流只有一个待触发的定时器，
+有输出时不重新调度，触发时按最近一次输出的时间决定发送心跳还是推迟。
+心跳写入流的预读或重放缓冲区，两者都关闭时不发送心跳。
+"""
+
+from typing import Optional
+
+from app.core.config import settings
+from app.utils.timer_wheel import Timer, get_timer_wheel
+
+PING = ": ping\n\n"
+
+
+class Heartbeat:
+    """Keep-alive for one buffered stream
+
+    target 需要提供 idle_for()（距最近一次输出的秒数）、ping() 与 done（流已结束或客户端已断开）。
+    """
+
+    def __init__(self, target, interval: float):
+        self.target = target
+        self.interval = interval
+        self.sent = 0
+        self._timer: Optional[Timer] = None
+
+    def start(self) -> "Heartbeat":
+        self._timer = get_timer_wheel().schedule(self.interval, self._fire)
+        return self
+
+    def _fire(self) -> None:
+        if self.target.done:
+            return
+        idle = self.target.idle_for()
+        if idle >= self.interval:
+            self.target.ping()
+            self.sent += 1
+            idle = 0.0
+        self._timer = get_timer_wheel().schedule(self.interval - idle, self._fire)
+
+    def stop(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+def start_heartbeat(target) -> Optional[Heartbeat]:
+    """Start heartbeats for a stream buffer; None when HEARTBEAT_INTERVAL is 0"""
+    if settings.HEARTBEAT_INTERVAL <= 0:
+        return None
+    return Heartbeat(target, settings.HEARTBEAT_INTERVAL).start()
@@ -0,0 +1,167 @@
+"""
+Graceful drain for long-lived streams
+
+收到 SIGTERM 后进入排空（drain）模式：
+1. /health/ready 返回 503，新的 /v1 请求返回 503（Retry-After），DRAIN_GRACE 秒后停止接受新连接
+2. 进行中的流式响应继续输出，直到全部完成或到达 DRAIN_TIMEOUT
+3. 到达期限仍未完成的流被强制关闭（中断上游连接），并报告强制关闭的数量
+再次收到 SIGINT/SIGTERM 时立即退出。
+
+serve.py 为 worker 分配的私有 Unix socket 在排空期间保持监听，其他 worker 转发来的断线重连
+仍可接续本 worker 重放缓冲区中的流（见 app.core.resumable）。
+"""
+
+import asyncio
+import itertools
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional
+
+import uvicorn
+
+from app.core.config import settings
+from app.utils.helpers import debug_log
+
+
+class DrainController:
+    """Track in-flight streams and coordinate draining"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._active: Dict[int, Callable[[], None]] = {}
+        self.draining = False
+        self.drain_started_at: Optional[float] = None
+        self.force_closed = 0
+
+    def start_drain(self) -> None:
+        with self._lock:
+            if not self.draining:
+                self.draining = True
+                self.drain_started_at = time.time()
+
+    def active_count(self) -> int:
+        with self._lock:
+            return len(self._active)
+
+    def track(self, stream: Iterable[str], abort: Callable[[], None]) -> Generator[str, None, None]:
+        """Wrap a response stream so it counts as in flight until it finishes"""
+        stream_id = next(self._ids)
+        with self._lock:
+            self._active[stream_id] = abort
+        try:
+            yield from stream
+        finally:
+            with self._lock:
+                self._active.pop(stream_id, None)
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Wait until no stream is in flight; False if the timeout expired first"""
+        deadline = time.monotonic() + timeout
+        while self.active_count() > 0:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.1)
+        return True
+
+    def force_close(self) -> int:
+        """Abort every stream still in flight; returns how many were aborted"""
+        with self._lock:
+            aborts: List[Callable[[], None]] = list(self._active.values())
+        for abort in aborts:
+            try:
+                abort()
+            except Exception as e:
+                debug_log(f"强制关闭流失败: {e}")
+        self.force_closed += len(aborts)
+        return len(aborts)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "draining": self.draining,
+            "active_streams": self.active_count(),
+            "force_closed_streams": self.force_closed,
+        }
+
+
+drain_controller = DrainController()
+
+_DRAINING_BODY = b'{"error":{"message":"Server is draining, retry shortly","type":"server_draining"}}'
+
+
+def _is_forwarded_resume(scope) -> bool:
+    # 经 Unix socket 到达（无 TCP 地址）且带 Last-Event-ID 的请求来自其他 worker 的转发
+    return scope.get("server") is None and any(name == b"last-event-id" for name, _ in scope["headers"])
+
+
+def _is_private_listener(server) -> bool:
+    return all(sock.family == socket.AF_UNIX for sock in server.sockets or ())
+
+
+class DrainMiddleware:
+    """ASGI middleware refusing new /v1 requests while draining (503 + Retry-After)
+
+    纯 ASGI 实现，不包装流式响应，正常情况下只多一次属性判断。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] == "http" and drain_controller.draining and scope["path"].startswith("/v1/")
+                and not _is_forwarded_resume(scope)):
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(_DRAINING_BODY)).encode()),
+                    (b"retry-after", b"1"),
+                    (b"connection", b"close"),
+                ],
+            })
+            await send({"type": "http.response.body", "body": _DRAINING_BODY})
+            return
+        await self.app(scope, receive, send)
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that drains in-flight streams before shutting down"""
+
+    def __init__(self, config: uvicorn.Config, ready=None):
+        super().__init__(config)
+        self._drain_task: Optional[asyncio.Future] = None
+        # serve.py 传入的 multiprocessing.Event，开始接受连接后置位
+        self.ready = ready
+
+    async def startup(self, sockets=None) -> None:
+        await super().startup(sockets=sockets)
+        if self.started and self.ready is not None:
+            self.ready.set()
+
+    def handle_exit(self, sig, frame) -> None:
+        if self._drain_task is None and not self.should_exit:
+            self._drain_task = asyncio.ensure_future(self._drain())
+            return
+        # 排空期间再次收到信号：立即退出
+        self.should_exit = True
+        self.force_exit = True
+
+    async def _drain(self) -> None:
+        drain_controller.start_drain()
+        print(f"[DRAIN] 开始排空，进行中的流: {drain_controller.active_count()}")
+
+        # 给负载均衡留出感知 /health/ready 变化的时间
+        if settings.DRAIN_GRACE > 0:
+            await asyncio.sleep(settings.DRAIN_GRACE)
+        for server in getattr(self, "servers", []):
+            if not _is_private_listener(server):
+                server.close()
+
+        if not await drain_controller.wait_idle(settings.DRAIN_TIMEOUT):
+            forced = drain_controller.force_close()
+            print(f"[DRAIN] 到达排空期限 {settings.DRAIN_TIMEOUT}s，强制关闭 {forced} 个流")
+        else:
+            print("[DRAIN] 所有流已完成")
+        self.should_exit = True
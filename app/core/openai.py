@@ -3,19 +3,25 @@ OpenAI API endpoints
 """
 
 import time
-from datetime import datetime
-from typing import List, Optional
+from typing import Callable, Dict, Iterable, Optional
 from fastapi import APIRouter, Header, HTTPException
 from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 from app.core.config import settings
-from app.models.schemas import (
-    OpenAIRequest, Message, UpstreamRequest, ModelItem, 
-    ModelsResponse, Model
-)
-from app.utils.helpers import debug_log, generate_request_ids, get_auth_token
-from app.utils.tools import process_messages_with_tools, content_to_string
-from app.core.response_handlers import StreamResponseHandler, NonStreamResponseHandler
+from app.models.schemas import OpenAIRequest, ModelsResponse, Model
+from app.utils.helpers import check_rate_limit, debug_log, generate_request_ids, get_auth_token, is_special_key_format
+from app.utils.context_window import apply_context_window
+from app.utils.deadlines import request_deadline
+from app.utils.ids import completion_id
+from app.utils.upstream_builder import build_upstream_payload, request_toolset
+from app.core.response_handlers import ResponseHandler, StreamResponseHandler, NonStreamResponseHandler
+from app.core.lifecycle import drain_controller
+from app.core.scheduler import Slot, acquire_upstream_slot
+from app.core.resumable import forward_resume, get_replay_registry, resume_owner, resume_stream
+from app.core.read_ahead import read_ahead
+from app.core.fanout import FanOut
+from app.core.routing import Route, route_model
 
 router = APIRouter()
 
@@ -51,142 +57,209 @@ async def list_models():
     return response
 
 
+class PreparedCompletion:
+    """A validated chat completion request, converted and ready to send upstream"""
+    
+    def __init__(self, request: OpenAIRequest, downstream_key: Optional[str], choice_index: int = 0,
+                 deadline: Optional[float] = None, route: Optional[Route] = None):
+        self.downstream_key = downstream_key
+        self.choice_index = choice_index
+        self.deadline = deadline
+        self.chat_id, self.msg_id = generate_request_ids()
+        # 返回给客户端的 chatcmpl- id；n > 1 时各候选沿用第一个候选的 id
+        self.completion_id = completion_id()
+        self.extra_headers: Dict[str, str] = {}
+        
+        # 上游首字节时间超出 SLO 时改用替代模型；n > 1 的各候选沿用同一个决策
+        self.route = route if route is not None else route_model(downstream_key, request.model)
+        if self.route is not None and self.route.substituted:
+            debug_log(f"模型 {request.model} 已降级，改用 {self.route.model}")
+            request = request.model_copy(update={"model": self.route.model})
+            self.extra_headers.update(self.route.headers())
+        
+        # 按模型的 token 预算裁剪过长的历史
+        request, window = apply_context_window(request)
+        self.request = request
+        
+        # 一次遍历直接生成上游请求体字节
+        toolset = request_toolset(request)
+        self.upstream_body = build_upstream_payload(request, self.chat_id, self.msg_id, toolset)
+        
+        # 报告本次注入的工具提示词大小与历史裁剪量，便于在提示词长度与延迟之间取舍
+        if window is not None:
+            self.extra_headers.update(window.headers())
+            if window.trimmed:
+                debug_log(f"上下文裁剪: 丢弃 {window.dropped_messages} 条消息，截断 {window.truncated_messages} 条工具结果，"
+                          f"约 {window.tokens_before} → {window.tokens_after} tokens (预算 {window.budget})")
+        if toolset is not None:
+            tool_prompt_chars = len(toolset.prompt())
+            self.extra_headers["X-Tool-Prompt-Chars"] = str(tool_prompt_chars)
+            debug_log(f"工具集 {toolset.id}: {len(toolset.names)} 个函数，注入提示词 {tool_prompt_chars} 字符 ({settings.TOOL_PROMPT_MODE})")
+        
+        # Get authentication token (pass downstream_key if available)
+        self.auth_token = get_auth_token(downstream_key)
+        
+        # Check if tools are enabled and present
+        self.has_tools = bool(settings.TOOL_SUPPORT and 
+                              request.tools and 
+                              len(request.tools) > 0 and 
+                              request.tool_choice != "none")
+    
+    def _handler_args(self) -> tuple:
+        return (self.upstream_body, self.chat_id, self.auth_token, self.has_tools, self.downstream_key,
+                self.request.max_tokens, self.request.stop, self.deadline)
+    
+    def _attach(self, handler: ResponseHandler) -> None:
+        handler.route = self.route
+        handler.completion_id = self.completion_id
+    
+    def stream_handler(self) -> StreamResponseHandler:
+        handler = StreamResponseHandler(*self._handler_args())
+        handler.choice_index = self.choice_index
+        self._attach(handler)
+        return handler
+    
+    def non_stream_handler(self) -> NonStreamResponseHandler:
+        handler = NonStreamResponseHandler(*self._handler_args())
+        self._attach(handler)
+        return handler
+
+
+def _sse_response(stream: Iterable[str], headers: Dict[str, str]) -> StreamingResponse:
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            **headers,
+        }
+    )
+
+
+def stream_response(stream: Iterable[str], abort: Callable[[], None], slot: Optional[Slot],
+                    downstream_key: Optional[str], headers: Dict[str, str]) -> StreamingResponse:
+    """SSE response for a handler stream, which holds the upstream slot until it ends"""
+    stream = drain_controller.track(stream, abort)
+    if slot is not None:
+        stream = slot.hold(stream)
+    registry = get_replay_registry()
+    if registry is not None:
+        # 上游由后台线程读入重放缓冲区，客户端断开后仍可凭 Last-Event-ID 接续
+        buffer = registry.start(stream, downstream_key)
+        return _sse_response(buffer.read(), {**headers, "X-Stream-Id": buffer.stream_id})
+    # 上游由后台线程全速读入有界缓冲区，慢客户端不再拖住上游连接
+    return _sse_response(read_ahead(stream, abort), headers)
+
+
+def authorize(authorization: str, rate_limit: bool = True) -> Optional[str]:
+    """Validate the Authorization header; returns the downstream key (if any)
+
+    rate_limit=False 时不计入 RATE_LIMIT_PER_MINUTE，由调用方自行计数（如批量补全按条目计数）。
+    """
+    # 提取下游key
+    downstream_key = None
+    if authorization.startswith("Bearer "):
+        downstream_key = authorization[7:]  # 去掉"Bearer "前缀
+        debug_log(f"提取到key: {downstream_key[:10]}...")
+    
+    # 验证API key（如果SKIP_AUTH_TOKEN未启用且不是特殊格式key）
+    if not settings.SKIP_AUTH_TOKEN:
+        if not authorization.startswith("Bearer "):
+            debug_log("缺少或无效的Authorization头")
+            raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
+        
+        # 检查是否为特殊格式key，如果不是则验证固定token
+        if not is_special_key_format(downstream_key):
+            if downstream_key != settings.AUTH_TOKEN:
+                debug_log(f"无效的API key: {downstream_key}")
+                raise HTTPException(status_code=401, detail="Invalid API key")
+            debug_log(f"API key验证通过，AUTH_TOKEN={downstream_key[:8]}......")
+        else:
+            debug_log(f"检测到特殊格式key，跳过固定token验证: {downstream_key[:10]}...")
+    else:
+        debug_log("SKIP_AUTH_TOKEN已启用，跳过API key验证")
+    
+    retry_after = check_rate_limit(downstream_key) if rate_limit else 0
+    if retry_after:
+        debug_log(f"超出速率限制，{retry_after}s 后重试")
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(retry_after)},
+        )
+    return downstream_key
+
+
 @router.post("/v1/chat/completions")
 async def chat_completions(
     request: OpenAIRequest,
-    authorization: str = Header(...)
+    authorization: str = Header(...),
+    x_priority: Optional[str] = Header(None),
+    last_event_id: Optional[str] = Header(None),
+    x_request_timeout: Optional[str] = Header(None),
 ):
     """Handle chat completion requests"""
     debug_log("收到chat completions请求")
+    # 总截止时间从收到请求开始计算，包含排队时间
+    deadline = request_deadline(x_request_timeout)
     
+    slot = None
+    streaming = False
     try:
-        # 提取下游key
-        downstream_key = None
-        if authorization.startswith("Bearer "):
-            downstream_key = authorization[7:]  # 去掉"Bearer "前缀
-            debug_log(f"提取到key: {downstream_key[:10]}...")
-        
-        # 验证API key（如果SKIP_AUTH_TOKEN未启用且不是特殊格式key）
-        if not settings.SKIP_AUTH_TOKEN:
-            if not authorization.startswith("Bearer "):
-                debug_log("缺少或无效的Authorization头")
-                raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
-            
-            # 检查是否为特殊格式key，如果不是则验证固定token
-            from app.utils.helpers import is_special_key_format
-            if not is_special_key_format(downstream_key):
-                if downstream_key != settings.AUTH_TOKEN:
-                    debug_log(f"无效的API key: {downstream_key}")
-                    raise HTTPException(status_code=401, detail="Invalid API key")
-                debug_log(f"API key验证通过，AUTH_TOKEN={downstream_key[:8]}......")
-            else:
-                debug_log(f"检测到特殊格式key，跳过固定token验证: {downstream_key[:10]}...")
-        else:
-            debug_log("SKIP_AUTH_TOKEN已启用，跳过API key验证")
+        # 断线重连落到了其他 worker：转给持有缓冲区的 worker，由它认证与计数
+        if last_event_id and request.stream and get_replay_registry() is not None:
+            owner = resume_owner(last_event_id)
+            if owner is not None:
+                debug_log(f"流 {last_event_id} 属于其他 worker，转发接续请求")
+                body = request.model_dump_json(exclude_none=True).encode("utf-8")
+                headers = {"Authorization": authorization, "Last-Event-ID": last_event_id}
+                return await run_in_threadpool(forward_resume, owner, body, headers)
         
-        debug_log(f"请求解析成功 - 模型: {request.model}, 流式: {request.stream}, 消息数: {len(request.messages)}")
+        downstream_key = authorize(authorization)
         
-        # Generate IDs
-        chat_id, msg_id = generate_request_ids()
+        # 断线重连：从重放缓冲区接续原来的流，不再请求上游
+        if last_event_id and request.stream:
+            resumed = resume_stream(last_event_id, downstream_key)
+            if resumed is not None:
+                buffer, after = resumed
+                debug_log(f"接续流 {buffer.stream_id}，从第 {after + 1} 个事件开始")
+                return _sse_response(buffer.read(after), {"X-Stream-Id": buffer.stream_id})
         
-        # Process messages with tools
-        processed_messages = process_messages_with_tools(
-            [m.model_dump() for m in request.messages],
-            request.tools,
-            request.tool_choice
-        )
-        
-        # Convert back to Message objects
-        upstream_messages: List[Message] = []
-        for msg in processed_messages:
-            content = content_to_string(msg.get("content"))
-            
-            upstream_messages.append(Message(
-                role=msg["role"],
-                content=content,
-                reasoning_content=msg.get("reasoning_content")
-            ))
+        debug_log(f"请求解析成功 - 模型: {request.model}, 流式: {request.stream}, 消息数: {len(request.messages)}")
         
-        # Determine model features
-        is_thinking = request.model == settings.THINKING_MODEL
-        is_search = request.model == settings.SEARCH_MODEL
-        is_air = request.model == settings.AIR_MODEL
-        search_mcp = "deep-web-search" if is_search else ""
+        n = 1 if request.n is None else request.n
+        if not 1 <= n <= settings.MAX_CHOICES:
+            raise HTTPException(status_code=400, detail=f"n must be between 1 and {settings.MAX_CHOICES}")
         
-        # Determine upstream model based on requested model
-        if is_air:
-            upstream_model_id = "0727-106B-API"  # for zai upstream
-            upstream_model_name = "GLM-4.5-Air"  # for openai upstream
-        else:
-            upstream_model_id = "0727-360B-API"
-            upstream_model_name = "GLM-4.5"
-
-        # Build upstream request by mode
-        if settings.UPSTREAM_TYPE == "openai":
-            # 官方 OpenAI 兼容上游所需最小字段
-            upstream_req = {
-                "model": upstream_model_name,
-                "messages": [m.model_dump(exclude_none=True) for m in upstream_messages],
-                "stream": bool(request.stream),
-            }
-            if request.tools:
-                upstream_req["tools"] = request.tools
-            if request.tool_choice is not None:
-                upstream_req["tool_choice"] = request.tool_choice
-        else:
-            upstream_req = UpstreamRequest(
-                stream=True,  # Always use streaming from zai upstream
-                chat_id=chat_id,
-                id=msg_id,
-                model=upstream_model_id,  # Dynamic upstream model ID
-                messages=upstream_messages,
-                params={},
-                features={
-                    "enable_thinking": is_thinking,
-                    "web_search": is_search,
-                    "auto_web_search": is_search,
-                },
-                background_tasks={
-                    "title_generation": False,
-                    "tags_generation": False,
-                },
-                mcp_servers=[search_mcp] if search_mcp else [],
-                model_item=ModelItem(
-                    id=upstream_model_id,
-                    name=upstream_model_name,
-                    owned_by="openai"
-                ),
-                tool_servers=[],
-                variables={
-                    "{{USER_NAME}}": "User",
-                    "{{USER_LOCATION}}": "Unknown",
-                    "{{CURRENT_DATETIME}}": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                }
-            )
+        # 上游并发已满时按类别加权公平排队；n > 1 时一次申请全部候选的名额
+        slot = await acquire_upstream_slot(downstream_key, x_priority, n)
         
-        # Get authentication token (pass downstream_key if available)
-        auth_token = get_auth_token(downstream_key)
+        prepared = PreparedCompletion(request, downstream_key, deadline=deadline)
+        if slot is not None:
+            prepared.extra_headers.update(slot.headers())
         
-        # Check if tools are enabled and present
-        has_tools = (settings.TOOL_SUPPORT and 
-                    request.tools and 
-                    len(request.tools) > 0 and 
-                    request.tool_choice != "none")
+        if n > 1:
+            # 多个候选并发请求上游，其余候选在各自的线程中准备并取 token
+            fanout = FanOut(n, prepared, lambda index: PreparedCompletion(request, downstream_key, index, deadline, prepared.route))
+            if request.stream:
+                streaming = True
+                return stream_response(fanout.stream(), fanout.abort, slot, downstream_key, prepared.extra_headers)
+            response = await run_in_threadpool(fanout.complete)
+            response.headers.update(prepared.extra_headers)
+            return response
         
         # Handle response based on stream flag
         if request.stream:
-            handler = StreamResponseHandler(upstream_req, chat_id, auth_token, has_tools, downstream_key)
-            return StreamingResponse(
-                handler.handle(),
-                media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                }
-            )
+            handler = prepared.stream_handler()
+            streaming = True
+            return stream_response(handler.handle(), handler.abort, slot, downstream_key, prepared.extra_headers)
         else:
-            handler = NonStreamResponseHandler(upstream_req, chat_id, auth_token, has_tools, downstream_key)
-            return handler.handle()
+            handler = prepared.non_stream_handler()
+            # 在线程池中等待上游，不阻塞事件循环
+            response = await run_in_threadpool(handler.handle)
+            response.headers.update(prepared.extra_headers)
+            return response
             
     except HTTPException:
         raise
@@ -195,3 +268,6 @@ async def chat_completions(
         import traceback
         debug_log(f"错误堆栈: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    finally:
+        if slot is not None and not streaming:
+            slot.release()
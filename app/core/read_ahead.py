@@ -0,0 +1,176 @@
+"""
+Read-ahead buffer between the upstream stream and a slow client
+
+流式响应原本只有在客户端取走上一个事件后才读取下一个上游事件，慢客户端会让上游连接与 token
+占用更久，上游也可能因此中断。这里由后台线程全速读取上游，写入每个流的有界缓冲区，
+客户端从缓冲区读取：
+- 合并：客户端落后时一次取走所有已缓冲的事件，合并成一次写入
+- 超出 READ_AHEAD_BYTES 时按 READ_AHEAD_OVERFLOW 处理：
+  drop  中断上游，客户端收完已缓冲的事件后断开
+  spill 之后的事件写入临时文件（READ_AHEAD_SPILL_DIR，为空时使用系统临时目录），
+        客户端读完内存中的事件后再读文件，顺序不变
+- 客户端断开时中断上游
+- 超过 HEARTBEAT_INTERVAL 秒没有事件时插入 ": ping" 注释帧（见 app/core/heartbeat.py）
+"""
+
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Generator, Iterable, Optional, Union
+
+from app.core.config import settings
+from app.core.heartbeat import PING, start_heartbeat
+from app.utils.helpers import debug_log
+
+# 从溢出文件单次读取的最大字节数
+_SPILL_READ_BYTES = 256 * 1024
+
+
+class ReadAheadBuffer:
+    """Drains a stream on a producer thread into a bounded buffer the client reads from"""
+
+    def __init__(self, source: Iterable[Union[str, bytes]], abort: Callable[[], None], max_bytes: int,
+                 overflow: str = "drop", spill_dir: Optional[str] = None):
+        self.source = source
+        self.abort = abort
+        self.max_bytes = max_bytes
+        self.overflow = overflow
+        self.spill_dir = spill_dir
+        self.size = 0
+        self.peak = 0
+        self.spilled = 0
+        self.finished = False
+        self.closed = False
+        self.overflowed = False
+        self.heartbeat = None
+        self._events: Deque[bytes] = deque()
+        self._spill = None
+        self._spill_read = 0
+        self._spill_write = 0
+        self.last_output = time.monotonic()
+        self._cond = threading.Condition()
+
+    def start(self) -> "ReadAheadBuffer":
+        threading.Thread(target=self._produce, name="read-ahead", daemon=True).start()
+        self.heartbeat = start_heartbeat(self)
+        return self
+
+    def _put(self, data: bytes) -> bool:
+        """Buffer one event; False when the stream must stop"""
+        with self._cond:
+            if self.closed:
+                return False
+            # 溢出文件中还有未读数据时继续写文件，保持事件顺序
+            spilling = self._spill_write > self._spill_read
+            if not spilling and self.size + len(data) <= self.max_bytes:
+                self._events.append(data)
+                self.size += len(data)
+                self.peak = max(self.peak, self.size)
+            elif self.overflow == "spill":
+                if self._spill is None:
+                    self._spill = tempfile.TemporaryFile(dir=self.spill_dir or None)
+                self._spill.seek(self._spill_write)
+                self._spill.write(data)
+                self._spill_write += len(data)
+                self.spilled += len(data)
+            else:
+                self.overflowed = True
+                self._cond.notify_all()
+                return False
+            self.last_output = time.monotonic()
+            self._cond.notify_all()
+            return True
+
+    @property
+    def done(self) -> bool:
+        return self.finished or self.closed
+
+    def idle_for(self) -> float:
+        return time.monotonic() - self.last_output
+
+    def ping(self) -> None:
+        """Queue a keep-alive comment unless events are already waiting for the client"""
+        with self._cond:
+            if self.done or self._events or self._spill_write > self._spill_read:
+                return
+            self._events.append(PING.encode("utf-8"))
+            self.last_output = time.monotonic()
+            self._cond.notify_all()
+
+    def _produce(self) -> None:
+        try:
+            for event in self.source:
+                if not self._put(event if isinstance(event, bytes) else event.encode("utf-8")):
+                    break
+        except Exception as e:
+            debug_log(f"预读上游失败: {e}")
+        finally:
+            if self.overflowed:
+                debug_log(f"客户端读取过慢，预读缓冲区超出 {self.max_bytes} 字节，断开连接")
+                self.abort()
+            close = getattr(self.source, "close", None)
+            if close is not None:
+                close()
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+                if self.closed:
+                    self._close_spill()
+
+    def _close_spill(self) -> None:
+        # 调用方持有锁；生产线程与客户端都结束后关闭溢出文件
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def _take(self) -> Optional[bytes]:
+        """Everything readable right now, coalesced; None at the end of the stream"""
+        with self._cond:
+            while not self._events and self._spill_write == self._spill_read and not self.finished:
+                self._cond.wait()
+            if self._events:
+                data = b"".join(self._events)
+                self._events.clear()
+                self.size = 0
+                return data
+            if self._spill_write > self._spill_read:
+                self._spill.seek(self._spill_read)
+                data = self._spill.read(min(self._spill_write - self._spill_read, _SPILL_READ_BYTES))
+                self._spill_read += len(data)
+                if self._spill_read == self._spill_write:
+                    # 文件已读完，回到内存缓冲
+                    self._spill.seek(0)
+                    self._spill.truncate()
+                    self._spill_read = self._spill_write = 0
+                return data
+            return None
+
+    def read(self) -> Generator[bytes, None, None]:
+        try:
+            while True:
+                data = self._take()
+                if data is None:
+                    return
+                yield data
+        finally:
+            if self.heartbeat is not None:
+                self.heartbeat.stop()
+            with self._cond:
+                interrupted = not self.finished
+                self.closed = True
+                self._cond.notify_all()
+                if not interrupted:
+                    self._close_spill()
+            if interrupted:
+                # 客户端断开：中断上游，生产线程随之结束
+                self.abort()
+
+
+def read_ahead(stream: Iterable[str], abort: Callable[[], None]) -> Iterable:
+    """Serve stream through a read-ahead buffer; unchanged when READ_AHEAD_BYTES is 0"""
+    if settings.READ_AHEAD_BYTES <= 0:
+        return stream
+    buffer = ReadAheadBuffer(stream, abort, settings.READ_AHEAD_BYTES, settings.READ_AHEAD_OVERFLOW,
+                             settings.READ_AHEAD_SPILL_DIR)
+    return buffer.start().read()
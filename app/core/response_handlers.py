@@ -3,42 +3,138 @@ Response handlers for streaming and non-streaming responses
 """
 
 import json
+import re
 import time
-from typing import Generator, Optional
+from functools import lru_cache
+from typing import Generator, List, Optional, Union
 import requests
 from fastapi import HTTPException
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
 from app.core.config import settings
+from app.core.routing import Route
 from app.models.schemas import (
     Message, Delta, Choice, Usage, OpenAIResponse, 
     UpstreamRequest, UpstreamData, UpstreamError, ModelItem
 )
-from app.utils.helpers import debug_log, call_upstream_api, transform_thinking_content
+from app.utils.deadlines import UpstreamDeadlines, UpstreamTimeout
+from app.utils.helpers import (
+    abort_upstream_response, debug_log, call_upstream_api, get_auth_token, transform_thinking_content, upstream_endpoints
+)
+from app.utils.ids import completion_id
 from app.utils.sse_parser import SSEParser
+from app.utils.stop_sequences import StopSequenceMatcher, normalize_stop
+from app.utils.tokens import OutputBudget
 from app.utils.tools import extract_tool_invocations, remove_tool_json_content
 
 
 def create_openai_response_chunk(
     model: str,
     delta: Optional[Delta] = None,
-    finish_reason: Optional[str] = None
+    finish_reason: Optional[str] = None,
+    index: int = 0,
+    id: Optional[str] = None,
+    created: Optional[int] = None
 ) -> OpenAIResponse:
-    """Create OpenAI response chunk for streaming"""
+    """Create OpenAI response chunk for streaming; pass the stream's id and created to keep them stable"""
     return OpenAIResponse(
-        id=f"chatcmpl-{int(time.time())}",
+        id=id or completion_id(),
         object="chat.completion.chunk",
-        created=int(time.time()),
+        created=created or int(time.time()),
         model=model,
         choices=[Choice(
-            index=0,
+            index=index,
             delta=delta or Delta(),
             finish_reason=finish_reason
         )]
     )
 
 
-def handle_upstream_error(error: UpstreamError) -> Generator[str, None, None]:
+# 首字节之前可以换 token / 端点重试的上游状态码
+_RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# JSON 的字符串与括号；字符串内的引号均已转义，跳过整个字符串即可正确计算嵌套深度
+_JSON_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]]')
+_STRING_VALUE = re.compile(rb'\s*:\s*("(?:[^"\\]|\\.)*")')
+# 一个 SSE 事件的结束：空行，三种换行方式
+_EVENT_END = (b"\n\n", b"\r\n\r\n", b"\r\r")
+# 与 requests iter_lines 的默认块大小一致
+_PASSTHROUGH_CHUNK_SIZE = 512
+
+
+@lru_cache(maxsize=8)
+def _model_value(model: str) -> bytes:
+    return json.dumps(model).encode("utf-8")
+
+
+def _top_level_model(data: bytes, start: int, end: int) -> Optional[re.Match]:
+    """Match of the top-level "model" string value of the JSON object starting at data[start]"""
+    depth = 0
+    for token in _JSON_TOKEN.finditer(data, start, end):
+        text = token.group()
+        if text[0] == 0x22:  # '"'
+            if depth == 1 and text == b'"model"':
+                value = _STRING_VALUE.match(data, token.end(), end)
+                if value is not None:
+                    return value
+        elif text in b"{[":
+            depth += 1
+        else:
+            depth -= 1
+            if depth <= 0:
+                return None
+    return None
+
+
+def rewrite_model(data: bytes, model: str) -> bytes:
+    """Replace the top-level "model" field of a JSON object at the byte level, if it differs
+
+    只改写顶层对象的 model 字段，嵌套对象中的同名字段不受影响；无法确定时原样返回。
+    """
+    start = data.find(b"{")
+    if start == -1 or data[:start].strip():
+        return data
+    value = _top_level_model(data, start, len(data))
+    if value is None or value.group(1) == _model_value(model):
+        return data
+    return data[:value.start(1)] + _model_value(model) + data[value.end(1):]
+
+
+def _complete_events_end(data: bytes) -> int:
+    """Length of the leading run of complete SSE events in data; 0 when there is none"""
+    return max((data.rfind(end) + len(end) for end in _EVENT_END if end in data), default=0)
+
+
+def rewrite_events_model(data: bytes, model: str) -> bytes:
+    """rewrite_model for each single-line "data:" JSON event in a run of complete SSE events"""
+    position = data.find(b'"model"')
+    if position == -1:
+        return data
+    parts: List[bytes] = []
+    last = 0
+    while position != -1:
+        line_start = max(data.rfind(b"\n", 0, position), data.rfind(b"\r", 0, position)) + 1
+        line_end = min(i for i in (data.find(b"\n", position), data.find(b"\r", position), len(data)) if i != -1)
+        # 只处理 "data: {...}" 单行事件；跨行的 data 字段无法逐行判断顶层，原样转发
+        value = None
+        if data.startswith(b"data:", line_start):
+            start = line_start + 5
+            while start < line_end and data[start] in b" \t":
+                start += 1
+            if data.startswith(b"{", start):
+                value = _top_level_model(data, start, line_end)
+        if value is not None and value.group(1) != _model_value(model):
+            parts.append(data[last:value.start(1)])
+            parts.append(_model_value(model))
+            last = value.end(1)
+        position = data.find(b'"model"', line_end)
+    if not parts:
+        return data
+    parts.append(data[last:])
+    return b"".join(parts)
+
+
+def handle_upstream_error(error: UpstreamError, index: int = 0, id: Optional[str] = None) -> Generator[str, None, None]:
     """Handle upstream error response"""
     debug_log(f"上游错误: code={error.code}, detail={error.detail}")
     
@@ -46,7 +142,9 @@ def handle_upstream_error(error: UpstreamError) -> Generator[str, None, None]:
     error_chunk = create_openai_response_chunk(
         model=settings.PRIMARY_MODEL,
         delta=Delta(content=f"Error: {error.detail}"),
-        finish_reason="stop"
+        finish_reason="stop",
+        index=index,
+        id=id
     )
     yield f"data: {error_chunk.model_dump_json()}\n\n"
     yield "data: [DONE]\n\n"
@@ -55,19 +153,118 @@ def handle_upstream_error(error: UpstreamError) -> Generator[str, None, None]:
 class ResponseHandler:
     """Base class for response handling"""
     
-    def __init__(self, upstream_req: UpstreamRequest, chat_id: str, auth_token: str, downstream_key: Optional[str] = None):
+    def __init__(self, upstream_req: Union[bytes, UpstreamRequest], chat_id: str, auth_token: str, downstream_key: Optional[str] = None, max_tokens: Optional[int] = None, stop: Optional[List[str]] = None, deadline: Optional[float] = None):
         self.upstream_req = upstream_req
         self.chat_id = chat_id
         self.auth_token = auth_token
         self.downstream_key = downstream_key
+        self.response: Optional[requests.Response] = None
+        self.aborted = False
+        # 上游不支持 max_tokens，在本地按估算的 token 数截断输出
+        self.output_budget = OutputBudget(max_tokens, settings.MAX_TOKENS_COUNT_REASONING) if max_tokens else None
+        stop = normalize_stop(stop)
+        self.stop_matcher = StopSequenceMatcher(stop) if stop else None
+        # 请求的总截止时间（time.monotonic），各阶段超时见 app/utils/deadlines.py
+        self.deadline = deadline
+        self.deadlines: Optional[UpstreamDeadlines] = None
+        # 模型路由决策（app/core/routing.py），用于上报首字节时间
+        self.route: Optional[Route] = None
+        # 同一个响应的所有 chunk 使用相同的 id 与 created
+        self.completion_id = completion_id()
+        self.created = int(time.time())
+    
+    def _observe_first_byte(self, ttft: float) -> None:
+        if self.route is not None:
+            self.route.observe(ttft)
     
     def _call_upstream(self) -> requests.Response:
-        """Call upstream API with error handling"""
-        try:
-            return call_upstream_api(self.upstream_req, self.chat_id, self.auth_token, self.downstream_key)
-        except Exception as e:
-            debug_log(f"调用上游失败: {e}")
-            raise
+        """Call upstream API, retrying on another token/endpoint until the first byte arrives"""
+        endpoints = upstream_endpoints()
+        retries = max(0, settings.UPSTREAM_RETRIES)
+        auth_token = self.auth_token
+        attempt = 0
+        while True:
+            self.deadlines = UpstreamDeadlines(self.deadline)
+            last_attempt = attempt >= retries or self.aborted
+            try:
+                response = call_upstream_api(
+                    self.upstream_req, self.chat_id, auth_token, self.downstream_key,
+                    endpoint=endpoints[attempt % len(endpoints)],
+                    timeout=self.deadlines.request_timeout(),
+                )
+                self.response = response
+                if response.status_code == 200:
+                    response = self.deadlines.watch(response)
+                    self._observe_first_byte(self.deadlines.first_byte_at - self.deadlines.started)
+                    return response
+                if last_attempt or response.status_code not in _RETRY_STATUS:
+                    return response
+                reason = f"status {response.status_code}"
+                response.close()
+            except (requests.RequestException, UpstreamTimeout) as e:
+                error = self.deadlines.classify(e)
+                debug_log(f"调用上游失败: {error}")
+                if getattr(error, "phase", None) == "first_byte":
+                    self._observe_first_byte(time.monotonic() - self.deadlines.started)
+                if last_attempt or getattr(error, "phase", None) == "total":
+                    if error is e:
+                        raise
+                    raise error from e
+                reason = str(error)
+            # 首字节之前失败：换一个 token（及备用端点）重试
+            attempt += 1
+            debug_log(f"上游首字节前失败 ({reason})，重试 {attempt}/{retries}")
+            auth_token = get_auth_token(self.downstream_key)
+    
+    def _stream_error_message(self, error: Exception) -> str:
+        if self.aborted:
+            return "Stream aborted: server is shutting down"
+        if isinstance(error, UpstreamTimeout):
+            return str(error)
+        return f"Stream processing error: {str(error)}"
+    
+    def abort(self) -> None:
+        """Abort the upstream stream (e.g. when a drain deadline is reached)"""
+        self.aborted = True
+        if self.response is not None:
+            abort_upstream_response(self.response)
+    
+    def _within_budget(self, text: str, reasoning: bool = False) -> str:
+        """The part of text still allowed by max_tokens"""
+        if self.output_budget is None:
+            return text
+        return self.output_budget.take(text, reasoning)
+    
+    def _filter_output(self, text: str, reasoning: bool = False) -> str:
+        """Apply stop sequences (content only) and max_tokens to a piece of output"""
+        if text and not reasoning and self.stop_matcher is not None:
+            text, _ = self.stop_matcher.feed(text)
+        return self._within_budget(text, reasoning)
+    
+    def _flush_output(self) -> str:
+        """Content withheld by the stop matcher, released when the upstream finishes normally"""
+        if self.stop_matcher is None:
+            return ""
+        return self._within_budget(self.stop_matcher.flush())
+    
+    @property
+    def length_exceeded(self) -> bool:
+        return self.output_budget is not None and self.output_budget.exhausted
+    
+    @property
+    def early_finish(self) -> Optional[str]:
+        """finish_reason when output ended before the upstream did (stop sequence or max_tokens)"""
+        if self.stop_matcher is not None and self.stop_matcher.matched:
+            return "stop"
+        if self.length_exceeded:
+            return "length"
+        return None
+    
+    def _stop_upstream(self, reason: str) -> None:
+        """Close the upstream stream early once the client has all the output it asked for"""
+        debug_log(f"输出提前结束 ({reason})，关闭上游连接")
+        if self.response is not None:
+            abort_upstream_response(self.response)
     
     def _handle_upstream_error(self, response: requests.Response) -> None:
         """Handle upstream error response"""
@@ -79,22 +276,29 @@ class ResponseHandler:
 class StreamResponseHandler(ResponseHandler):
     """Handler for streaming responses"""
     
-    def __init__(self, upstream_req: UpstreamRequest, chat_id: str, auth_token: str, has_tools: bool = False, downstream_key: Optional[str] = None):
-        super().__init__(upstream_req, chat_id, auth_token, downstream_key)
+    def __init__(self, upstream_req: Union[bytes, UpstreamRequest], chat_id: str, auth_token: str, has_tools: bool = False, downstream_key: Optional[str] = None, max_tokens: Optional[int] = None, stop: Optional[List[str]] = None, deadline: Optional[float] = None):
+        super().__init__(upstream_req, chat_id, auth_token, downstream_key, max_tokens, stop, deadline)
         self.has_tools = has_tools
         self.buffered_content = ""
         self.tool_calls = None
+        # n > 1 时本流对应的 choices[].index
+        self.choice_index = 0
+        # OpenAI 兼容上游自行执行 max_tokens 与 stop，直通模式下不再逐块解析与重建
+        self.passthrough = settings.UPSTREAM_TYPE == "openai" and settings.OPENAI_PASSTHROUGH
+    
+    def _chunk(self, **kwargs) -> OpenAIResponse:
+        return create_openai_response_chunk(index=self.choice_index, id=self.completion_id, created=self.created, **kwargs)
     
-    def handle(self) -> Generator[str, None, None]:
-        """Handle streaming response"""
+    def handle(self) -> Generator[Union[str, bytes], None, None]:
+        """Handle streaming response (bytes in passthrough mode)"""
         debug_log(f"开始处理流式响应 (chat_id={self.chat_id})")
         
         try:
             response = self._call_upstream()
-        except Exception:
-            error_chunk = create_openai_response_chunk(
+        except Exception as e:
+            error_chunk = self._chunk(
                 model=settings.PRIMARY_MODEL,
-                delta=Delta(content="Failed to call upstream"),
+                delta=Delta(content=str(e) if isinstance(e, UpstreamTimeout) else "Failed to call upstream"),
                 finish_reason="stop"
             )
             yield f"data: {error_chunk.model_dump_json()}\n\n"
@@ -106,7 +310,7 @@ class StreamResponseHandler(ResponseHandler):
             # 将上游错误摘要返回给客户端，便于排查
             snippet = response.text[:200] if hasattr(response, 'text') else ''
             msg = f"Upstream {response.status_code}: {snippet}"
-            error_chunk = create_openai_response_chunk(
+            error_chunk = self._chunk(
                 model=settings.PRIMARY_MODEL,
                 delta=Delta(content=msg),
                 finish_reason="stop"
@@ -115,8 +319,12 @@ class StreamResponseHandler(ResponseHandler):
             yield "data: [DONE]\n\n"
             return
         
+        if self.passthrough:
+            yield from self._passthrough(response)
+            return
+        
         # Send initial role chunk
-        first_chunk = create_openai_response_chunk(
+        first_chunk = self._chunk(
             model=settings.PRIMARY_MODEL,
             delta=Delta(role="assistant")
         )
@@ -125,6 +333,7 @@ class StreamResponseHandler(ResponseHandler):
         # OpenAI 兼容模式：直接按 OpenAI 流式数据透传解析
         if settings.UPSTREAM_TYPE == "openai":
             debug_log("以 OpenAI 兼容流式格式解析")
+            finish_reason = None
             try:
                 with SSEParser(response, debug_mode=settings.DEBUG_LOGGING) as parser:
                     for event in parser.iter_events():
@@ -134,9 +343,16 @@ class StreamResponseHandler(ResponseHandler):
                         # 处理 [DONE]
                         if isinstance(data, str):
                             if data.strip() == "[DONE]":
-                                end_chunk = create_openai_response_chunk(
+                                tail = self._flush_output()
+                                if tail:
+                                    tail_chunk = self._chunk(
+                                        model=settings.PRIMARY_MODEL,
+                                        delta=Delta(content=tail)
+                                    )
+                                    yield f"data: {tail_chunk.model_dump_json()}\n\n"
+                                end_chunk = self._chunk(
                                     model=settings.PRIMARY_MODEL,
-                                    finish_reason="stop"
+                                    finish_reason=finish_reason or "stop"
                                 )
                                 yield f"data: {end_chunk.model_dump_json()}\n\n"
                                 yield "data: [DONE]\n\n"
@@ -149,26 +365,40 @@ class StreamResponseHandler(ResponseHandler):
                         if not choices:
                             continue
                         ch = choices[0]
+                        # 保留上游的结束原因（如上游按 max_tokens 截断时的 length）
+                        finish_reason = ch.get("finish_reason") or finish_reason
                         delta_dict = ch.get("delta", {}) or {}
                         out_delta = Delta()
                         if delta_dict.get("content"):
-                            out_delta.content = delta_dict["content"]
+                            out_delta.content = self._filter_output(delta_dict["content"])
                         if delta_dict.get("reasoning_content"):
-                            out_delta.reasoning_content = delta_dict["reasoning_content"]
+                            out_delta.reasoning_content = self._filter_output(delta_dict["reasoning_content"], reasoning=True)
                         if delta_dict.get("tool_calls"):
                             out_delta.tool_calls = delta_dict["tool_calls"]
 
                         if out_delta.content or out_delta.reasoning_content or out_delta.tool_calls:
-                            chunk = create_openai_response_chunk(
+                            chunk = self._chunk(
                                 model=settings.PRIMARY_MODEL,
                                 delta=out_delta
                             )
                             yield f"data: {chunk.model_dump_json()}\n\n"
+                        
+                        early_finish = self.early_finish
+                        if early_finish:
+                            self._stop_upstream(early_finish)
+                            end_chunk = self._chunk(
+                                model=settings.PRIMARY_MODEL,
+                                finish_reason=early_finish
+                            )
+                            yield f"data: {end_chunk.model_dump_json()}\n\n"
+                            yield "data: [DONE]\n\n"
+                            break
             except Exception as e:
                 debug_log(f"处理OpenAI流时发生错误: {e}")
-                error_chunk = create_openai_response_chunk(
+                message = self._stream_error_message(e)
+                error_chunk = self._chunk(
                     model=settings.PRIMARY_MODEL,
-                    delta=Delta(content=f"Stream processing error: {str(e)}"),
+                    delta=Delta(content=message),
                     finish_reason="stop"
                 )
                 yield f"data: {error_chunk.model_dump_json()}\n\n"
@@ -187,7 +417,7 @@ class StreamResponseHandler(ResponseHandler):
                     # Check for errors
                     if self._has_error(upstream_data):
                         error = self._get_error(upstream_data)
-                        yield from handle_upstream_error(error)
+                        yield from handle_upstream_error(error, self.choice_index, self.completion_id)
                         break
                     
                     debug_log(f"解析成功 - 类型: {upstream_data.type}, 阶段: {upstream_data.data.phase}, "
@@ -196,6 +426,12 @@ class StreamResponseHandler(ResponseHandler):
                     # Process content
                     yield from self._process_content(upstream_data, sent_initial_answer)
                     
+                    early_finish = self.early_finish
+                    if early_finish:
+                        self._stop_upstream(early_finish)
+                        yield from self._send_end_chunk(early_finish)
+                        break
+                    
                     # Check if done
                     if upstream_data.data.done or upstream_data.data.phase == "done":
                         debug_log("检测到流结束信号")
@@ -203,14 +439,47 @@ class StreamResponseHandler(ResponseHandler):
                         break
         except Exception as e:
             debug_log(f"处理流时发生错误: {e}")
-            error_chunk = create_openai_response_chunk(
+            message = self._stream_error_message(e)
+            error_chunk = self._chunk(
                 model=settings.PRIMARY_MODEL,
-                delta=Delta(content=f"Stream processing error: {str(e)}"),
+                delta=Delta(content=message),
                 finish_reason="stop"
             )
             yield f"data: {error_chunk.model_dump_json()}\n\n"
             yield "data: [DONE]\n\n"
     
+    def _passthrough(self, response: requests.Response) -> Generator[bytes, None, None]:
+        """Forward upstream bytes verbatim, rewriting only the top-level model field of each event
+
+        按到达的块转发，只在块内最后一个完整事件处切分，未完整的事件留到下一块，
+        保证 model 字段不会被块边界截断；换行与空行保持上游原样。
+        """
+        debug_log("OpenAI 直通模式：原样转发上游事件")
+        pending = b""
+        try:
+            for chunk in response.iter_content(chunk_size=_PASSTHROUGH_CHUNK_SIZE):
+                if not chunk:
+                    continue
+                pending += chunk
+                cut = _complete_events_end(pending)
+                if cut:
+                    yield rewrite_events_model(pending[:cut], settings.PRIMARY_MODEL)
+                    pending = pending[cut:]
+            if pending:
+                yield rewrite_events_model(pending, settings.PRIMARY_MODEL)
+        except Exception as e:
+            debug_log(f"直通转发时发生错误: {e}")
+            message = self._stream_error_message(e)
+            error_chunk = self._chunk(
+                model=settings.PRIMARY_MODEL,
+                delta=Delta(content=message),
+                finish_reason="stop"
+            )
+            yield f"data: {error_chunk.model_dump_json()}\n\n".encode("utf-8")
+            yield b"data: [DONE]\n\n"
+        finally:
+            response.close()
+    
     def _has_error(self, upstream_data: UpstreamData) -> bool:
         """Check if upstream data contains error"""
         return bool(
@@ -239,22 +508,23 @@ class StreamResponseHandler(ResponseHandler):
             return
         
         # Transform thinking content
-        if upstream_data.data.phase == "thinking":
+        is_thinking = upstream_data.data.phase == "thinking"
+        if is_thinking:
             content = transform_thinking_content(content)
         
         # Buffer content if tools are enabled
         if self.has_tools:
-            self.buffered_content += content
+            self.buffered_content += self._filter_output(content, reasoning=is_thinking)
         else:
             # Handle initial answer content
             if (not sent_initial_answer and 
                 upstream_data.data.edit_content and 
                 upstream_data.data.phase == "answer"):
                 
-                content = self._extract_edit_content(upstream_data.data.edit_content)
+                content = self._filter_output(self._extract_edit_content(upstream_data.data.edit_content))
                 if content:
                     debug_log(f"发送普通内容: {content}")
-                    chunk = create_openai_response_chunk(
+                    chunk = self._chunk(
                         model=settings.PRIMARY_MODEL,
                         delta=Delta(content=content)
                     )
@@ -263,16 +533,17 @@ class StreamResponseHandler(ResponseHandler):
             
             # Handle delta content
             if upstream_data.data.delta_content:
+                content = self._filter_output(content, reasoning=is_thinking)
                 if content:
-                    if upstream_data.data.phase == "thinking":
+                    if is_thinking:
                         debug_log(f"发送思考内容: {content}")
-                        chunk = create_openai_response_chunk(
+                        chunk = self._chunk(
                             model=settings.PRIMARY_MODEL,
                             delta=Delta(reasoning_content=content)
                         )
                     else:
                         debug_log(f"发送普通内容: {content}")
-                        chunk = create_openai_response_chunk(
+                        chunk = self._chunk(
                             model=settings.PRIMARY_MODEL,
                             delta=Delta(content=content)
                         )
@@ -283,11 +554,19 @@ class StreamResponseHandler(ResponseHandler):
         parts = edit_content.split("</details>")
         return parts[1] if len(parts) > 1 else ""
     
-    def _send_end_chunk(self) -> Generator[str, None, None]:
+    def _send_end_chunk(self, finish_reason: str = "stop") -> Generator[str, None, None]:
         """Send end chunk and DONE signal"""
-        finish_reason = "stop"
+        tail = self._flush_output()
+        if tail and not self.has_tools:
+            tail_chunk = self._chunk(
+                model=settings.PRIMARY_MODEL,
+                delta=Delta(content=tail)
+            )
+            yield f"data: {tail_chunk.model_dump_json()}\n\n"
         
         if self.has_tools:
+            self.buffered_content += tail
+
             # Try to extract tool calls from buffered content
             self.tool_calls = extract_tool_invocations(self.buffered_content)
             
@@ -301,7 +580,7 @@ class StreamResponseHandler(ResponseHandler):
                         "function": tc.get("function", {}),
                     }
                     
-                    out_chunk = create_openai_response_chunk(
+                    out_chunk = self._chunk(
                         model=settings.PRIMARY_MODEL,
                         delta=Delta(tool_calls=[tool_call_delta])
                     )
@@ -312,14 +591,14 @@ class StreamResponseHandler(ResponseHandler):
                 # Send regular content
                 trimmed_content = remove_tool_json_content(self.buffered_content)
                 if trimmed_content:
-                    content_chunk = create_openai_response_chunk(
+                    content_chunk = self._chunk(
                         model=settings.PRIMARY_MODEL,
                         delta=Delta(content=trimmed_content)
                     )
                     yield f"data: {content_chunk.model_dump_json()}\n\n"
         
         # Send final chunk
-        end_chunk = create_openai_response_chunk(
+        end_chunk = self._chunk(
             model=settings.PRIMARY_MODEL,
             finish_reason=finish_reason
         )
@@ -331,8 +610,8 @@ class StreamResponseHandler(ResponseHandler):
 class NonStreamResponseHandler(ResponseHandler):
     """Handler for non-streaming responses"""
     
-    def __init__(self, upstream_req: UpstreamRequest, chat_id: str, auth_token: str, has_tools: bool = False, downstream_key: Optional[str] = None):
-        super().__init__(upstream_req, chat_id, auth_token, downstream_key)
+    def __init__(self, upstream_req: Union[bytes, UpstreamRequest], chat_id: str, auth_token: str, has_tools: bool = False, downstream_key: Optional[str] = None, max_tokens: Optional[int] = None, stop: Optional[List[str]] = None, deadline: Optional[float] = None):
+        super().__init__(upstream_req, chat_id, auth_token, downstream_key, max_tokens, stop, deadline)
         self.has_tools = has_tools
     
     def handle(self) -> JSONResponse:
@@ -341,6 +620,8 @@ class NonStreamResponseHandler(ResponseHandler):
         
         try:
             response = self._call_upstream()
+        except UpstreamTimeout as e:
+            raise HTTPException(status_code=504, detail=str(e))
         except Exception as e:
             debug_log(f"调用上游失败: {e}")
             raise HTTPException(status_code=502, detail="Failed to call upstream")
@@ -351,6 +632,9 @@ class NonStreamResponseHandler(ResponseHandler):
         
         # OpenAI 兼容模式：直接透传完整响应
         if settings.UPSTREAM_TYPE == "openai":
+            if settings.OPENAI_PASSTHROUGH:
+                return Response(content=rewrite_model(response.content, settings.PRIMARY_MODEL),
+                                media_type="application/json")
             try:
                 return JSONResponse(content=response.json())
             except Exception:
@@ -368,25 +652,35 @@ class NonStreamResponseHandler(ResponseHandler):
                     if upstream_data.data.delta_content:
                         content = upstream_data.data.delta_content
                         
-                        if upstream_data.data.phase == "thinking":
+                        is_thinking = upstream_data.data.phase == "thinking"
+                        if is_thinking:
                             content = transform_thinking_content(content)
                         
+                        content = self._filter_output(content, reasoning=is_thinking)
                         if content:
                             full_content.append(content)
+                        
+                        early_finish = self.early_finish
+                        if early_finish:
+                            self._stop_upstream(early_finish)
+                            break
                     
                     if upstream_data.data.done or upstream_data.data.phase == "done":
                         debug_log("检测到完成信号，停止收集")
                         break
+        except UpstreamTimeout as e:
+            raise HTTPException(status_code=504, detail=str(e))
         except Exception as e:
             debug_log(f"收集响应内容时发生错误: {e}")
             raise HTTPException(status_code=502, detail="Failed to process upstream response")
         
+        full_content.append(self._flush_output())
         final_content = "".join(full_content)
         debug_log(f"内容收集完成，最终长度: {len(final_content)}")
         
         # Handle tool calls for non-streaming
         tool_calls = None
-        finish_reason = "stop"
+        finish_reason = self.early_finish or "stop"
         message_content = final_content
         
         if self.has_tools:
@@ -404,9 +698,9 @@ class NonStreamResponseHandler(ResponseHandler):
         
         # Build response
         response_data = OpenAIResponse(
-            id=f"chatcmpl-{int(time.time())}",
+            id=self.completion_id,
             object="chat.completion",
-            created=int(time.time()),
+            created=self.created,
             model=settings.PRIMARY_MODEL,
             choices=[Choice(
                 index=0,
@@ -0,0 +1,291 @@
+"""
+Resumable SSE streams
+
+移动端与不稳定网络的客户端常在回答中途断开 SSE 连接，重试会让上游重新生成整个回答。
+启用 STREAM_REPLAY_MAX_BYTES 后：
+- 上游流由后台线程读取，写入该流的环形缓冲区，客户端只从缓冲区读取；客户端断开不会中断上游
+- 每个事件带 SSE id "<stream_id>:<序号>"，响应头 X-Stream-Id 返回流 ID
+- 客户端带 Last-Event-ID 重新请求（同一个下游 key）时，从缓冲区补发其后的事件并继续跟随
+  仍在进行的上游流，不会发起新的上游请求
+
+内存上限：每个流最多保留 STREAM_REPLAY_STREAM_BYTES（超出时丢弃最旧的事件），所有流合计
+超过 STREAM_REPLAY_MAX_BYTES 时从最早结束的流开始淘汰；结束超过 STREAM_REPLAY_TTL 秒的流
+同样淘汰。
+
+缓冲区只在单个 worker 内有效。流 ID 中编码了生成它的 worker 序号（见 app.utils.ids），
+serve.py 多 worker 运行时为每个 worker 额外监听一个 Unix socket（目录由 WORKER_SOCKET_DIR 传入），
+落到其他 worker 的重连请求经该 socket 原样转给持有缓冲区的 worker，无需粘性路由。
+"""
+
+import http.client
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Generator, Iterable, Optional, Tuple, Union
+
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+from app.core.config import settings
+from app.core.heartbeat import PING, start_heartbeat
+from app.utils.helpers import debug_log
+from app.utils.ids import new_id, worker_index, worker_of
+
+# 连接其他 worker 并等待响应头的超时；之后按流式读取，不设读超时（对方的心跳与结束会唤醒读取）
+_FORWARD_CONNECT_TIMEOUT = 5.0
+# 转发时保留的响应头
+_FORWARD_HEADERS = ("content-type", "cache-control", "x-stream-id", "retry-after")
+
+
+class StreamGone(Exception):
+    """The requested events are no longer buffered"""
+
+
+class ReplayBuffer:
+    """Bounded ring buffer of the SSE events of one stream"""
+
+    def __init__(self, stream_id: str, owner: Optional[str], max_bytes: int):
+        self.stream_id = stream_id
+        self.owner = owner
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.last_seq = 0
+        self.finished = False
+        self.finished_at = 0.0
+        self.last_output = time.monotonic()
+        self.pings = 0
+        self._events: Deque[Tuple[int, str, int]] = deque()
+        self._cond = threading.Condition()
+
+    @property
+    def first_seq(self) -> int:
+        """Sequence number of the oldest buffered event"""
+        with self._cond:
+            return self._events[0][0] if self._events else self.last_seq + 1
+
+    def append(self, event: Union[str, bytes]) -> None:
+        if isinstance(event, bytes):
+            event = event.decode("utf-8")
+        with self._cond:
+            self.last_seq += 1
+            framed = f"id: {self.stream_id}:{self.last_seq}\n{event}"
+            cost = len(framed.encode("utf-8"))
+            self._events.append((self.last_seq, framed, cost))
+            self.size += cost
+            # 至少保留最新的一个事件
+            while self.size > self.max_bytes and len(self._events) > 1:
+                self.size -= self._events.popleft()[2]
+            self.last_output = time.monotonic()
+            self._cond.notify_all()
+
+    @property
+    def done(self) -> bool:
+        return self.finished
+
+    def idle_for(self) -> float:
+        return time.monotonic() - self.last_output
+
+    def ping(self) -> None:
+        """Wake readers to send a keep-alive comment; pings are not buffered or replayed"""
+        with self._cond:
+            self.pings += 1
+            self.last_output = time.monotonic()
+            self._cond.notify_all()
+
+    def finish(self) -> None:
+        with self._cond:
+            self.finished = True
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    def check(self, after: int) -> None:
+        """Raise StreamGone if events after `after` were already dropped"""
+        if after + 1 < self.first_seq or after > self.last_seq:
+            raise StreamGone(f"{self.stream_id}:{after}")
+
+    def read(self, after: int = 0) -> Generator[str, None, None]:
+        """Events after sequence `after`, following the stream until it finishes"""
+        pings = self.pings
+        while True:
+            with self._cond:
+                while self.last_seq <= after and not self.finished and self.pings == pings:
+                    self._cond.wait()
+                if self._events and after + 1 < self._events[0][0]:
+                    # 读取过慢，未读的事件已被挤出缓冲区；断开后由客户端重连
+                    debug_log(f"流 {self.stream_id} 的读取落后于缓冲区，结束本次连接")
+                    return
+                pending = [framed for seq, framed, _ in self._events if seq > after]
+                after = self.last_seq
+                done = self.finished
+                ping = not pending and self.pings != pings
+                pings = self.pings
+            if pending:
+                # 客户端落后时合并为一次写入
+                yield "".join(pending)
+            elif ping:
+                yield PING
+            if done and after == self.last_seq:
+                return
+
+
+class StreamReplayRegistry:
+    """Replay buffers of active and recently finished streams, bounded by total bytes"""
+
+    def __init__(self, max_bytes: int, stream_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.stream_bytes = min(stream_bytes, max_bytes)
+        self.ttl = ttl
+        self._streams: "OrderedDict[str, ReplayBuffer]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.resumed = 0
+        self.evicted = 0
+
+    def _produce(self, buffer: ReplayBuffer, source: Iterable[str]) -> None:
+        # 心跳只唤醒读取方，不进入缓冲区，也不占用事件序号
+        heartbeat = start_heartbeat(buffer)
+        try:
+            for event in source:
+                buffer.append(event)
+        except Exception as e:
+            debug_log(f"流 {buffer.stream_id} 读取上游失败: {e}")
+        finally:
+            if heartbeat is not None:
+                heartbeat.stop()
+            buffer.finish()
+            self.evict()
+
+    def start(self, source: Iterable[str], owner: Optional[str]) -> ReplayBuffer:
+        """Consume source on a background thread into a new replay buffer"""
+        buffer = ReplayBuffer(new_id(), owner, self.stream_bytes)
+        with self._lock:
+            self._streams[buffer.stream_id] = buffer
+        self.evict()
+        threading.Thread(target=self._produce, args=(buffer, source),
+                         name=f"replay-{buffer.stream_id}", daemon=True).start()
+        return buffer
+
+    def resume(self, last_event_id: str, owner: Optional[str]) -> Tuple[ReplayBuffer, int]:
+        """(buffer, last received sequence) for a Last-Event-ID; raises StreamGone"""
+        stream_id, _, seq = last_event_id.strip().rpartition(":")
+        if not seq.isdigit():
+            raise StreamGone(last_event_id)
+        with self._lock:
+            buffer = self._streams.get(stream_id)
+        # 不同 key 的请求不能接续别人的流，且不透露该流是否存在
+        if buffer is None or buffer.owner != owner:
+            raise StreamGone(last_event_id)
+        buffer.check(int(seq))
+        self.resumed += 1
+        return buffer, int(seq)
+
+    def evict(self) -> None:
+        """Drop expired finished streams, then the oldest finished ones while over the byte cap"""
+        now = time.monotonic()
+        with self._lock:
+            finished = [b for b in self._streams.values() if b.finished]
+            total = sum(b.size for b in self._streams.values())
+            for buffer in sorted(finished, key=lambda b: b.finished_at):
+                if now - buffer.finished_at < self.ttl and total <= self.max_bytes:
+                    break
+                del self._streams[buffer.stream_id]
+                total -= buffer.size
+                self.evicted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            buffers = list(self._streams.values())
+        return {
+            "streams": len(buffers),
+            "active": sum(1 for b in buffers if not b.finished),
+            "bytes": sum(b.size for b in buffers),
+            "resumed": self.resumed,
+            "evicted": self.evicted,
+        }
+
+
+def resume_stream(last_event_id: str, owner: Optional[str]) -> Optional[Tuple[ReplayBuffer, int]]:
+    """Buffer and position to continue from; None when replay is disabled, 410 when gone"""
+    registry = get_replay_registry()
+    if registry is None:
+        return None
+    try:
+        return registry.resume(last_event_id, owner)
+    except StreamGone:
+        debug_log(f"无法接续流 {last_event_id}")
+        raise HTTPException(status_code=410, detail="Stream can no longer be resumed")
+
+
+def worker_socket(index: int, directory: Optional[str] = None) -> Optional[str]:
+    """Path of the private Unix socket of a serve.py worker; None when not running under serve.py"""
+    directory = directory or os.getenv("WORKER_SOCKET_DIR")
+    return os.path.join(directory, f"worker-{index}.sock") if directory else None
+
+
+def resume_owner(last_event_id: str) -> Optional[str]:
+    """Socket of the other worker holding the stream of a Last-Event-ID; None when it is this one"""
+    worker = worker_of(last_event_id.strip().rpartition(":")[0])
+    if worker is None or worker == worker_index():
+        return None
+    return worker_socket(worker)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str):
+        super().__init__("localhost", timeout=_FORWARD_CONNECT_TIMEOUT)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _relay(connection: http.client.HTTPConnection, response: http.client.HTTPResponse) -> Generator[bytes, None, None]:
+    try:
+        while True:
+            data = response.read1(65536)
+            if not data:
+                return
+            yield data
+    finally:
+        connection.close()
+
+
+def forward_resume(socket_path: str, body: bytes, headers: Dict[str, str]) -> Response:
+    """Send a reconnect to the worker that owns its stream and relay the answer (blocking)
+
+    对方 worker 重新执行认证与归属检查；对方不可达时说明该 worker 已重启，缓冲区随之丢失，返回 410。
+    """
+    connection = _UnixHTTPConnection(socket_path)
+    try:
+        connection.request("POST", "/v1/chat/completions", body=body,
+                           headers={**headers, "Content-Type": "application/json"})
+        sock = connection.sock
+        response = connection.getresponse()
+        # 响应头在超时内到达即可，之后的流式读取不设超时
+        sock.settimeout(None)
+    except OSError as e:
+        connection.close()
+        debug_log(f"转发接续请求到 {socket_path} 失败: {e}")
+        raise HTTPException(status_code=410, detail="Stream can no longer be resumed")
+    relayed = {name: value for name, value in response.getheaders() if name.lower() in _FORWARD_HEADERS}
+    if response.status != 200:
+        try:
+            return Response(content=response.read(), status_code=response.status, headers=relayed)
+        finally:
+            connection.close()
+    return StreamingResponse(_relay(connection, response), headers=relayed)
+
+
+_registry: Optional[StreamReplayRegistry] = None
+
+
+def get_replay_registry() -> Optional[StreamReplayRegistry]:
+    """Process-wide replay registry; None when STREAM_REPLAY_MAX_BYTES is 0"""
+    global _registry
+    if _registry is None and settings.STREAM_REPLAY_MAX_BYTES > 0:
+        _registry = StreamReplayRegistry(settings.STREAM_REPLAY_MAX_BYTES, settings.STREAM_REPLAY_STREAM_BYTES,
+                                         settings.STREAM_REPLAY_TTL)
+    return _registry
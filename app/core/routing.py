@@ -0,0 +1,173 @@
+"""
+Load-adaptive model degradation
+
+上游负载高时 GLM-4.5 / GLM-4.5-Thinking 的首字节时间会成倍增加，而 GLM-4.5-Air 往往仍然很快。
+启用 DEGRADE_TTFT_SLO 后，按（下游 key，模型）统计首字节时间（上游请求发出到读到首块响应，
+不含排队）的指数滑动平均：
+- 至少 3 个样本且平均值超过 SLO 时降级，按 DEGRADE_MODELS 改用替代模型
+  （默认 Thinking / Search → GLM-4.5，即关闭思考与搜索；GLM-4.5 → GLM-4.5-Air）
+- 降级期间每 DEGRADE_PROBE_INTERVAL 秒放行一个请求使用原模型作为探测，
+  探测的首字节时间低于 SLO 的 70% 时恢复
+- 被替换的请求带响应头 X-Model-Substituted（实际使用的模型），统计见 GET /health/routing
+
+只替换一级，不会连续降级；状态只在单个 worker 内有效。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.helpers import debug_log, key_digest, parse_key_values
+
+# 指数滑动平均中新样本的权重
+_ALPHA = 0.3
+# 降级前需要的最少样本数，避免个别慢请求触发降级
+_MIN_SAMPLES = 3
+# 探测请求的首字节时间低于 SLO 的该比例时恢复，与降级阈值之间留出滞回区间
+_RECOVER_RATIO = 0.7
+# 最多跟踪的（key，模型）数量，超出时淘汰最久未使用的
+_MAX_ROUTES = 4096
+
+
+class RouteState:
+    """Measured time-to-first-byte of one (key, model) pair"""
+
+    __slots__ = ("ewma", "samples", "degraded", "last_probe", "substituted")
+
+    def __init__(self):
+        self.ewma = 0.0
+        self.samples = 0
+        self.degraded = False
+        self.last_probe = 0.0
+        self.substituted = 0
+
+
+class Route:
+    """Routing decision for one request"""
+
+    __slots__ = ("router", "key", "requested", "model", "probe")
+
+    def __init__(self, router: "ModelRouter", key: Tuple[Optional[str], str], requested: str, model: str, probe: bool):
+        self.router = router
+        self.key = key
+        self.requested = requested
+        self.model = model
+        self.probe = probe
+
+    @property
+    def substituted(self) -> bool:
+        return self.model != self.requested
+
+    def headers(self) -> Dict[str, str]:
+        return {"X-Model-Substituted": self.model} if self.substituted else {}
+
+    def observe(self, ttft: float) -> None:
+        """Record the time-to-first-byte of an upstream call made for this request"""
+        # 替代模型的耗时不反映原模型的状态，只记录使用原模型的请求
+        if not self.substituted:
+            self.router.observe(self.key, ttft, self.probe)
+
+
+class ModelRouter:
+    """Per key and model TTFT tracking that downgrades models past an SLO"""
+
+    def __init__(self, slo: float, fallbacks: Dict[str, str], probe_interval: float):
+        self.slo = slo
+        self.fallbacks = fallbacks
+        self.probe_interval = probe_interval
+        self._routes: "OrderedDict[Tuple[Optional[str], str], RouteState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.degradations = 0
+        self.recoveries = 0
+
+    def _state(self, key: Tuple[Optional[str], str]) -> RouteState:
+        # 调用方持有锁
+        state = self._routes.get(key)
+        if state is None:
+            state = self._routes[key] = RouteState()
+            if len(self._routes) > _MAX_ROUTES:
+                self._routes.popitem(last=False)
+        else:
+            self._routes.move_to_end(key)
+        return state
+
+    def route(self, downstream_key: Optional[str], model: str) -> Route:
+        key = (downstream_key, model)
+        fallback = self.fallbacks.get(model)
+        with self._lock:
+            state = self._state(key)
+            if fallback is None or not state.degraded:
+                return Route(self, key, model, model, False)
+            now = time.monotonic()
+            if now - state.last_probe >= self.probe_interval:
+                state.last_probe = now
+                return Route(self, key, model, model, True)
+            state.substituted += 1
+        return Route(self, key, model, fallback, False)
+
+    def observe(self, key: Tuple[Optional[str], str], ttft: float, probe: bool = False) -> None:
+        with self._lock:
+            state = self._state(key)
+            state.ewma = ttft if state.samples == 0 else _ALPHA * ttft + (1 - _ALPHA) * state.ewma
+            state.samples += 1
+            if state.degraded:
+                if probe and ttft < self.slo * _RECOVER_RATIO:
+                    state.degraded = False
+                    state.ewma = ttft
+                    self.recoveries += 1
+                    debug_log(f"模型 {key[1]} 探测首字节 {ttft:.2f}s，恢复使用原模型")
+            elif key[1] in self.fallbacks and state.samples >= _MIN_SAMPLES and state.ewma > self.slo:
+                state.degraded = True
+                state.last_probe = time.monotonic()
+                self.degradations += 1
+                debug_log(f"模型 {key[1]} 首字节平均 {state.ewma:.2f}s 超过 SLO {self.slo}s，"
+                          f"降级为 {self.fallbacks[key[1]]}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = list(self._routes.items())
+        models: Dict[str, Dict[str, Any]] = {}
+        degraded = []
+        for (downstream_key, model), state in routes:
+            entry = models.setdefault(model, {"routes": 0, "degraded": 0, "substituted": 0})
+            entry["routes"] += 1
+            entry["degraded"] += int(state.degraded)
+            entry["substituted"] += state.substituted
+            if state.degraded:
+                # 健康检查端点无需认证，只给出 key 哈希的前缀，便于与日志对照
+                degraded.append({
+                    "key": key_digest(downstream_key)[:12],
+                    "model": model,
+                    "fallback": self.fallbacks.get(model),
+                    "ttft_ewma": round(state.ewma, 3),
+                })
+        return {
+            "slo": self.slo,
+            "degradations": self.degradations,
+            "recoveries": self.recoveries,
+            "models": models,
+            "degraded": degraded,
+        }
+
+
+def route_model(downstream_key: Optional[str], model: str) -> Optional[Route]:
+    """Routing decision for a request; None when DEGRADE_TTFT_SLO is 0"""
+    router = get_model_router()
+    if router is None:
+        return None
+    return router.route(downstream_key, model)
+
+
+_router: Optional[ModelRouter] = None
+
+
+def get_model_router() -> Optional[ModelRouter]:
+    """Process-wide model router; None when DEGRADE_TTFT_SLO is 0"""
+    global _router
+    if _router is None and settings.DEGRADE_TTFT_SLO > 0:
+        # 没有替代模型的条目忽略
+        fallbacks = {model: fallback for model, fallback in parse_key_values(settings.DEGRADE_MODELS).items() if fallback}
+        _router = ModelRouter(settings.DEGRADE_TTFT_SLO, fallbacks, settings.DEGRADE_PROBE_INTERVAL)
+    return _router
@@ -0,0 +1,345 @@
+"""
+Weighted fair upstream scheduler
+
+限制每个 worker 同时进行的上游请求数（UPSTREAM_CONCURRENCY），超出的请求排队，
+按流量类别（interactive / batch 等）做赤字轮询（DRR）调度：
+- 每个类别按 SCHEDULER_WEIGHTS 中的权重分得放行份额，如 "interactive=8,batch=1"
+  表示两类都在排队时每放行 1 个 batch 请求放行 8 个 interactive 请求
+- 同一类别内按下游 key 轮询，单个 key 的大量请求不会饿死其他 key
+- 释放的名额直接交给下一个被选中的等待者，不会被新到的请求抢走
+
+类别：SCHEDULER_KEY_CLASSES 中为 key 指定的类别（默认 interactive），请求头 X-Priority
+只能选择权重不高于该类别的类别（即只能降级）。等待时间通过响应头 X-Queue-Wait-Ms 返回，
+汇总统计见 GET /health/scheduler。
+
+n > 1 的请求一次申请 n 个名额（不超过 UPSTREAM_CONCURRENCY），全部到齐后才放行，
+不会出现持有部分名额等待其余名额的死锁；同一时间只有一个等待者在累积名额。
+"""
+
+import asyncio
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Generator, Iterable, List, Optional
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.utils.helpers import debug_log, parse_key_values
+
+DEFAULT_CLASS = "interactive"
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a request waited longer than the queue timeout"""
+
+
+class _Waiter:
+    __slots__ = ("key", "traffic_class", "notify", "count", "held", "granted")
+
+    def __init__(self, key: str, traffic_class: str, notify: Callable[[], None], count: int = 1):
+        self.key = key
+        self.traffic_class = traffic_class
+        self.notify = notify
+        self.count = count
+        self.held = 0
+        self.granted = False
+
+
+class _ClassQueue:
+    """Waiters of one traffic class, round-robin across keys"""
+
+    __slots__ = ("weight", "deficit", "visited", "keys", "size", "dispatched", "wait_total", "wait_max")
+
+    def __init__(self, weight: int):
+        self.weight = weight
+        self.deficit = 0
+        self.visited = False
+        self.keys: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self.size = 0
+        self.dispatched = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def push(self, waiter: _Waiter) -> None:
+        queue = self.keys.get(waiter.key)
+        if queue is None:
+            queue = self.keys[waiter.key] = deque()
+        queue.append(waiter)
+        self.size += 1
+
+    def pop(self) -> _Waiter:
+        key, queue = next(iter(self.keys.items()))
+        waiter = queue.popleft()
+        if queue:
+            self.keys.move_to_end(key)
+        else:
+            del self.keys[key]
+        self.size -= 1
+        return waiter
+
+    def remove(self, waiter: _Waiter) -> None:
+        queue = self.keys[waiter.key]
+        queue.remove(waiter)
+        if not queue:
+            del self.keys[waiter.key]
+        self.size -= 1
+
+
+class Slot:
+    """Upstream concurrency slots held by one request; release() is idempotent"""
+
+    __slots__ = ("traffic_class", "wait_ms", "count", "_scheduler", "_lock", "_released", "__weakref__")
+
+    def __init__(self, scheduler: "UpstreamScheduler", traffic_class: str, wait_ms: float, count: int = 1):
+        self.traffic_class = traffic_class
+        self.wait_ms = wait_ms
+        self.count = count
+        self._scheduler = scheduler
+        self._lock = threading.Lock()
+        self._released = False
+
+    def release(self) -> None:
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._scheduler._release(self.count)
+
+    def headers(self) -> Dict[str, str]:
+        return {"X-Queue-Wait-Ms": str(int(self.wait_ms)), "X-Queue-Class": self.traffic_class}
+
+    def _hold(self, stream: Iterable[str]) -> Generator[str, None, None]:
+        try:
+            yield from stream
+        finally:
+            self.release()
+
+    def hold(self, stream: Iterable[str]) -> Generator[str, None, None]:
+        """Wrap a response stream so the slot is released when it ends"""
+        held = self._hold(stream)
+        # 客户端在响应开始前断开时生成器不会被迭代，回收时同样释放名额
+        weakref.finalize(held, self.release)
+        return held
+
+
+class UpstreamScheduler:
+    """Bounded upstream concurrency with deficit round-robin across traffic classes"""
+
+    def __init__(self, capacity: int, weights: Dict[str, int]):
+        self.capacity = capacity
+        self.weights = dict(weights) or {DEFAULT_CLASS: 1}
+        self._free = capacity
+        self._lock = threading.Lock()
+        self._classes: Dict[str, _ClassQueue] = {}
+        self._ring: Deque[str] = deque()
+        # 已出队、正在累积名额的等待者（申请多个名额时）
+        self._filling: Optional[_Waiter] = None
+
+    def weight(self, traffic_class: str) -> int:
+        return self.weights.get(traffic_class, 1)
+
+    def _enqueue(self, key: str, traffic_class: str, notify: Callable[[], None], count: int = 1) -> Optional[_Waiter]:
+        """None when the slots were taken immediately, otherwise the queued waiter"""
+        with self._lock:
+            if self._free >= count and not self._ring and self._filling is None:
+                self._free -= count
+                return None
+            queue = self._classes.get(traffic_class)
+            if queue is None:
+                queue = self._classes[traffic_class] = _ClassQueue(self.weight(traffic_class))
+            if not queue.size:
+                self._ring.append(traffic_class)
+            waiter = _Waiter(key, traffic_class, notify, count)
+            queue.push(waiter)
+            # 空闲名额不足以一次满足时，先交给队首等待者累积
+            granted = self._dispatch()
+        for other in granted:
+            other.notify()
+        return waiter
+
+    def _cancel(self, waiter: _Waiter) -> bool:
+        """Remove a waiter that gave up; False if it was granted its slots meanwhile"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            if waiter is self._filling:
+                # 已累积的名额交给后面的等待者
+                self._filling = None
+                self._free += waiter.held
+                waiter.held = 0
+                granted = self._dispatch()
+            else:
+                granted = []
+                queue = self._classes[waiter.traffic_class]
+                queue.remove(waiter)
+                if not queue.size:
+                    self._ring.remove(waiter.traffic_class)
+                    queue.deficit = 0
+                    queue.visited = False
+        for other in granted:
+            other.notify()
+        return True
+
+    def _pick(self) -> _Waiter:
+        # 调用方持有锁且 _ring 非空
+        while True:
+            queue = self._classes[self._ring[0]]
+            if not queue.visited:
+                queue.deficit += queue.weight
+                queue.visited = True
+            if queue.deficit >= 1:
+                queue.deficit -= 1
+                waiter = queue.pop()
+                if not queue.size:
+                    self._ring.popleft()
+                    queue.deficit = 0
+                    queue.visited = False
+                return waiter
+            queue.visited = False
+            self._ring.rotate(-1)
+
+    def _dispatch(self) -> List[_Waiter]:
+        """Hand free slots to waiters in DRR order; returns the ones fully granted"""
+        # 调用方持有锁
+        granted: List[_Waiter] = []
+        while self._free > 0:
+            if self._filling is None:
+                if not self._ring:
+                    break
+                self._filling = self._pick()
+            waiter = self._filling
+            take = min(self._free, waiter.count - waiter.held)
+            self._free -= take
+            waiter.held += take
+            if waiter.held < waiter.count:
+                break
+            waiter.granted = True
+            self._filling = None
+            granted.append(waiter)
+        return granted
+
+    def _release(self, count: int = 1) -> None:
+        with self._lock:
+            self._free += count
+            granted = self._dispatch()
+        for waiter in granted:
+            waiter.notify()
+
+    def _slot(self, traffic_class: str, started: float, count: int = 1) -> Slot:
+        wait_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            queue = self._classes.get(traffic_class)
+            if queue is None:
+                queue = self._classes[traffic_class] = _ClassQueue(self.weight(traffic_class))
+            queue.dispatched += 1
+            queue.wait_total += wait_ms
+            queue.wait_max = max(queue.wait_max, wait_ms)
+        return Slot(self, traffic_class, wait_ms, count)
+
+    def acquire(self, key: str, traffic_class: str, timeout: Optional[float] = None, count: int = 1) -> Slot:
+        """Block until `count` slots (at most the capacity) are granted together (for worker threads)"""
+        started = time.monotonic()
+        count = min(count, self.capacity)
+        event = threading.Event()
+        waiter = self._enqueue(key, traffic_class, event.set, count)
+        if waiter is not None and not event.wait(timeout) and self._cancel(waiter):
+            raise SchedulerTimeout(f"waited {timeout}s for an upstream slot")
+        return self._slot(traffic_class, started, count)
+
+    async def acquire_async(self, key: str, traffic_class: str, timeout: Optional[float] = None,
+                            count: int = 1) -> Slot:
+        """Wait for `count` slots without blocking the event loop"""
+        started = time.monotonic()
+        count = min(count, self.capacity)
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify() -> None:
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = self._enqueue(key, traffic_class, notify, count)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(granted), timeout)
+            except asyncio.TimeoutError:
+                if self._cancel(waiter):
+                    raise SchedulerTimeout(f"waited {timeout}s for an upstream slot")
+            except asyncio.CancelledError:
+                # 客户端在排队期间断开
+                if not self._cancel(waiter):
+                    self._release(count)
+                raise
+        return self._slot(traffic_class, started, count)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            classes = {
+                name: {
+                    "weight": queue.weight,
+                    "queued": queue.size,
+                    "dispatched": queue.dispatched,
+                    "avg_wait_ms": round(queue.wait_total / queue.dispatched, 1) if queue.dispatched else 0.0,
+                    "max_wait_ms": round(queue.wait_max, 1),
+                }
+                for name, queue in self._classes.items()
+            }
+            return {"capacity": self.capacity, "in_use": self.capacity - self._free, "classes": classes}
+
+
+def traffic_class(downstream_key: Optional[str], priority: Optional[str] = None) -> str:
+    """Traffic class of a request: the key's class, or a lower-weight one requested via X-Priority"""
+    scheduler = get_scheduler()
+    weights = scheduler.weights if scheduler is not None else {}
+    key_class = parse_key_values(settings.SCHEDULER_KEY_CLASSES).get(downstream_key or "", DEFAULT_CLASS)
+    if priority:
+        priority = priority.strip().lower()
+        if priority in weights and weights[priority] <= weights.get(key_class, 1):
+            return priority
+    return key_class
+
+
+def _acquire_failed(traffic_class_name: str) -> HTTPException:
+    debug_log(f"上游排队超时 ({traffic_class_name})")
+    return HTTPException(status_code=503, detail="Upstream queue timeout", headers={"Retry-After": "1"})
+
+
+async def acquire_upstream_slot(downstream_key: Optional[str], priority: Optional[str] = None,
+                                count: int = 1) -> Optional[Slot]:
+    """Queue for `count` upstream slots from an endpoint; None when scheduling is disabled"""
+    scheduler = get_scheduler()
+    if scheduler is None:
+        return None
+    name = traffic_class(downstream_key, priority)
+    try:
+        return await scheduler.acquire_async(downstream_key or "", name, settings.UPSTREAM_QUEUE_TIMEOUT, count)
+    except SchedulerTimeout:
+        raise _acquire_failed(name)
+
+
+def acquire_upstream_slot_sync(downstream_key: Optional[str], priority: Optional[str] = None) -> Optional[Slot]:
+    """Same as acquire_upstream_slot, blocking the calling worker thread"""
+    scheduler = get_scheduler()
+    if scheduler is None:
+        return None
+    name = traffic_class(downstream_key, priority)
+    try:
+        return scheduler.acquire(downstream_key or "", name, settings.UPSTREAM_QUEUE_TIMEOUT)
+    except SchedulerTimeout:
+        raise _acquire_failed(name)
+
+
+def parse_weights(value: str) -> Dict[str, int]:
+    return {name.lower(): max(1, int(weight)) for name, weight in parse_key_values(value).items() if weight.isdigit()}
+
+
+_scheduler: Optional[UpstreamScheduler] = None
+
+
+def get_scheduler() -> Optional[UpstreamScheduler]:
+    """Process-wide scheduler; None when UPSTREAM_CONCURRENCY is 0"""
+    global _scheduler
+    if _scheduler is None and settings.UPSTREAM_CONCURRENCY > 0:
+        _scheduler = UpstreamScheduler(settings.UPSTREAM_CONCURRENCY, parse_weights(settings.SCHEDULER_WEIGHTS))
+    return _scheduler
@@ -0,0 +1,147 @@
+"""
+Startup warm-up and warm-state persistence
+
+冷启动（如 Render 实例缩容到零后被唤醒）时，首个请求需要承担浏览器画像构建、
+匿名token获取与首次 TLS 握手的开销。这里在 FastAPI lifespan 中预先完成这些工作，
+并可选地把预热状态保存到磁盘，下次启动时直接恢复。
+"""
+
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List
+from urllib.parse import urlsplit
+
+from fastapi import FastAPI
+
+from app.core.config import settings
+from app.utils.header_profiles import HeaderProfilePool, get_header_pool, set_header_pool
+from app.utils.helpers import debug_log, get_token_pool, get_upstream_session
+
+WARM_STATE_VERSION = 1
+
+# 启动各阶段耗时（秒），便于排查冷启动瓶颈
+startup_report: Dict[str, Any] = {}
+
+
+def _upstream_origins() -> List[str]:
+    origins = []
+    for url in (settings.API_ENDPOINT, settings.CLIENT_HEADERS["Origin"]):
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        if origin not in origins:
+            origins.append(origin)
+    return origins
+
+
+def warm_header_profiles() -> int:
+    return len(get_header_pool())
+
+
+def warm_token_pool() -> int:
+    pool = get_token_pool()
+    if pool is None or not settings.ANONYMOUS_MODE:
+        return 0
+    return pool.fill()
+
+
+def warm_upstream_connections() -> int:
+    """Open pooled TCP/TLS connections to each upstream origin"""
+    session = get_upstream_session()
+    warmed = 0
+    for origin in _upstream_origins():
+        try:
+            session.head(origin + "/", timeout=5.0)
+            warmed += 1
+        except Exception as e:
+            debug_log(f"预热上游连接失败 {origin}: {e}")
+    return warmed
+
+
+def save_warm_state(path: str) -> None:
+    """Persist header profiles, sticky bindings and pooled tokens"""
+    pool = get_header_pool()
+    token_pool = get_token_pool()
+    state = {
+        "v": WARM_STATE_VERSION,
+        "saved_at": time.time(),
+        "user_agents": pool.user_agents(),
+        "sticky": pool.sticky_items(),
+        "tokens": token_pool.snapshot() if token_pool else [],
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    # 文件中包含匿名token，仅允许当前用户读取
+    os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, path)
+
+
+def restore_warm_state(path: str) -> bool:
+    """Restore state written by save_warm_state; returns False if unusable"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if state.get("v") != WARM_STATE_VERSION or not state.get("user_agents"):
+        return False
+
+    pool = HeaderProfilePool(state["user_agents"])
+    for token, index in state.get("sticky", []):
+        if 0 <= index < len(pool):
+            pool.bind(token, index)
+    set_header_pool(pool)
+
+    token_pool = get_token_pool()
+    if token_pool is not None:
+        startup_report["restored_tokens"] = token_pool.restore([tuple(t) for t in state.get("tokens", [])])
+    return True
+
+
+def run_warmup() -> Dict[str, Any]:
+    """Run all warm-up steps, recording the duration of each"""
+    steps = (
+        ("header_profiles", warm_header_profiles),
+        ("token_pool", warm_token_pool),
+        ("upstream_connections", warm_upstream_connections),
+    )
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            result = step()
+        except Exception as e:
+            result = f"error: {e}"
+        startup_report[name] = {"result": result, "seconds": round(time.perf_counter() - started, 4)}
+    return startup_report
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """FastAPI lifespan: restore/warm on startup, persist warm state on shutdown"""
+    started = time.perf_counter()
+
+    if settings.WARM_STATE_FILE:
+        startup_report["warm_state_restored"] = restore_warm_state(settings.WARM_STATE_FILE)
+
+    warmup_task = None
+    if settings.WARMUP_MODE == "blocking":
+        await asyncio.get_running_loop().run_in_executor(None, run_warmup)
+    elif settings.WARMUP_MODE == "background":
+        warmup_task = asyncio.get_running_loop().run_in_executor(None, run_warmup)
+
+    startup_report["ready_seconds"] = round(time.perf_counter() - started, 4)
+    debug_log(f"启动完成: {startup_report}")
+
+    yield
+
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    if settings.WARM_STATE_FILE:
+        try:
+            save_warm_state(settings.WARM_STATE_FILE)
+            debug_log(f"已保存预热状态: {settings.WARM_STATE_FILE}")
+        except OSError as e:
+            debug_log(f"保存预热状态失败: {e}")
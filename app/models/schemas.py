@@ -30,6 +30,8 @@ class OpenAIRequest(BaseModel):
     stream: Optional[bool] = False
     temperature: Optional[float] = None
     max_tokens: Optional[int] = None
+    stop: Optional[Union[str, List[str]]] = None
+    n: Optional[int] = None
     tools: Optional[List[Dict[str, Any]]] = None
     tool_choice: Optional[Any] = None
 
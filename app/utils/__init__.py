@@ -2,6 +2,13 @@
 Utils module initialization
 """
 
-from app.utils import helpers, sse_parser, tools
+import importlib
 
-__all__ = ["helpers", "sse_parser", "tools"]
\ No newline at end of file
+__all__ = ["helpers", "sse_parser", "tools", "recorder", "header_profiles", "token_pool", "shared_state", "message_cache", "tool_registry", "upstream_builder", "tokens", "context_window", "stop_sequences", "timer_wheel", "deadlines", "ids"]
+
+
+# 子模块按需加载：导入单个模块时不连带导入其余模块（及其 requests、pydantic 等依赖），缩短冷启动导入时间
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"app.utils.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,129 @@
+"""
+Token-budget context windowing
+
+超长对话原样转发会拖慢上游预填充，甚至超出上游上下文限制。这里在构建上游请求体之前
+按估算的 token 数裁剪历史：
+- 始终保留所有 system 消息与最新一轮对话
+- 以"轮"为单位（从一条 user 消息开始，包含其后的 assistant 与工具结果）从最旧的开始丢弃，
+  工具调用与其结果不会被拆开
+- 可选地对过长的工具结果做中间截断，保留开头与结尾
+
+预算：CONTEXT_TOKEN_BUDGETS 中按模型配置（"GLM-4.5=120000,GLM-4.5-Air=60000"），
+未配置的模型使用 CONTEXT_TOKEN_BUDGET；为 0 时不裁剪历史。
+"""
+
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.models.schemas import OpenAIRequest
+from app.utils.helpers import parse_key_values
+from app.utils.tokens import estimate_message_tokens, estimate_tokens
+from app.utils.upstream_builder import message_text
+
+
+class WindowResult:
+    """What the context window did to one request"""
+
+    __slots__ = ("budget", "dropped_messages", "truncated_messages", "tokens_before", "tokens_after")
+
+    def __init__(self, budget: int, dropped_messages: int, truncated_messages: int, tokens_before: int, tokens_after: int):
+        self.budget = budget
+        self.dropped_messages = dropped_messages
+        self.truncated_messages = truncated_messages
+        self.tokens_before = tokens_before
+        self.tokens_after = tokens_after
+
+    @property
+    def trimmed_tokens(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    @property
+    def trimmed(self) -> bool:
+        return self.dropped_messages > 0 or self.truncated_messages > 0
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-Context-Tokens": str(self.tokens_after),
+            "X-Context-Trimmed-Messages": str(self.dropped_messages),
+            "X-Context-Trimmed-Tokens": str(self.trimmed_tokens),
+        }
+
+
+@lru_cache(maxsize=8)
+def parse_budgets(value: str) -> Dict[str, int]:
+    """Parse "model=tokens,model=tokens" into a dict; malformed entries are ignored"""
+    return {model: int(tokens) for model, tokens in parse_key_values(value).items() if tokens.isdigit()}
+
+
+def context_budget(model: str) -> int:
+    """Token budget for the upstream message list of a model, 0 for unlimited"""
+    return parse_budgets(settings.CONTEXT_TOKEN_BUDGETS).get(model, settings.CONTEXT_TOKEN_BUDGET)
+
+
+def truncate_middle(text: str, max_tokens: int) -> str:
+    """Keep the head and tail of text within roughly max_tokens, marking the omitted middle"""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    keep = len(text) * max_tokens // tokens
+    head = keep // 2
+    tail = keep - head
+    return f"{text[:head]}\n…[已省略 {len(text) - keep} 字符]…\n{text[len(text) - tail:]}"
+
+
+def _turns(roles: List[str]) -> List[List[int]]:
+    """Indexes of non-system messages grouped into turns, each starting at a user message"""
+    turns: List[List[int]] = []
+    for index, role in enumerate(roles):
+        if role == "system":
+            continue
+        if role == "user" or not turns:
+            turns.append([])
+        turns[-1].append(index)
+    return turns
+
+
+def apply_context_window(request: OpenAIRequest) -> Tuple[OpenAIRequest, Optional[WindowResult]]:
+    """Request with its history fitted to the model's budget; (request, None) when disabled"""
+    budget = context_budget(request.model)
+    max_tool_tokens = settings.TOOL_RESULT_MAX_TOKENS
+    if budget <= 0 and max_tool_tokens <= 0:
+        return request, None
+
+    messages = list(request.messages)
+    costs = [estimate_message_tokens(message_text(m.content), m.reasoning_content) for m in messages]
+    tokens_before = sum(costs)
+
+    truncated = 0
+    if max_tool_tokens > 0:
+        for index, message in enumerate(messages):
+            if message.role not in ("tool", "function"):
+                continue
+            text = message_text(message.content)
+            shortened = truncate_middle(text, max_tool_tokens)
+            if shortened is not text:
+                messages[index] = message.model_copy(update={"content": shortened})
+                costs[index] = estimate_message_tokens(shortened, message.reasoning_content)
+                truncated += 1
+
+    total = sum(costs)
+    dropped = 0
+    if budget > 0 and total > budget:
+        turns = _turns([m.role for m in messages])
+        drop: List[int] = []
+        # 最新一轮始终保留，即使它本身已超出预算
+        for turn in turns[:-1]:
+            if total <= budget:
+                break
+            drop.extend(turn)
+            total -= sum(costs[i] for i in turn)
+        if drop:
+            dropped_set = set(drop)
+            messages = [m for i, m in enumerate(messages) if i not in dropped_set]
+            dropped = len(drop)
+
+    result = WindowResult(budget, dropped, truncated, tokens_before, total)
+    if not result.trimmed:
+        return request, result
+    return request.model_copy(update={"messages": messages}), result
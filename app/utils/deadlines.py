@@ -0,0 +1,201 @@
+"""
+Per-phase upstream deadlines
+
+原来只有 requests 的 timeout=60，无法区分连接缓慢、首字节前长时间排队与回答中途停滞。
+这里把一次上游调用分为几个阶段，分别设置上限（0 表示不限制）：
+- 连接：UPSTREAM_CONNECT_TIMEOUT，由 requests 执行
+- 首字节：UPSTREAM_FIRST_BYTE_TIMEOUT，从发出请求到读到第一块响应体
+- 空闲：UPSTREAM_IDLE_TIMEOUT，相邻两块响应体之间的最大间隔
+- 总时长：UPSTREAM_TOTAL_TIMEOUT 与客户端请求头 X-Request-Timeout（秒）中较早的一个
+
+首字节之后的阶段由共享时间轮检查，超时时关闭上游 socket，读取方随即结束；每读到一块数据
+只记录一次时间戳，不重新调度定时器。首字节之前的超时与连接失败可以换 token / 端点重试。
+"""
+
+import time
+from typing import Optional, Tuple
+
+import requests
+from urllib3.exceptions import ReadTimeoutError
+
+from app.core.config import settings
+from app.utils.helpers import abort_upstream_response, debug_log
+from app.utils.timer_wheel import Timer, get_timer_wheel
+
+# 预读首块数据时使用的块大小，与 iter_lines 的默认值一致
+_FIRST_CHUNK_SIZE = 512
+
+
+class UpstreamTimeout(Exception):
+    """An upstream call exceeded one of its phase deadlines"""
+
+    def __init__(self, phase: str):
+        super().__init__(f"Upstream {phase} timeout")
+        self.phase = phase
+
+
+def request_deadline(timeout_header: Optional[str] = None) -> Optional[float]:
+    """Absolute monotonic deadline of a request from UPSTREAM_TOTAL_TIMEOUT and X-Request-Timeout"""
+    limits = []
+    if settings.UPSTREAM_TOTAL_TIMEOUT > 0:
+        limits.append(settings.UPSTREAM_TOTAL_TIMEOUT)
+    if timeout_header:
+        try:
+            value = float(timeout_header)
+        except ValueError:
+            value = 0
+        if value > 0:
+            limits.append(value)
+    return time.monotonic() + min(limits) if limits else None
+
+
+def _is_read_timeout(error: Exception) -> bool:
+    # 读取响应体时 requests 把 urllib3 的 ReadTimeoutError 包装为 ConnectionError
+    return isinstance(error, requests.ConnectionError) and bool(error.args) and isinstance(error.args[0], ReadTimeoutError)
+
+
+def _positive(value: float) -> Optional[float]:
+    return value if value > 0 else None
+
+
+class UpstreamDeadlines:
+    """Watches one upstream response against its phase deadlines"""
+
+    def __init__(self, deadline: Optional[float] = None):
+        self.started = time.monotonic()
+        self.deadline = deadline
+        self.connect = _positive(settings.UPSTREAM_CONNECT_TIMEOUT)
+        self.first_byte = _positive(settings.UPSTREAM_FIRST_BYTE_TIMEOUT)
+        self.idle = _positive(settings.UPSTREAM_IDLE_TIMEOUT)
+        self.response: Optional[requests.Response] = None
+        self.first_byte_at: Optional[float] = None
+        self.last_activity = self.started
+        self.expired: Optional[str] = None
+        self.finished = False
+        self._timer: Optional[Timer] = None
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def request_timeout(self) -> Tuple[Optional[float], Optional[float]]:
+        """(connect, read) timeouts for requests, bounded by the total deadline"""
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise UpstreamTimeout("total")
+        # 读超时覆盖等待响应头；响应体的首字节与空闲由时间轮检查，这里只作兜底
+        reads = [t for t in (self.first_byte, self.idle) if t is not None]
+        read = max(reads) if reads else None
+        if remaining is not None:
+            read = min(read, remaining) if read is not None else remaining
+        connect = self.connect
+        if remaining is not None:
+            connect = min(connect, remaining) if connect is not None else remaining
+        return connect, read
+
+    def classify(self, error: Exception) -> Exception:
+        """Map requests' connect/read timeouts while waiting for the response to the phase that expired"""
+        if isinstance(error, requests.ConnectTimeout):
+            return UpstreamTimeout("connect")
+        if isinstance(error, requests.ReadTimeout):
+            remaining = self.remaining()
+            return UpstreamTimeout("total" if remaining is not None and remaining <= 0.01 else "first_byte")
+        return error
+
+    def _next_check(self) -> Optional[Tuple[float, str]]:
+        """(monotonic time, phase) of the nearest deadline"""
+        candidates = []
+        if self.first_byte_at is None:
+            if self.first_byte is not None:
+                candidates.append((self.started + self.first_byte, "first_byte"))
+        elif self.idle is not None:
+            candidates.append((self.last_activity + self.idle, "idle"))
+        if self.deadline is not None:
+            candidates.append((self.deadline, "total"))
+        return min(candidates) if candidates else None
+
+    def _schedule(self) -> None:
+        check = self._next_check()
+        if check is not None and not self.finished:
+            self._timer = get_timer_wheel().schedule(check[0] - time.monotonic(), self._on_timer)
+
+    def _on_timer(self) -> None:
+        if self.finished:
+            return
+        check = self._next_check()
+        if check is None:
+            return
+        at, phase = check
+        if time.monotonic() < at:
+            # 期间读到了新数据，按新的截止时间重新检查
+            self._timer = get_timer_wheel().schedule(at - time.monotonic(), self._on_timer)
+            return
+        self.expired = phase
+        debug_log(f"上游 {phase} 超时，中断上游连接")
+        if self.response is not None:
+            abort_upstream_response(self.response)
+
+    def cancel(self) -> None:
+        self.finished = True
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def watch(self, response: requests.Response) -> requests.Response:
+        """Read the first chunk within the first-byte deadline, then watch idle gaps and the total deadline
+
+        首块数据读取失败时关闭响应（归还连接）并抛出 UpstreamTimeout 或连接异常，调用方可重试。
+        """
+        self.response = response
+        original_iter_content = response.iter_content
+        original_close = response.close
+        watcher = self
+        self._schedule()
+
+        chunks = original_iter_content(chunk_size=_FIRST_CHUNK_SIZE)
+        try:
+            first = next(chunks, None)
+        except Exception as e:
+            self.cancel()
+            original_close()
+            if self.expired:
+                raise UpstreamTimeout(self.expired) from e
+            raise
+        if self.expired:
+            self.cancel()
+            original_close()
+            raise UpstreamTimeout(self.expired)
+        self.first_byte_at = self.last_activity = time.monotonic()
+        if self._timer is None:
+            # 未设置首字节上限时，从这里开始检查空闲间隔
+            self._schedule()
+
+        # 与录制器相同，包装 iter_content 即覆盖 iter_lines / content / json 全部读取路径；
+        # 首块已读出，后续读取沿用同一个底层生成器
+        def iter_content(chunk_size: int = 1, decode_unicode: bool = False):
+            try:
+                if first is not None:
+                    yield first
+                for chunk in chunks:
+                    watcher.last_activity = time.monotonic()
+                    yield chunk
+                if watcher.expired:
+                    # socket 被关闭后底层读取可能正常结束
+                    raise UpstreamTimeout(watcher.expired)
+            except UpstreamTimeout:
+                raise
+            except Exception as e:
+                if watcher.expired:
+                    raise UpstreamTimeout(watcher.expired) from e
+                if _is_read_timeout(e):
+                    # requests 的 socket 读超时可能先于时间轮触发，同样属于空闲超时
+                    raise UpstreamTimeout("idle") from e
+                raise
+            finally:
+                watcher.cancel()
+
+        def close() -> None:
+            watcher.cancel()
+            original_close()
+
+        response.iter_content = iter_content
+        response.close = close
+        return response
@@ -0,0 +1,232 @@
+"""
+Precomputed browser header profile pool
+
+启动时一次性构建完整、内部一致的浏览器请求头集合（User-Agent / sec-ch-ua / 平台），
+请求时先按权重选择浏览器家族，再在家族内均匀选择画像（均为 O(1)），家族占比不受快照中
+各家族画像数量的影响；并为每个token粘性绑定一个画像，保证同一token的指纹稳定。
+"""
+
+import json
+import os
+import random
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+BUNDLED_SNAPSHOT = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "header_profiles.json")
+
+# 浏览器家族权重，偏向使用 Chrome 和 Edge
+BROWSER_WEIGHTS: Dict[str, int] = {"chrome": 3, "edge": 2, "firefox": 1, "safari": 1}
+
+_FAKE_UA_BROWSERS = {"Chrome": "chrome", "Edge": "edge", "Firefox": "firefox", "Safari": "safari"}
+_FAKE_UA_OS = ("Windows", "Mac OS X", "Linux")
+
+
+def detect_browser(user_agent: str) -> str:
+    """Classify a User-Agent string into a browser family"""
+    if "Edg/" in user_agent:
+        return "edge"
+    if "Firefox/" in user_agent:
+        return "firefox"
+    if "Chrome/" in user_agent:
+        return "chrome"
+    if "Safari/" in user_agent:
+        return "safari"
+    return "chrome"
+
+
+def detect_platform(user_agent: str) -> str:
+    """Derive the sec-ch-ua-platform value from a User-Agent string"""
+    if "Windows" in user_agent:
+        return "Windows"
+    if "Macintosh" in user_agent or "Mac OS X" in user_agent:
+        return "macOS"
+    if "CrOS" in user_agent:
+        return "Chrome OS"
+    return "Linux"
+
+
+def _major_version(user_agent: str, marker: str, default: str = "139") -> str:
+    if marker not in user_agent:
+        return default
+    try:
+        return user_agent.split(marker)[1].split(".")[0]
+    except IndexError:
+        return default
+
+
+def build_profile_headers(user_agent: str) -> Dict[str, str]:
+    """Build a complete, self-consistent header set for one User-Agent"""
+    browser = detect_browser(user_agent)
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "application/json, text/event-stream",
+        "User-Agent": user_agent,
+        "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8,en-US;q=0.7",
+        "sec-fetch-dest": "empty",
+        "sec-fetch-mode": "cors",
+        "sec-fetch-site": "same-origin",
+        "X-FE-Version": "prod-fe-1.0.70",
+        "Origin": settings.CLIENT_HEADERS["Origin"],
+        "Cache-Control": "no-cache",
+        "Pragma": "no-cache",
+    }
+
+    # 只有基于 Chromium 的浏览器才发送 Client Hints
+    if browser in ("chrome", "edge"):
+        chrome_version = _major_version(user_agent, "Chrome/")
+        if browser == "edge":
+            edge_version = _major_version(user_agent, "Edg/", chrome_version)
+            sec_ch_ua = f'"Microsoft Edge";v="{edge_version}", "Chromium";v="{chrome_version}", "Not_A Brand";v="24"'
+        else:
+            sec_ch_ua = f'"Not;A=Brand";v="8", "Chromium";v="{chrome_version}", "Google Chrome";v="{chrome_version}"'
+        headers["sec-ch-ua"] = sec_ch_ua
+        headers["sec-ch-ua-mobile"] = "?0"
+        headers["sec-ch-ua-platform"] = f'"{detect_platform(user_agent)}"'
+
+    return headers
+
+
+def load_snapshot_user_agents(path: str = BUNDLED_SNAPSHOT) -> List[str]:
+    """Load User-Agent strings from a snapshot file"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return [entry["user_agent"] for entry in data.get("profiles", [])]
+
+
+def collect_fake_useragent_user_agents(count: int) -> List[str]:
+    """Pick the most common desktop User-Agents per browser family from fake_useragent data"""
+    from fake_useragent import UserAgent  # 仅在需要时加载，避免拖慢冷启动
+
+    ua = UserAgent(platforms="desktop")
+    per_family = max(1, count // len(BROWSER_WEIGHTS))
+    by_family: Dict[str, List[Dict[str, Any]]] = {}
+    for entry in ua.data_browsers:
+        family = _FAKE_UA_BROWSERS.get(entry.get("browser"))
+        if family and entry.get("os") in _FAKE_UA_OS:
+            by_family.setdefault(family, []).append(entry)
+
+    user_agents: List[str] = []
+    for family in BROWSER_WEIGHTS:
+        entries = sorted(by_family.get(family, []), key=lambda e: e.get("percent", 0), reverse=True)
+        user_agents.extend(e["useragent"] for e in entries[:per_family])
+    return user_agents
+
+
+class HeaderProfilePool:
+    """Weighted pool of prebuilt header sets with sticky per-token assignment"""
+
+    def __init__(self, user_agents: List[str], sticky_capacity: int = 10000, rng: Optional[random.Random] = None):
+        if not user_agents:
+            raise ValueError("header profile pool needs at least one User-Agent")
+        self.profiles: List[Dict[str, str]] = [build_profile_headers(ua) for ua in dict.fromkeys(user_agents)]
+        # 各家族的画像索引；按家族权重展开的家族表，random.choice 即为 O(1) 的加权选择
+        self._families: Dict[str, List[int]] = {}
+        for index, profile in enumerate(self.profiles):
+            self._families.setdefault(detect_browser(profile["User-Agent"]), []).append(index)
+        self._weighted: List[List[int]] = []
+        for family, indexes in self._families.items():
+            self._weighted.extend([indexes] * BROWSER_WEIGHTS.get(family, 1))
+        self._rng = rng or random.Random()
+        self._sticky: "OrderedDict[str, int]" = OrderedDict()
+        self._sticky_capacity = sticky_capacity
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.profiles)
+
+    def choose_index(self) -> int:
+        """Random profile index: a browser family by weight, then a profile uniformly within it"""
+        return self._rng.choice(self._rng.choice(self._weighted))
+
+    def bind(self, token: str, index: int) -> None:
+        """Stick a token to a profile (LRU bounded)"""
+        with self._lock:
+            self._sticky[token] = index
+            self._sticky.move_to_end(token)
+            while len(self._sticky) > self._sticky_capacity:
+                self._sticky.popitem(last=False)
+
+    def index_for_token(self, token: Optional[str]) -> int:
+        """Profile index for a token, assigning one on first use"""
+        if not token:
+            return self.choose_index()
+        with self._lock:
+            index = self._sticky.get(token)
+            if index is not None:
+                self._sticky.move_to_end(token)
+                return index
+        index = self.choose_index()
+        self.bind(token, index)
+        return index
+
+    def headers(self, index: int) -> Dict[str, str]:
+        """Fresh copy of a profile's headers (callers may mutate it)"""
+        return dict(self.profiles[index])
+
+    def sticky_count(self) -> int:
+        return len(self._sticky)
+
+    def user_agents(self) -> List[str]:
+        return [profile["User-Agent"] for profile in self.profiles]
+
+    def sticky_items(self) -> List[Any]:
+        """(token, profile index) pairs, oldest first"""
+        with self._lock:
+            return list(self._sticky.items())
+
+
+def build_pool() -> HeaderProfilePool:
+    """Build the pool from the configured source, falling back to the bundled snapshot"""
+    source = settings.HEADER_PROFILE_SOURCE
+    user_agents: List[str] = []
+    if source == "fake_useragent":
+        try:
+            user_agents = collect_fake_useragent_user_agents(settings.HEADER_PROFILE_COUNT)
+        except Exception as e:
+            print(f"[HEADER_PROFILES] fake_useragent 加载失败，使用内置快照: {e}")
+    elif source not in ("snapshot", ""):
+        # 其他取值视为自定义快照文件路径
+        user_agents = load_snapshot_user_agents(source)
+    if not user_agents:
+        user_agents = load_snapshot_user_agents()
+    return HeaderProfilePool(user_agents)
+
+
+_pool: Optional[HeaderProfilePool] = None
+_pool_lock = threading.Lock()
+
+
+def get_header_pool() -> HeaderProfilePool:
+    """Get or build the process-wide header profile pool"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = build_pool()
+    return _pool
+
+
+def set_header_pool(pool: HeaderProfilePool) -> None:
+    """Install a prebuilt pool (used when restoring warm state)"""
+    global _pool
+    with _pool_lock:
+        _pool = pool
+
+
+def write_snapshot(path: str = BUNDLED_SNAPSHOT, count: int = 64) -> int:
+    """Regenerate the bundled snapshot from fake_useragent data"""
+    # fake_useragent 数据中同一 User-Agent 可能出现多次，重复条目会放大所在家族内的权重
+    user_agents = list(dict.fromkeys(collect_fake_useragent_user_agents(count)))
+    profiles = [{"user_agent": ua, "browser": detect_browser(ua), "platform": detect_platform(ua)} for ua in user_agents]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"profiles": profiles}, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    return len(profiles)
+
+
+if __name__ == "__main__":
+    written = write_snapshot()
+    print(f"已写入 {written} 个浏览器画像到 {BUNDLED_SNAPSHOT}")
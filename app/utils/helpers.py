@@ -2,25 +2,57 @@
 Utility functions for the application
 """
 
+import hashlib
 import json
 import re
+import socket
 import time
-import random
+from functools import lru_cache
 from typing import Dict, List, Optional, Any, Tuple, Generator
 import requests
-from fake_useragent import UserAgent
 
 from app.core.config import settings
-
-# 全局 UserAgent 实例，避免每次调用都创建新实例
-_user_agent_instance = None
-
-def get_user_agent_instance() -> UserAgent:
-    """获取或创建 UserAgent 实例（单例模式）"""
-    global _user_agent_instance
-    if _user_agent_instance is None:
-        _user_agent_instance = UserAgent()
-    return _user_agent_instance
+from app.utils.header_profiles import get_header_pool
+from app.utils.ids import new_id
+from app.utils.shared_state import get_shared_state
+from app.utils.token_pool import AnonymousTokenPool
+
+# 全局上游 Session，复用 TCP/TLS 连接，避免每次请求重新握手
+_upstream_session: Optional[requests.Session] = None
+# 全局匿名 token 池（ANON_TOKEN_POOL_SIZE > 0 时启用）
+_token_pool: Optional[AnonymousTokenPool] = None
+
+
+def get_upstream_session() -> requests.Session:
+    """获取或创建上游 Session（单例模式）"""
+    global _upstream_session
+    if _upstream_session is None:
+        from http.cookiejar import DefaultCookiePolicy
+
+        session = requests.Session()
+        # 不在请求之间保留 Cookie，避免不同匿名用户共享站点状态
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=settings.UPSTREAM_POOL_SIZE,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _upstream_session = session
+    return _upstream_session
+
+
+def get_token_pool() -> Optional[AnonymousTokenPool]:
+    """获取匿名 token 池；未启用时返回 None"""
+    global _token_pool
+    if _token_pool is None and settings.ANON_TOKEN_POOL_SIZE > 0:
+        _token_pool = AnonymousTokenPool(
+            fetch=get_anonymous_token,
+            size=settings.ANON_TOKEN_POOL_SIZE,
+            ttl=settings.ANON_TOKEN_TTL,
+            state=get_shared_state(),
+        )
+    return _token_pool
 
 
 def debug_log(message: str, *args) -> None:
@@ -32,12 +64,21 @@ def debug_log(message: str, *args) -> None:
             print(f"[DEBUG] {message}")
 
 
+@lru_cache(maxsize=32)
+def parse_key_values(value: str) -> Dict[str, str]:
+    """Parse a "name=value,name=value" setting; entries without "=" are ignored"""
+    result = {}
+    for item in value.split(","):
+        name, sep, item_value = item.partition("=")
+        if sep and name.strip():
+            result[name.strip()] = item_value.strip()
+    return result
+
+
 def generate_request_ids() -> Tuple[str, str]:
     """Generate unique IDs for chat and message"""
-    timestamp = int(time.time())
-    chat_id = f"{timestamp * 1000}-{timestamp}"
-    msg_id = str(timestamp * 1000000)
-    return chat_id, msg_id
+    # 原来按秒生成，同一秒内的并发请求会共用 ID
+    return new_id(), new_id()
 
 
 def is_special_key_format(key: str) -> bool:
@@ -71,76 +112,13 @@ def is_special_key_format(key: str) -> bool:
     return True
 
 
-def get_browser_headers(referer_chat_id: str = "") -> Dict[str, str]:
-    """Get browser headers for API requests with dynamic User-Agent"""
-    
-    # 获取 UserAgent 实例
-    ua = get_user_agent_instance()
-    
-    # 随机选择一个浏览器类型，偏向使用 Chrome 和 Edge
-    browser_choices = ['chrome', 'chrome', 'chrome', 'edge', 'edge', 'firefox', 'safari']
-    browser_type = random.choice(browser_choices)
-    
-    try:
-        # 根据浏览器类型获取 User-Agent
-        if browser_type == 'chrome':
-            user_agent = ua.chrome
-        elif browser_type == 'edge':
-            user_agent = ua.edge
-        elif browser_type == 'firefox':
-            user_agent = ua.firefox
-        elif browser_type == 'safari':
-            user_agent = ua.safari
-        else:
-            user_agent = ua.random
-    except:
-        # 如果获取失败，使用随机 User-Agent
-        user_agent = ua.random
-    
-    # 提取浏览器版本信息
-    chrome_version = "139"  # 默认版本
-    edge_version = "139"
-    
-    if "Chrome/" in user_agent:
-        try:
-            chrome_version = user_agent.split("Chrome/")[1].split(".")[0]
-        except:
-            pass
-    
-    if "Edg/" in user_agent:
-        try:
-            edge_version = user_agent.split("Edg/")[1].split(".")[0]
-            # Edge 基于 Chromium，使用 Edge 特定的 sec-ch-ua
-            sec_ch_ua = f'"Microsoft Edge";v="{edge_version}", "Chromium";v="{chrome_version}", "Not_A Brand";v="24"'
-        except:
-            sec_ch_ua = f'"Not;A=Brand";v="8", "Chromium";v="{chrome_version}", "Google Chrome";v="{chrome_version}"'
-    elif "Firefox/" in user_agent:
-        # Firefox 不使用 sec-ch-ua
-        sec_ch_ua = None
-    else:
-        # Chrome 或其他基于 Chromium 的浏览器
-        sec_ch_ua = f'"Not;A=Brand";v="8", "Chromium";v="{chrome_version}", "Google Chrome";v="{chrome_version}"'
-    
-    # 构建动态 Headers
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json, text/event-stream",
-        "User-Agent": user_agent,
-        "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8,en-US;q=0.7",
-        "sec-ch-ua-mobile": "?0",
-        "sec-ch-ua-platform": '"Windows"',
-        "sec-fetch-dest": "empty",
-        "sec-fetch-mode": "cors",
-        "sec-fetch-site": "same-origin",
-        "X-FE-Version": "prod-fe-1.0.70",
-        "Origin": settings.CLIENT_HEADERS["Origin"],
-        "Cache-Control": "no-cache",
-        "Pragma": "no-cache",
-    }
-    
-    # 只有基于 Chromium 的浏览器才添加 sec-ch-ua
-    if sec_ch_ua:
-        headers["sec-ch-ua"] = sec_ch_ua
+def get_browser_headers(referer_chat_id: str = "", token: Optional[str] = None) -> Dict[str, str]:
+    """Get browser headers for API requests from the precomputed profile pool
+
+    同一个 token 始终使用同一套请求头画像，保证指纹一致。
+    """
+    pool = get_header_pool()
+    headers = pool.headers(pool.index_for_token(token))
     
     # 添加 Referer
     if referer_chat_id:
@@ -148,14 +126,16 @@ def get_browser_headers(referer_chat_id: str = "") -> Dict[str, str]:
     
     # 调试日志
     if settings.DEBUG_LOGGING:
-        debug_log(f"使用 User-Agent: {user_agent[:100]}...")
+        debug_log(f"使用 User-Agent: {headers['User-Agent'][:100]}...")
     
     return headers
 
 
 def get_anonymous_token() -> str:
     """Get anonymous token for authentication"""
-    headers = get_browser_headers()
+    pool = get_header_pool()
+    profile_index = pool.choose_index()
+    headers = pool.headers(profile_index)
     headers.update({
         "Accept": "*/*",
         "Accept-Language": "zh-CN,zh;q=0.9",
@@ -163,7 +143,7 @@ def get_anonymous_token() -> str:
     })
     
     try:
-        response = requests.get(
+        response = get_upstream_session().get(
             f"{settings.CLIENT_HEADERS['Origin']}/api/v1/auths/",
             headers=headers,
             timeout=10.0
@@ -177,6 +157,8 @@ def get_anonymous_token() -> str:
         if not token:
             raise Exception("anon token empty")
         
+        # 后续使用该 token 的上游请求沿用获取 token 时的浏览器画像
+        pool.bind(token, profile_index)
         return token
     except Exception as e:
         debug_log(f"获取匿名token失败: {e}")
@@ -197,7 +179,8 @@ def get_auth_token(downstream_key: Optional[str] = None) -> str:
     # 如果启用了匿名模式，尝试获取匿名token
     if settings.ANONYMOUS_MODE:
         try:
-            token = get_anonymous_token()
+            pool = get_token_pool()
+            token = pool.acquire() if pool else get_anonymous_token()
             debug_log(f"匿名token获取成功: {token[:10]}...")
             return token
         except Exception as e:
@@ -207,6 +190,23 @@ def get_auth_token(downstream_key: Optional[str] = None) -> str:
     return settings.BACKUP_TOKEN
 
 
+def key_digest(downstream_key: Optional[str]) -> str:
+    """Stable hash of a downstream key, for storing or showing per-key state without the key itself"""
+    return hashlib.sha256((downstream_key or "").encode("utf-8")).hexdigest()[:32]
+
+
+def check_rate_limit(downstream_key: Optional[str]) -> int:
+    """按下游key计数（所有 worker 共享），超出 RATE_LIMIT_PER_MINUTE 时返回需等待的秒数，否则返回 0"""
+    if settings.RATE_LIMIT_PER_MINUTE <= 0:
+        return 0
+    # 计数器以 key 的哈希存储，避免明文 key 落在共享文件中
+    key = "rate:" + key_digest(downstream_key)
+    count = get_shared_state().incr(key, window=60.0)
+    if count <= settings.RATE_LIMIT_PER_MINUTE:
+        return 0
+    return max(1, int(60 - time.time() % 60))
+
+
 def get_fallback_token() -> str:
     """获取回退token：优先尝试匿名token，失败则使用备份token"""
     # 总是优先尝试匿名token（即使未开启 ANONYMOUS_MODE）
@@ -248,27 +248,24 @@ def call_upstream_api(
     upstream_req: Any,
     chat_id: str,
     auth_token: str,
-    downstream_key: Optional[str] = None
+    downstream_key: Optional[str] = None,
+    endpoint: Optional[str] = None,
+    timeout: Any = 60.0,
 ) -> requests.Response:
     """Call upstream API with proper headers and fallback logic.
 
     - zai: 使用站点端点与浏览器头；必要时回退匿名token
     - openai: 使用标准OpenAI兼容头；不进行匿名回退
+    - endpoint: 默认为 API_ENDPOINT；timeout: requests 的 (连接, 读取) 超时
     """
-    # 构造请求体
-    if hasattr(upstream_req, "model_dump"):
-        payload = upstream_req.model_dump(exclude_none=True)
-        try:
-            payload_dbg = upstream_req.model_dump_json()[:2000]
-        except Exception:
-            payload_dbg = str(payload)[:2000]
+    endpoint = endpoint or settings.API_ENDPOINT
+    # 构造请求体：chat_completions 传入已序列化的字节（见 upstream_builder），其他调用方可传模型或字典
+    if isinstance(upstream_req, bytes):
+        body = upstream_req
+    elif hasattr(upstream_req, "model_dump"):
+        body = upstream_req.model_dump_json(exclude_none=True).encode("utf-8")
     else:
-        payload = upstream_req
-        try:
-            import json as _json
-            payload_dbg = _json.dumps(payload, ensure_ascii=False)[:2000]
-        except Exception:
-            payload_dbg = str(payload)[:2000]
+        body = json.dumps(upstream_req, ensure_ascii=False).encode("utf-8")
 
     # 构造headers
     if settings.UPSTREAM_TYPE == "openai":
@@ -278,20 +275,22 @@ def call_upstream_api(
             "User-Agent": "zai2api-proxy/1.0",
         }
     else:
-        headers = get_browser_headers(chat_id)
+        headers = get_browser_headers(chat_id, auth_token)
 
     # Authorization
     headers["Authorization"] = f"Bearer {auth_token}"
 
-    debug_log(f"调用上游API: {settings.API_ENDPOINT}")
-    debug_log(f"上游请求体: {payload_dbg}")
+    debug_log(f"调用上游API: {endpoint}")
+    if settings.DEBUG_LOGGING:
+        debug_log(f"上游请求体: {body[:2000].decode('utf-8', 'replace')}")
     debug_log(f"使用认证token: {auth_token[:20]}...")
 
-    response = requests.post(
-        settings.API_ENDPOINT,
-        json=payload,
+    request_started = time.perf_counter()
+    response = get_upstream_session().post(
+        endpoint,
+        data=body,
         headers=headers,
-        timeout=60.0,
+        timeout=timeout,
         stream=True
     )
 
@@ -315,14 +314,56 @@ def call_upstream_api(
         # 重试请求
         debug_log("使用回退token重新调用上游API")
         debug_log(f"回退token: {fallback_token[:20]}...")
-        response = requests.post(
-            settings.API_ENDPOINT,
-            json=payload,
+        request_started = time.perf_counter()
+        response = get_upstream_session().post(
+            endpoint,
+            data=body,
             headers=headers,
-            timeout=60.0,
+            timeout=timeout,
             stream=True
         )
 
         debug_log(f"回退token上游响应状态: {response.status_code}")
 
+    # 录制模式：保存请求与原始SSE字节流，供回放服务器离线重放
+    if settings.RECORD_DIR:
+        from app.utils.recorder import UpstreamRecorder
+
+        recorder = UpstreamRecorder(
+            settings.RECORD_DIR,
+            upstream_type=settings.UPSTREAM_TYPE,
+            endpoint=endpoint,
+            payload=json.loads(body),
+            headers=headers,
+            secrets=[auth_token, headers["Authorization"][7:]],
+            tag=chat_id,
+            started=request_started,
+        )
+        response = recorder.attach(response)
+        debug_log("已启用上游录制")
+
     return response
+
+
+def upstream_endpoints() -> List[str]:
+    """API_ENDPOINT followed by UPSTREAM_FALLBACK_ENDPOINTS, used in turn when retrying"""
+    return [settings.API_ENDPOINT] + [e.strip() for e in settings.UPSTREAM_FALLBACK_ENDPOINTS.split(",") if e.strip()]
+
+
+def abort_upstream_response(response: requests.Response) -> None:
+    """Abort a streaming upstream response from another thread
+
+    仅调用 close() 无法唤醒阻塞在 recv 上的读取线程，这里先对底层 socket 执行 shutdown。
+    """
+    raw = getattr(response, "raw", None)
+    sock = getattr(getattr(raw, "_connection", None), "sock", None)
+    if sock is None:
+        # urllib3 已释放连接对象时，从 http.client 的文件对象中取 socket
+        fp = getattr(getattr(raw, "_fp", None), "fp", None)
+        sock = getattr(getattr(fp, "raw", None), "_sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
@@ -0,0 +1,95 @@
+"""
+Prefix cache for encoded upstream messages
+
+Agent 客户端每轮都会重发不断增长的完整历史。这里按消息列表的滚动哈希缓存已编码的前缀，
+新请求只需编码缓存前缀之后新增的消息。
+
+- 滚动哈希：key_i = hash((key_{i-1}, role, 文本, reasoning_content))，
+  种子包含工具提示词，工具集变化时不会命中旧前缀
+- 使用 Python 内置字符串哈希（进程内有效，且字符串对象会缓存自身哈希），
+  比 blake2b 等摘要快一个数量级；缓存只在单个 worker 内使用
+- 按字节数限制总大小，LRU 淘汰；同一对话前进一轮后，旧的较短前缀移到淘汰队列的最前面，
+  内存紧张时优先淘汰，但在被淘汰之前仍可供同一对话的其他分支（如重新生成）命中
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# 每个条目的额外开销估计（bytes 对象头与字典槽位）
+_ENTRY_OVERHEAD = 100
+
+
+class MessagePrefixCache:
+    """LRU cache of encoded message-list prefixes, bounded by total bytes"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[int, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def longest_prefix(self, keys: List[int]) -> Tuple[int, bytes]:
+        """(number of messages covered, encoded fragment) of the longest cached prefix"""
+        with self._lock:
+            for count in range(len(keys), 0, -1):
+                fragment = self._entries.get(keys[count - 1])
+                if fragment is not None:
+                    self._entries.move_to_end(keys[count - 1])
+                    self.hits += 1
+                    return count, fragment
+            self.misses += 1
+        return 0, b""
+
+    def store(self, key: int, fragment: bytes, replaces: Optional[int] = None) -> None:
+        """Cache a prefix; `replaces` is the shorter prefix it extends, which becomes the next to evict"""
+        cost = len(fragment) + _ENTRY_OVERHEAD
+        if cost > self.max_bytes:
+            return
+        with self._lock:
+            if replaces is not None and replaces in self._entries:
+                self._entries.move_to_end(replaces, last=False)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old) + _ENTRY_OVERHEAD
+            self._entries[key] = fragment
+            self._size += cost
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted) + _ENTRY_OVERHEAD
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+
+def prefix_keys(seed: int, messages: List[Any], texts: List[str]) -> List[int]:
+    """Rolling hash of every prefix of the message list"""
+    keys = []
+    key = seed
+    for message, text in zip(messages, texts):
+        key = hash((key, message.role, text, message.reasoning_content))
+        keys.append(key)
+    return keys
+
+
+_cache: Optional[MessagePrefixCache] = None
+
+
+def get_message_cache() -> Optional[MessagePrefixCache]:
+    """Process-wide prefix cache; None when MESSAGE_CACHE_MAX_BYTES is 0"""
+    global _cache
+    if _cache is None:
+        from app.core.config import settings
+
+        if settings.MESSAGE_CACHE_MAX_BYTES > 0:
+            _cache = MessagePrefixCache(settings.MESSAGE_CACHE_MAX_BYTES)
+    return _cache
@@ -0,0 +1,199 @@
+"""
+Upstream traffic recorder for offline replay
+
+录制格式（gzip 压缩的 JSON Lines）：
+- 第一行：元数据（上游类型、端点、脱敏后的请求头/请求体、响应状态与首字节耗时）
+- 后续每行：[相对首字节的秒数偏移, base64 编码的原始字节块]
+"""
+
+import base64
+import gzip
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from app.utils.helpers import debug_log
+
+CAPTURE_VERSION = 1
+CAPTURE_SUFFIX = ".sse.gz"
+REDACTED = "***REDACTED***"
+
+# 需要脱敏的请求头（小写比较）
+_SENSITIVE_HEADERS = {"authorization", "cookie", "x-api-key"}
+# 保留在录制文件中的响应头
+_KEPT_RESPONSE_HEADERS = ("Content-Type",)
+
+_capture_counter = itertools.count(1)
+
+
+def redact_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    """Return a copy of headers with credentials replaced"""
+    return {k: (REDACTED if k.lower() in _SENSITIVE_HEADERS else v) for k, v in headers.items()}
+
+
+def _redact_bytes(data: bytes, secrets: Iterable[bytes]) -> bytes:
+    for secret in secrets:
+        if secret and secret in data:
+            data = data.replace(secret, REDACTED.encode())
+    return data
+
+
+def _payload_to_json(payload: Any) -> Any:
+    """Convert request payload (dict/bytes/str) to a JSON-serializable object"""
+    if isinstance(payload, (bytes, bytearray)):
+        payload = bytes(payload).decode("utf-8", errors="replace")
+    if isinstance(payload, str):
+        try:
+            return json.loads(payload)
+        except json.JSONDecodeError:
+            return payload
+    return payload
+
+
+class UpstreamRecorder:
+    """Record one upstream exchange (request + raw SSE byte stream) to disk"""
+
+    def __init__(
+        self,
+        directory: str,
+        upstream_type: str,
+        endpoint: str,
+        payload: Any,
+        headers: Dict[str, str],
+        secrets: Optional[List[str]] = None,
+        tag: str = "",
+        started: Optional[float] = None,
+    ):
+        self.directory = directory
+        self.upstream_type = upstream_type
+        self.endpoint = endpoint
+        self.payload = payload
+        self.headers = redact_headers(headers)
+        self.secrets = [s.encode() for s in (secrets or []) if s]
+        self.tag = tag
+        self.started = started if started is not None else time.perf_counter()
+        self.first_byte_at: Optional[float] = None
+        self.status_code: Optional[int] = None
+        self.response_headers: Dict[str, str] = {}
+        self.chunks: List[Tuple[float, bytes]] = []
+        self.path: Optional[str] = None
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def attach(self, response: requests.Response) -> requests.Response:
+        """Wrap the response so every byte read from it is recorded"""
+        self.first_byte_at = time.perf_counter()
+        self.status_code = response.status_code
+        self.response_headers = {
+            k: response.headers[k] for k in _KEPT_RESPONSE_HEADERS if k in response.headers
+        }
+
+        original_iter_content = response.iter_content
+        original_close = response.close
+        recorder = self
+
+        # requests 的 iter_lines / content / json 都基于 iter_content 读取，包装它即可覆盖全部读取路径
+        def iter_content(chunk_size: int = 1, decode_unicode: bool = False):
+            try:
+                for chunk in original_iter_content(chunk_size=chunk_size, decode_unicode=decode_unicode):
+                    recorder.add_chunk(chunk)
+                    yield chunk
+            finally:
+                recorder.finish()
+
+        def close() -> None:
+            try:
+                original_close()
+            finally:
+                recorder.finish()
+
+        response.iter_content = iter_content
+        response.close = close
+        return response
+
+    def add_chunk(self, chunk: Any) -> None:
+        """Append one raw chunk with its time offset"""
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        if not chunk:
+            return
+        offset = time.perf_counter() - (self.first_byte_at or self.started)
+        self.chunks.append((offset, _redact_bytes(chunk, self.secrets)))
+
+    def finish(self) -> Optional[str]:
+        """Write the capture file once; safe to call multiple times"""
+        with self._lock:
+            if self._finished:
+                return self.path
+            self._finished = True
+
+        ttfb = (self.first_byte_at or self.started) - self.started
+        meta = {
+            "v": CAPTURE_VERSION,
+            "upstream_type": self.upstream_type,
+            "endpoint": self.endpoint,
+            "recorded_at": time.time(),
+            "request": {"headers": self.headers, "body": _payload_to_json(self.payload)},
+            "status": self.status_code,
+            "response_headers": self.response_headers,
+            "ttfb": round(ttfb, 6),
+        }
+
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_capture_counter)}"
+        if self.tag:
+            name += f"-{self.tag}"
+        path = os.path.join(self.directory, name + CAPTURE_SUFFIX)
+        tmp_path = path + ".tmp"
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                f.write(json.dumps(meta, ensure_ascii=False, separators=(",", ":")) + "\n")
+                for offset, chunk in self.chunks:
+                    encoded = base64.b64encode(chunk).decode("ascii")
+                    f.write(f"[{offset:.6f},\"{encoded}\"]\n")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            debug_log(f"写入录制文件失败: {e}")
+            return None
+
+        self.path = path
+        self.chunks = []
+        return path
+
+
+def load_capture(path: str) -> Dict[str, Any]:
+    """Load a capture file written by UpstreamRecorder
+
+    Returns:
+        dict: metadata plus ``chunks``: list of (offset_seconds, bytes)
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        meta = json.loads(f.readline())
+        if meta.get("v") != CAPTURE_VERSION:
+            raise ValueError(f"unsupported capture version: {meta.get('v')}")
+        chunks = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            offset, encoded = json.loads(line)
+            chunks.append((float(offset), base64.b64decode(encoded)))
+    meta["chunks"] = chunks
+    meta["path"] = path
+    return meta
+
+
+def iter_capture_paths(directory: str) -> List[str]:
+    """List capture files in a directory (sorted for deterministic replay)"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith(CAPTURE_SUFFIX)
+    )
@@ -0,0 +1,210 @@
+"""
+Cross-worker shared state
+
+多 worker 部署时，各进程需要共享匿名token池与按 key 的计数器（限流），
+否则每个 worker 各自获取token、各自限流，实际限额会被放大 worker 数倍。
+
+提供两种后端：
+- memory: 进程内实现，单 worker 时使用
+- sqlite: 同一主机上多进程共享的 SQLite（WAL 模式），默认放在 /dev/shm，
+  每个线程复用一个连接，lease / increment 均为单个 IMMEDIATE 事务内的原子操作
+"""
+
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+
+class SharedState(ABC):
+    """Interface shared by the memory and SQLite backends"""
+
+    # ---- anonymous token pool ----
+    @abstractmethod
+    def token_push(self, token: str, fetched_at: float, max_size: int, min_fetched_at: float = 0.0) -> bool:
+        """Drop tokens fetched before min_fetched_at, then add a token unless the pool holds max_size tokens"""
+
+    @abstractmethod
+    def token_lease(self, min_fetched_at: float) -> Optional[str]:
+        """Atomically remove and return the oldest token fetched after min_fetched_at"""
+
+    @abstractmethod
+    def token_count(self, min_fetched_at: float) -> int:
+        """Number of tokens fetched after min_fetched_at"""
+
+    @abstractmethod
+    def token_items(self, min_fetched_at: float) -> List[Tuple[str, float]]:
+        """(token, fetched_at) of the tokens fetched after min_fetched_at, oldest first"""
+
+    # ---- per-key counters ----
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1, window: float = 60.0) -> int:
+        """Add to a fixed-window counter and return the new value for the current window"""
+
+
+class MemorySharedState(SharedState):
+    """In-process backend (single worker)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: Deque[Tuple[str, float]] = deque()
+        self._counters: Dict[str, Tuple[float, int]] = {}
+
+    def token_push(self, token: str, fetched_at: float, max_size: int, min_fetched_at: float = 0.0) -> bool:
+        with self._lock:
+            # 过期的token不占用池的容量
+            self._tokens = deque(item for item in self._tokens if item[1] >= min_fetched_at)
+            if len(self._tokens) >= max_size:
+                return False
+            self._tokens.append((token, fetched_at))
+            return True
+
+    def token_lease(self, min_fetched_at: float) -> Optional[str]:
+        with self._lock:
+            while self._tokens:
+                token, fetched_at = self._tokens.popleft()
+                if fetched_at >= min_fetched_at:
+                    return token
+        return None
+
+    def token_count(self, min_fetched_at: float) -> int:
+        with self._lock:
+            return sum(1 for _, ts in self._tokens if ts >= min_fetched_at)
+
+    def token_items(self, min_fetched_at: float) -> List[Tuple[str, float]]:
+        with self._lock:
+            return [(t, ts) for t, ts in self._tokens if ts >= min_fetched_at]
+
+    def incr(self, key: str, amount: int = 1, window: float = 60.0) -> int:
+        window_start = time.time() // window * window
+        with self._lock:
+            start, value = self._counters.get(key, (window_start, 0))
+            value = value + amount if start == window_start else amount
+            self._counters[key] = (window_start, value)
+            return value
+
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS tokens (id INTEGER PRIMARY KEY AUTOINCREMENT, token TEXT UNIQUE, fetched_at REAL)",
+    "CREATE INDEX IF NOT EXISTS tokens_fetched_at ON tokens (fetched_at)",
+    "CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, window_start REAL, value INTEGER)",
+)
+
+
+class SqliteSharedState(SharedState):
+    """SQLite (WAL) backend shared by all workers on one host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        for statement in _SCHEMA:
+            conn.execute(statement)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # 共享状态是可丢弃的运行时数据，不需要 fsync
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, func):
+        """Run func(conn) inside a BEGIN IMMEDIATE transaction"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def token_push(self, token: str, fetched_at: float, max_size: int, min_fetched_at: float = 0.0) -> bool:
+        def push(conn: sqlite3.Connection) -> bool:
+            # 过期的token不占用池的容量
+            conn.execute("DELETE FROM tokens WHERE fetched_at < ?", (min_fetched_at,))
+            (count,) = conn.execute("SELECT COUNT(*) FROM tokens").fetchone()
+            if count >= max_size:
+                return False
+            conn.execute("INSERT OR IGNORE INTO tokens (token, fetched_at) VALUES (?, ?)", (token, fetched_at))
+            return True
+
+        return self._write(push)
+
+    def token_lease(self, min_fetched_at: float) -> Optional[str]:
+        def lease(conn: sqlite3.Connection) -> Optional[str]:
+            conn.execute("DELETE FROM tokens WHERE fetched_at < ?", (min_fetched_at,))
+            row = conn.execute("SELECT id, token FROM tokens ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM tokens WHERE id = ?", (row[0],))
+            return row[1]
+
+        return self._write(lease)
+
+    def token_count(self, min_fetched_at: float) -> int:
+        (count,) = self._conn().execute(
+            "SELECT COUNT(*) FROM tokens WHERE fetched_at >= ?", (min_fetched_at,)
+        ).fetchone()
+        return count
+
+    def token_items(self, min_fetched_at: float) -> List[Tuple[str, float]]:
+        rows = self._conn().execute(
+            "SELECT token, fetched_at FROM tokens WHERE fetched_at >= ? ORDER BY id", (min_fetched_at,)
+        ).fetchall()
+        return [(token, fetched_at) for token, fetched_at in rows]
+
+    def incr(self, key: str, amount: int = 1, window: float = 60.0) -> int:
+        window_start = time.time() // window * window
+
+        def increment(conn: sqlite3.Connection) -> int:
+            conn.execute(
+                "INSERT INTO counters (key, window_start, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                "value = CASE WHEN window_start = excluded.window_start THEN value + excluded.value "
+                "ELSE excluded.value END, window_start = excluded.window_start",
+                (key, window_start, amount),
+            )
+            (value,) = conn.execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()
+            return value
+
+        return self._write(increment)
+
+
+def default_state_path(port: int) -> str:
+    # 按端口区分，同一主机上的多个部署互不干扰
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"zai2api-{port}.db")
+
+
+def create_shared_state(backend: str, path: str) -> SharedState:
+    """Create a backend; "auto" is resolved to sqlite by serve.py when running several workers"""
+    if backend == "sqlite":
+        return SqliteSharedState(path)
+    return MemorySharedState()
+
+
+_state: Optional[SharedState] = None
+_state_lock = threading.Lock()
+
+
+def get_shared_state() -> SharedState:
+    """Get or create the process-wide shared state backend"""
+    global _state
+    if _state is None:
+        from app.core.config import settings
+
+        with _state_lock:
+            if _state is None:
+                path = settings.SHARED_STATE_PATH or default_state_path(settings.LISTEN_PORT)
+                _state = create_shared_state(settings.SHARED_STATE_BACKEND, path)
+    return _state
@@ -0,0 +1,104 @@
+"""
+Streaming stop-sequence matcher
+
+OpenAI `stop` 参数的流式实现：多个停止序列构建为 Aho-Corasick 自动机，逐个增量喂入文本，
+可以匹配跨越增量边界的停止序列。
+- 只扣留"可能是某个停止序列开头"的最短后缀（即自动机当前状态的深度），其余文本立即输出
+- 在第一个出现的停止序列处精确截断；同一位置结束的多个序列取最长的一个（起点最早）
+- 文本中不含任何停止序列首字符且没有扣留内容时直接放行，不进入逐字符循环
+"""
+
+from collections import deque
+from typing import Dict, List, Optional, Tuple, Union
+
+
+def normalize_stop(stop: Optional[Union[str, List[str]]]) -> List[str]:
+    """OpenAI `stop` (string or list) as a list of distinct non-empty sequences"""
+    if not stop:
+        return []
+    if isinstance(stop, str):
+        stop = [stop]
+    return [s for s in dict.fromkeys(stop) if isinstance(s, str) and s]
+
+
+class StopSequenceMatcher:
+    """Aho-Corasick automaton over the stop sequences, fed one delta at a time"""
+
+    def __init__(self, sequences: List[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._depth: List[int] = [0]
+        # 在该状态结束的最长停止序列长度，0 表示没有
+        self._match: List[int] = [0]
+        for sequence in sequences:
+            self._add(sequence)
+        self._link()
+        self._first = frozenset(self._goto[0])
+        self._state = 0
+        self._held = ""
+        self.matched = False
+
+    def _add(self, sequence: str) -> None:
+        state = 0
+        for char in sequence:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._depth.append(self._depth[state] + 1)
+                self._match.append(0)
+                self._goto[state][char] = next_state
+            state = next_state
+        self._match[state] = len(sequence)
+
+    def _link(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                self._match[next_state] = max(self._match[next_state], self._match[fail])
+                queue.append(next_state)
+
+    @property
+    def held(self) -> str:
+        """Text withheld because it may be the start of a stop sequence"""
+        return self._held
+
+    def feed(self, text: str) -> Tuple[str, bool]:
+        """(text safe to emit, whether a stop sequence was hit)"""
+        if self.matched:
+            return "", True
+        if not self._state and self._first.isdisjoint(text):
+            return text, False
+
+        goto, fail, match = self._goto, self._fail, self._match
+        pending = self._held + text
+        offset = len(self._held)
+        state = self._state
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if match[state]:
+                self.matched = True
+                self._held = ""
+                self._state = 0
+                return pending[:offset + index + 1 - match[state]], True
+
+        self._state = state
+        keep = self._depth[state]
+        self._held = pending[len(pending) - keep:] if keep else ""
+        return pending[:len(pending) - keep], False
+
+    def flush(self) -> str:
+        """Release withheld text at the end of the stream"""
+        held = "" if self.matched else self._held
+        self._held = ""
+        self._state = 0
+        return held
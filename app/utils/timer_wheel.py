@@ -0,0 +1,103 @@
+"""
+Shared hashed timer wheel
+
+上游各阶段超时与 SSE 心跳都需要为每个流维护定时器。这里用一个后台线程驱动的时间轮统一处理，
+不为每个流创建线程或任务：
+- 调度与取消均为 O(1)；取消只做标记，到期时跳过
+- 精度为一个 tick（默认 100ms），超时与心跳都不需要更高的精度
+- 回调在时间轮线程中执行，应当很快返回（如关闭 socket、写入标记）
+"""
+
+import threading
+import time
+from typing import Callable, List, Optional
+
+from app.utils.helpers import debug_log
+
+
+class Timer:
+    """A scheduled callback; cancel() is O(1)"""
+
+    __slots__ = ("deadline", "callback", "rounds", "cancelled")
+
+    def __init__(self, deadline: float, callback: Callable[[], None], rounds: int):
+        self.deadline = deadline
+        self.callback = callback
+        self.rounds = rounds
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class TimerWheel:
+    """Hashed timer wheel driven by one daemon thread"""
+
+    def __init__(self, tick: float = 0.1, slots: int = 512):
+        self.tick = tick
+        self.slots = slots
+        self._buckets: List[List[Timer]] = [[] for _ in range(slots)]
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._cursor = 0
+        self._thread: Optional[threading.Thread] = None
+        self.pending = 0
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> Timer:
+        """Run callback after roughly `delay` seconds"""
+        deadline = time.monotonic() + max(0.0, delay)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="timer-wheel", daemon=True)
+                self._thread.start()
+            # 向上取整到 tick，且至少在下一个 tick 触发
+            ticks = max(1, int((deadline - self._started_at) / self.tick + 0.999999) - self._cursor)
+            timer = Timer(deadline, callback, (ticks - 1) // self.slots)
+            self._buckets[(self._cursor + ticks) % self.slots].append(timer)
+            self.pending += 1
+        return timer
+
+    def _advance(self) -> List[Timer]:
+        """Move the cursor one tick and collect the timers that are due"""
+        with self._lock:
+            self._cursor += 1
+            bucket = self._buckets[self._cursor % self.slots]
+            due: List[Timer] = []
+            waiting: List[Timer] = []
+            for timer in bucket:
+                if timer.cancelled:
+                    self.pending -= 1
+                elif timer.rounds > 0:
+                    timer.rounds -= 1
+                    waiting.append(timer)
+                else:
+                    self.pending -= 1
+                    due.append(timer)
+            self._buckets[self._cursor % self.slots] = waiting
+            return due
+
+    def _run(self) -> None:
+        while True:
+            next_tick = self._started_at + (self._cursor + 1) * self.tick
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            for timer in self._advance():
+                try:
+                    timer.callback()
+                except Exception as e:
+                    debug_log(f"定时器回调失败: {e}")
+
+
+_wheel: Optional[TimerWheel] = None
+_wheel_lock = threading.Lock()
+
+
+def get_timer_wheel() -> TimerWheel:
+    """Process-wide timer wheel"""
+    global _wheel
+    if _wheel is None:
+        with _wheel_lock:
+            if _wheel is None:
+                _wheel = TimerWheel()
+    return _wheel
@@ -0,0 +1,89 @@
+"""
+Prefetched anonymous token pool
+
+预先获取若干匿名token，请求到来时直接取用，避免首个请求等待 /api/v1/auths/。
+每个token只分配给一个请求（与逐请求获取匿名token的语义一致，避免对话历史共享），
+取用后在后台线程中补充。token 存放在 SharedState 中，多 worker 时共用同一个池。
+"""
+
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from app.utils.shared_state import MemorySharedState, SharedState
+
+
+class AnonymousTokenPool:
+    """Bounded pool of single-use anonymous tokens with background refill"""
+
+    def __init__(self, fetch: Callable[[], str], size: int, ttl: float, state: Optional[SharedState] = None):
+        self.fetch = fetch
+        self.size = size
+        self.ttl = ttl
+        self.state = state if state is not None else MemorySharedState()
+        self._lock = threading.Lock()
+        self._refilling = False
+
+    def __len__(self) -> int:
+        return self.state.token_count(self._min_fetched_at())
+
+    def _min_fetched_at(self) -> float:
+        return time.time() - self.ttl
+
+    def _pop_fresh(self) -> Optional[str]:
+        return self.state.token_lease(self._min_fetched_at())
+
+    def put(self, token: str, fetched_at: Optional[float] = None) -> bool:
+        fetched_at = fetched_at if fetched_at is not None else time.time()
+        return self.state.token_push(token, fetched_at, self.size, self._min_fetched_at())
+
+    def acquire(self) -> str:
+        """Take a fresh token, fetching synchronously when the pool is empty"""
+        token = self._pop_fresh()
+        self.refill_async()
+        if token:
+            return token
+        return self.fetch()
+
+    def fill(self) -> int:
+        """Fetch tokens until the pool is full; returns the number fetched"""
+        fetched = 0
+        while len(self) < self.size:
+            try:
+                token = self.fetch()
+            except Exception:
+                break
+            # 其他 worker 可能同时在补充，池满时放弃多取的token
+            if not self.put(token):
+                break
+            fetched += 1
+        return fetched
+
+    def refill_async(self) -> None:
+        """Refill in a daemon thread unless a refill is already running"""
+        with self._lock:
+            if self._refilling or len(self) >= self.size:
+                return
+            self._refilling = True
+
+        def run() -> None:
+            try:
+                self.fill()
+            finally:
+                with self._lock:
+                    self._refilling = False
+
+        threading.Thread(target=run, name="anon-token-refill", daemon=True).start()
+
+    def snapshot(self) -> List[Tuple[str, float]]:
+        """Tokens still valid, for the warm-state file"""
+        return self.state.token_items(self._min_fetched_at())
+
+    def restore(self, entries: List[Tuple[str, float]]) -> int:
+        """Load tokens saved by snapshot(); expired ones are dropped"""
+        min_fetched_at = self._min_fetched_at()
+        restored = 0
+        for token, fetched_at in entries:
+            if fetched_at >= min_fetched_at and self.put(token, fetched_at):
+                restored += 1
+        return restored
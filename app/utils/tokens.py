@@ -0,0 +1,84 @@
+"""
+Fast token estimation
+
+不依赖分词器的近似估算，用于上下文窗口裁剪等需要在请求路径上快速判断长度的场景：
+- ASCII 文本约 4 个字符一个 token
+- 中日韩等多字节字符约 1 个字符一个 token（GLM 分词器实际略少，估算偏保守）
+
+非 ASCII 字符数由 UTF-8 字节数推算（CJK 字符占 3 字节），全部在 C 层完成，
+对 10 万字符的文本耗时约几十微秒。
+OutputBudget 以同样的规则增量计数流式输出，用于在本地执行 max_tokens。
+"""
+
+from typing import Optional
+
+# 每条消息的角色、分隔符等额外开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Approximate token count of a piece of text"""
+    if not text:
+        return 0
+    length = len(text)
+    if text.isascii():
+        return (length + 3) // 4
+    # 每个 3 字节字符多出 2 字节，每个 2 字节字符多出 1 字节
+    wide = (len(text.encode("utf-8", "surrogatepass")) - length + 1) // 2
+    return (length - wide + 3) // 4 + wide
+
+
+def estimate_message_tokens(text: str, reasoning_content: Optional[str] = None) -> int:
+    """Approximate tokens of one chat message as sent upstream"""
+    return MESSAGE_OVERHEAD_TOKENS + estimate_tokens(text) + estimate_tokens(reasoning_content)
+
+
+class OutputBudget:
+    """Streaming max_tokens enforcement over emitted text
+
+    增量累计 ASCII 与宽字符数，按与 estimate_tokens 相同的规则换算，
+    各个增量的计数等价于对拼接后的全文估算，不会因为逐块取整而偏大。
+    """
+
+    __slots__ = ("max_tokens", "count_reasoning", "exhausted", "_ascii", "_wide")
+
+    def __init__(self, max_tokens: int, count_reasoning: bool = False):
+        self.max_tokens = max_tokens
+        self.count_reasoning = count_reasoning
+        self.exhausted = False
+        self._ascii = 0
+        self._wide = 0
+
+    @property
+    def used(self) -> int:
+        return (self._ascii + 3) // 4 + self._wide
+
+    def take(self, text: str, reasoning: bool = False) -> str:
+        """The part of text that fits in the remaining budget; sets exhausted once it is used up"""
+        if not text or (reasoning and not self.count_reasoning):
+            return text
+        if self.exhausted:
+            return ""
+        length = len(text)
+        wide = 0 if text.isascii() else (len(text.encode("utf-8", "surrogatepass")) - length + 1) // 2
+        ascii_chars = self._ascii + length - wide
+        wide_chars = self._wide + wide
+        if (ascii_chars + 3) // 4 + wide_chars <= self.max_tokens:
+            self._ascii, self._wide = ascii_chars, wide_chars
+            self.exhausted = self.used >= self.max_tokens
+            return text
+
+        # 只有最后一个增量需要逐字符定位截断点
+        ascii_chars, wide_chars = self._ascii, self._wide
+        end = 0
+        for char in text:
+            if char < "\x80":
+                ascii_chars += 1
+            else:
+                wide_chars += 1
+            if (ascii_chars + 3) // 4 + wide_chars > self.max_tokens:
+                break
+            end += 1
+            self._ascii, self._wide = ascii_chars, wide_chars
+        self.exhausted = True
+        return text[:end]
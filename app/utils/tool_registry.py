@@ -0,0 +1,150 @@
+"""
+Compiled tool-schema registry
+
+按内容哈希驻留（intern）请求中的工具集，渲染后的工具提示词只生成一次。
+提供两种渲染模式（TOOL_PROMPT_MODE）：
+- full: 与 generate_tool_prompt 相同的详细 Markdown（默认）
+- compact: 每个函数一行签名，省略参数描述，大型工具集可显著缩短注入的提示词与上游预填充时间
+
+用法：python -m app.utils.tool_registry tools.json  # 对比两种模式下工具集增加的提示词字符数
+"""
+
+import hashlib
+import json
+import marshal
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.utils.tools import generate_tool_prompt
+
+PROMPT_MODES = ("full", "compact")
+
+COMPACT_CALL_FORMAT = (
+    "\n# CALL FORMAT\n"
+    "To call functions, reply ONLY with a ```json block, no other text:\n"
+    '{"tool_calls":[{"id":"call_1","type":"function","function":{"name":"NAME","arguments":"{\\"param\\":\\"value\\"}"}}]}\n'
+    "`arguments` must be a JSON string. Parameters marked ? are optional.\n"
+)
+
+
+def _compact_type(schema: Dict[str, Any]) -> str:
+    if not isinstance(schema, dict):
+        return "any"
+    if schema.get("enum"):
+        return "|".join(json.dumps(v, ensure_ascii=False) for v in schema["enum"])
+    schema_type = schema.get("type", "any")
+    if schema_type == "array":
+        return _compact_type(schema.get("items") or {}) + "[]"
+    if isinstance(schema_type, list):
+        return "|".join(str(t) for t in schema_type)
+    return str(schema_type)
+
+
+def render_compact_prompt(tools: List[Dict[str, Any]]) -> str:
+    """One signature line per function: name(param: type, optional?: type): description"""
+    lines = []
+    for tool in tools:
+        if tool.get("type") != "function":
+            continue
+        function_spec = tool.get("function", {}) or {}
+        parameters = function_spec.get("parameters", {}) or {}
+        required = set(parameters.get("required", []) or [])
+        params = ", ".join(
+            f"{name}{'' if name in required else '?'}: {_compact_type(details or {})}"
+            for name, details in (parameters.get("properties", {}) or {}).items()
+        )
+        line = f"- {function_spec.get('name', 'unknown')}({params})"
+        description = (function_spec.get("description") or "").strip().split("\n", 1)[0]
+        if description:
+            line += f": {description}"
+        lines.append(line)
+    if not lines:
+        return ""
+    return "\n\n# FUNCTIONS\n" + "\n".join(lines) + "\n" + COMPACT_CALL_FORMAT
+
+
+def _fingerprint(tools: List[Dict[str, Any]]) -> bytes:
+    """Exact serialization of the tool list, much cheaper than json.dumps or rendering"""
+    try:
+        # version 2 不使用对象引用，输出只取决于内容
+        return marshal.dumps(tools, 2)
+    except ValueError:
+        return repr(tools).encode("utf-8")
+
+
+class CompiledToolset:
+    """A tool set with its prompts rendered once"""
+
+    def __init__(self, tools: List[Dict[str, Any]], toolset_id: str):
+        self.id = toolset_id
+        self.names = [(t.get("function") or {}).get("name", "unknown") for t in tools if t.get("type") == "function"]
+        self.prompts = {
+            "full": generate_tool_prompt(tools),
+            "compact": render_compact_prompt(tools),
+        }
+
+    def prompt(self, mode: Optional[str] = None) -> str:
+        return self.prompts.get(mode or settings.TOOL_PROMPT_MODE, self.prompts["full"])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "functions": len(self.names),
+            "full_chars": len(self.prompts["full"]),
+            "compact_chars": len(self.prompts["compact"]),
+        }
+
+
+class ToolRegistry:
+    """LRU registry of compiled tool sets, keyed by content"""
+
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        self._toolsets: "OrderedDict[bytes, CompiledToolset]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._toolsets)
+
+    def compile(self, tools: List[Dict[str, Any]]) -> CompiledToolset:
+        key = _fingerprint(tools)
+        with self._lock:
+            toolset = self._toolsets.get(key)
+            if toolset is not None:
+                self._toolsets.move_to_end(key)
+                return toolset
+        toolset = CompiledToolset(tools, hashlib.blake2b(key, digest_size=8).hexdigest())
+        with self._lock:
+            self._toolsets[key] = toolset
+            while len(self._toolsets) > self.capacity:
+                self._toolsets.popitem(last=False)
+        return toolset
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [toolset.stats() for toolset in self._toolsets.values()]
+
+
+_registry: Optional[ToolRegistry] = None
+
+
+def get_tool_registry() -> ToolRegistry:
+    global _registry
+    if _registry is None:
+        _registry = ToolRegistry()
+    return _registry
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], encoding="utf-8") as f:
+        data = json.load(f)
+    # 支持直接传入 tools 数组或完整的请求体
+    toolset = CompiledToolset(data["tools"] if isinstance(data, dict) else data, "cli")
+    stats = toolset.stats()
+    print(f"函数数量: {stats['functions']}")
+    print(f"full 模式提示词: {stats['full_chars']} 字符")
+    print(f"compact 模式提示词: {stats['compact_chars']} 字符 "
+          f"({(1 - stats['compact_chars'] / max(1, stats['full_chars'])) * 100:.1f}% 更短)")
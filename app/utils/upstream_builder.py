@@ -0,0 +1,218 @@
+"""
+Single-pass upstream payload builder
+
+从校验后的 OpenAIRequest 一次遍历直接生成上游请求体字节，取代
+model_dump → process_messages_with_tools → Message → UpstreamRequest → model_dump 的多次复制。
+每个模型不变的字段（model、features、model_item、background_tasks、mcp_servers 等）只编码一次；
+多轮对话中已编码的消息前缀由 message_cache 复用，只有新增消息需要编码。
+生成结果与原流程在 JSON 语义上一致（见 tests/test_upstream_builder.py）。
+"""
+
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.models.schemas import Message, OpenAIRequest
+from app.utils.message_cache import get_message_cache, prefix_keys
+from app.utils.tool_registry import CompiledToolset, get_tool_registry
+
+# 复用同一个编码器，避免 json.dumps 带参数时每次重新构造 JSONEncoder
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+DEFAULT_SYSTEM_PROMPT = "你是一个有用的助手。"
+TOOL_CHOICE_HINT = "\n\n请根据需要使用提供的工具函数。"
+
+_fragment_cache: Dict[str, bytes] = {}
+
+
+def _encode(value: Any) -> bytes:
+    return _dumps(value).encode("utf-8")
+
+
+def resolve_upstream_model(model: str) -> Tuple[str, str]:
+    """(zai upstream model id, openai upstream model name) for a requested model"""
+    if model == settings.AIR_MODEL:
+        return "0727-106B-API", "GLM-4.5-Air"
+    return "0727-360B-API", "GLM-4.5"
+
+
+def _build_static_fragment(model: str) -> bytes:
+    is_thinking = model == settings.THINKING_MODEL
+    is_search = model == settings.SEARCH_MODEL
+    upstream_model_id, upstream_model_name = resolve_upstream_model(model)
+    fields = {
+        "model": upstream_model_id,
+        "params": {},
+        "features": {
+            "enable_thinking": is_thinking,
+            "web_search": is_search,
+            "auto_web_search": is_search,
+        },
+        "background_tasks": {
+            "title_generation": False,
+            "tags_generation": False,
+        },
+        "mcp_servers": ["deep-web-search"] if is_search else [],
+        "model_item": {"id": upstream_model_id, "name": upstream_model_name, "owned_by": "openai"},
+        "tool_servers": [],
+    }
+    # 去掉外层大括号，作为对象中的一段字段直接拼接
+    return _encode(fields)[1:-1]
+
+
+def static_fragment(model: str) -> bytes:
+    """Pre-encoded per-model fields of the zai upstream request"""
+    fragment = _fragment_cache.get(model)
+    if fragment is None:
+        fragment = _fragment_cache[model] = _build_static_fragment(model)
+    return fragment
+
+
+def message_text(content: Any) -> str:
+    """Flatten Message.content (str / content parts / None) to text, like content_to_string"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            if isinstance(part, str):
+                parts.append(part)
+            elif getattr(part, "type", None) == "text":
+                parts.append(part.text or "")
+        return " ".join(parts)
+    return ""
+
+
+def upstream_message(role: str, content: str, reasoning_content: Optional[str] = None) -> Dict[str, Any]:
+    message: Dict[str, Any] = {"role": role, "content": content}
+    if reasoning_content is not None:
+        message["reasoning_content"] = reasoning_content
+    return message
+
+
+def tool_choice_hint(tool_choice: Any) -> str:
+    if tool_choice in ("required", "auto"):
+        return TOOL_CHOICE_HINT
+    if isinstance(tool_choice, dict) and tool_choice.get("type") == "function":
+        name = (tool_choice.get("function") or {}).get("name")
+        if name:
+            return f"\n\n请使用 {name} 函数来处理这个请求。"
+    return ""
+
+
+def request_toolset(request: OpenAIRequest) -> Optional[CompiledToolset]:
+    """Compiled tool set to inject, or None when tools are absent or disabled"""
+    if request.tools and settings.TOOL_SUPPORT and request.tool_choice != "none":
+        return get_tool_registry().compile(request.tools)
+    return None
+
+
+def _tool_context(request: OpenAIRequest, toolset: Optional[CompiledToolset]) -> Tuple[bool, str, str]:
+    """(inject tools, tool prompt, tool-choice hint for the last user message)"""
+    if toolset is None:
+        toolset = request_toolset(request)
+    if toolset is None:
+        return False, "", ""
+    return True, toolset.prompt(), tool_choice_hint(request.tool_choice)
+
+
+def _needs_default_system(request: OpenAIRequest, inject: bool) -> bool:
+    return inject and not any(m.role == "system" for m in request.messages)
+
+
+def convert_message(message: Message, text: str, tools_prompt: str = "", hint: str = "") -> Dict[str, Any]:
+    """Upstream form of one message; `text` is message_text(message.content)"""
+    role = message.role
+    if role in ("tool", "function"):
+        # 工具结果以 assistant 消息发送给上游；Message 模型没有 name 字段，与原流程一致显示为 unknown
+        return upstream_message("assistant", f"工具 unknown 返回结果:\n```json\n{text}\n```")
+    if role == "system":
+        text += tools_prompt
+    elif role == "user":
+        text += hint
+    return upstream_message(role, text, message.reasoning_content)
+
+
+def upstream_messages(request: OpenAIRequest, toolset: Optional[CompiledToolset] = None) -> List[Dict[str, Any]]:
+    """Upstream message list (tool prompt injected, tool results rewritten, content flattened)"""
+    inject, tools_prompt, hint = _tool_context(request, toolset)
+    messages = request.messages
+    result: List[Dict[str, Any]] = []
+    if _needs_default_system(request, inject):
+        result.append(upstream_message("system", DEFAULT_SYSTEM_PROMPT + tools_prompt))
+    last = len(messages) - 1
+    for index, message in enumerate(messages):
+        result.append(convert_message(message, message_text(message.content), tools_prompt, hint if index == last else ""))
+    return result
+
+
+def encode_messages(request: OpenAIRequest, toolset: Optional[CompiledToolset] = None) -> bytes:
+    """Encoded upstream message list, reusing cached prefixes of earlier turns"""
+    cache = get_message_cache()
+    messages = request.messages
+    if cache is None or len(messages) < 2:
+        # 整个消息列表一次交给 C 编码器，比逐条编码再拼接更快
+        return _encode(upstream_messages(request, toolset))
+
+    inject, tools_prompt, hint = _tool_context(request, toolset)
+    prepend = _needs_default_system(request, inject)
+    texts = [message_text(m.content) for m in messages]
+    keys = prefix_keys(hash((inject, prepend, tools_prompt)), messages, texts)
+
+    # 最后一条消息可能附加工具提示，不进入缓存
+    cacheable = len(messages) - 1
+    count, prefix = cache.longest_prefix(keys[:cacheable])
+    if count < cacheable:
+        new: List[Dict[str, Any]] = []
+        if count == 0 and prepend:
+            new.append(upstream_message("system", DEFAULT_SYSTEM_PROMPT + tools_prompt))
+        new.extend(convert_message(messages[i], texts[i], tools_prompt) for i in range(count, cacheable))
+        encoded = _encode(new)[1:-1]
+        prefix = prefix + b"," + encoded if prefix else encoded
+        cache.store(keys[cacheable - 1], prefix, replaces=keys[count - 1] if count else None)
+
+    last = _encode(convert_message(messages[-1], texts[-1], tools_prompt, hint))
+    return b"[" + prefix + b"," + last + b"]"
+
+
+def build_upstream_payload(
+    request: OpenAIRequest, chat_id: str, msg_id: str, toolset: Optional[CompiledToolset] = None
+) -> bytes:
+    """Serialize the upstream request body for the configured UPSTREAM_TYPE
+
+    toolset: 调用方已通过 request_toolset 取得的工具集，避免重复计算指纹
+    """
+    messages = encode_messages(request, toolset)
+
+    if settings.UPSTREAM_TYPE == "openai":
+        _, upstream_model_name = resolve_upstream_model(request.model)
+        parts = [
+            b'{"model":', _encode(upstream_model_name),
+            b',"messages":', messages,
+            b',"stream":', b"true" if request.stream else b"false",
+        ]
+        if request.tools:
+            parts += [b',"tools":', _encode(request.tools)]
+        if request.tool_choice is not None:
+            parts += [b',"tool_choice":', _encode(request.tool_choice)]
+        if request.max_tokens is not None:
+            parts += [b',"max_tokens":', _encode(request.max_tokens)]
+        if request.stop:
+            parts += [b',"stop":', _encode(request.stop)]
+        parts.append(b"}")
+        return b"".join(parts)
+
+    variables = {
+        "{{USER_NAME}}": "User",
+        "{{USER_LOCATION}}": "Unknown",
+        "{{CURRENT_DATETIME}}": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    return b"".join([
+        b'{"stream":true,"chat_id":', _encode(chat_id),
+        b',"id":', _encode(msg_id),
+        b",", static_fragment(request.model),
+        b',"messages":', messages,
+        b',"variables":', _encode(variables),
+        b"}",
+    ])
@@ -0,0 +1,407 @@
+"""
+End-to-end async load generator for /v1/chat/completions
+
+用法：
+    # 闭环：固定并发
+    python -m benchmarks.load_test --scenario mix --concurrency 32 --duration 60 --server-pid $(pgrep -f "uvicorn main:app")
+    # 开环：固定到达率（请求/秒）
+    python -m benchmarks.load_test --scenario short_chat --rate 50 --duration 60 --output results.json
+    # 与历史结果对比
+    python -m benchmarks.load_test --scenario mix --concurrency 32 --compare baseline.json
+
+输出 RPS、首 token 延迟（TTFT）p50/p95/p99、chunk 间隔、每流 CPU 与每流 RSS，
+并可写入 JSON 结果文件，便于跨提交对比。为避免客户端依赖，内置一个最小的 asyncio HTTP/1.1 客户端。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from benchmarks.scenarios import SCENARIOS, build_session
+
+RESULT_SCHEMA = 1
+
+
+class RequestResult:
+    """Timing of one request as seen by the client"""
+
+    __slots__ = ("status", "error", "started", "ttft", "latency", "gaps", "chunks", "bytes")
+
+    def __init__(self, started: float):
+        self.status = 0
+        self.error: Optional[str] = None
+        self.started = started
+        self.ttft: Optional[float] = None
+        self.latency: Optional[float] = None
+        self.gaps: List[float] = []
+        self.chunks = 0
+        self.bytes = 0
+
+
+def _has_output(payload: bytes) -> bool:
+    """Whether an SSE data payload carries client-visible output"""
+    if payload.strip() == b"[DONE]":
+        return False
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return False
+    for choice in data.get("choices") or []:
+        delta = choice.get("delta") or {}
+        if delta.get("content") or delta.get("reasoning_content") or delta.get("tool_calls"):
+            return True
+    return False
+
+
+async def _read_body(reader: asyncio.StreamReader, headers: Dict[str, str]):
+    """Yield raw body pieces, handling chunked and content-length framing"""
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size_line = await reader.readline()
+            if not size_line:
+                return
+            size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                await reader.readline()
+                return
+            data = await reader.readexactly(size)
+            await reader.readexactly(2)
+            yield data
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining > 0:
+            data = await reader.read(min(remaining, 65536))
+            if not data:
+                return
+            remaining -= len(data)
+            yield data
+    else:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            yield data
+
+
+async def send_request(url: str, api_key: str, body: Dict[str, Any], timeout: float) -> RequestResult:
+    """POST one chat completion request and measure TTFT / inter-chunk gaps"""
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or (443 if parts.scheme == "https" else 80)
+    payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    request_head = (
+        f"POST {parts.path or '/'} HTTP/1.1\r\n"
+        f"Host: {host}:{port}\r\n"
+        f"Authorization: Bearer {api_key}\r\n"
+        "Content-Type: application/json\r\n"
+        "Accept: text/event-stream, application/json\r\n"
+        f"Content-Length: {len(payload)}\r\n"
+        "Connection: close\r\n\r\n"
+    ).encode("latin-1")
+
+    result = RequestResult(time.perf_counter())
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=parts.scheme == "https"), timeout
+        )
+        writer.write(request_head + payload)
+        await writer.drain()
+
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        result.status = int(status_line.split()[1])
+        headers: Dict[str, str] = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        streaming = headers.get("content-type", "").startswith("text/event-stream")
+        buffer = b""
+        last_chunk_at: Optional[float] = None
+        body_iter = _read_body(reader, headers).__aiter__()
+        while True:
+            try:
+                data = await asyncio.wait_for(body_iter.__anext__(), timeout)
+            except StopAsyncIteration:
+                break
+            now = time.perf_counter()
+            result.bytes += len(data)
+            if not streaming:
+                buffer += data
+                continue
+            buffer += data
+            while b"\n\n" in buffer:
+                event, buffer = buffer.split(b"\n\n", 1)
+                for line in event.split(b"\n"):
+                    if not line.startswith(b"data:"):
+                        continue
+                    if not _has_output(line[5:].strip()):
+                        continue
+                    result.chunks += 1
+                    if result.ttft is None:
+                        result.ttft = now - result.started
+                    if last_chunk_at is not None:
+                        result.gaps.append(now - last_chunk_at)
+                    last_chunk_at = now
+
+        result.latency = time.perf_counter() - result.started
+        if not streaming:
+            # 非流式：首 token 即完整响应到达
+            result.ttft = result.latency
+            result.chunks = 1
+        if result.status != 200:
+            result.error = f"HTTP {result.status}"
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+        result.latency = time.perf_counter() - result.started
+    finally:
+        if writer is not None:
+            writer.close()
+    return result
+
+
+class ProcessSampler:
+    """Sample CPU time and RSS of the server process tree via /proc (Linux only)"""
+
+    def __init__(self, pid: Optional[int]):
+        self.pid = pid
+        self.clock_ticks = os.sysconf("SC_CLK_TCK") if pid else 100
+        self.peak_rss_kb = 0
+        self.baseline_rss_kb = 0
+
+    def _tree(self) -> List[int]:
+        pids, stack = [], [self.pid]
+        while stack:
+            pid = stack.pop()
+            pids.append(pid)
+            try:
+                for task in os.listdir(f"/proc/{pid}/task"):
+                    with open(f"/proc/{pid}/task/{task}/children") as f:
+                        stack.extend(int(c) for c in f.read().split())
+            except OSError:
+                continue
+        return pids
+
+    def cpu_seconds(self) -> float:
+        if not self.pid:
+            return 0.0
+        total = 0
+        for pid in self._tree():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                total += int(fields[11]) + int(fields[12])  # utime + stime
+            except OSError:
+                continue
+        return total / self.clock_ticks
+
+    def rss_kb(self) -> int:
+        if not self.pid:
+            return 0
+        total = 0
+        for pid in self._tree():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1])
+                            break
+            except OSError:
+                continue
+        return total
+
+    async def run(self, stop: asyncio.Event, interval: float = 0.2) -> None:
+        self.baseline_rss_kb = self.peak_rss_kb = self.rss_kb()
+        while not stop.is_set():
+            self.peak_rss_kb = max(self.peak_rss_kb, self.rss_kb())
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+def percentiles(values: List[float], scale: float = 1000.0) -> Dict[str, Optional[float]]:
+    """p50/p95/p99/mean in milliseconds"""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * scale, 3)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99),
+            "mean": round(sum(ordered) / len(ordered) * scale, 3)}
+
+
+class LoadGenerator:
+    """Drive sessions at a target concurrency (closed loop) or arrival rate (open loop)"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.url = args.url.rstrip("/") + "/v1/chat/completions"
+        self.rng = random.Random(args.seed)
+        self.results: List[RequestResult] = []
+        self.inflight = 0
+        self.peak_inflight = 0
+        self.sent = 0
+
+    def _budget_left(self, deadline: float) -> bool:
+        if self.args.requests and self.sent >= self.args.requests:
+            return False
+        return time.perf_counter() < deadline
+
+    async def _run_session(self, deadline: float) -> None:
+        for body in build_session(self.args.scenario, self.rng):
+            if not self._budget_left(deadline):
+                return
+            self.sent += 1
+            self.inflight += 1
+            self.peak_inflight = max(self.peak_inflight, self.inflight)
+            try:
+                result = await send_request(self.url, self.args.api_key, body, self.args.timeout)
+            finally:
+                self.inflight -= 1
+            self.results.append(result)
+
+    async def _closed_loop(self, deadline: float) -> None:
+        async def worker():
+            while self._budget_left(deadline):
+                await self._run_session(deadline)
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+
+    async def _open_loop(self, deadline: float) -> None:
+        tasks = set()
+        interval = 1.0 / self.args.rate
+        next_at = time.perf_counter()
+        while self._budget_left(deadline):
+            task = asyncio.ensure_future(self._run_session(deadline))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            # 泊松到达
+            next_at += self.rng.expovariate(1.0 / interval)
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def run(self) -> Dict[str, Any]:
+        sampler = ProcessSampler(self.args.server_pid)
+        stop = asyncio.Event()
+        sampler_task = asyncio.ensure_future(sampler.run(stop))
+        cpu_before = sampler.cpu_seconds()
+        started = time.perf_counter()
+        deadline = started + self.args.duration
+
+        if self.args.rate:
+            await self._open_loop(deadline)
+        else:
+            await self._closed_loop(deadline)
+
+        elapsed = time.perf_counter() - started
+        cpu_used = sampler.cpu_seconds() - cpu_before
+        stop.set()
+        await sampler_task
+        return self._report(elapsed, cpu_used, sampler)
+
+    def _report(self, elapsed: float, cpu_used: float, sampler: ProcessSampler) -> Dict[str, Any]:
+        ok = [r for r in self.results if r.error is None]
+        errors: Dict[str, int] = {}
+        for r in self.results:
+            if r.error:
+                errors[r.error.split(":")[0]] = errors.get(r.error.split(":")[0], 0) + 1
+
+        gaps = [g for r in ok for g in r.gaps]
+        report: Dict[str, Any] = {
+            "requests": len(self.results),
+            "succeeded": len(ok),
+            "errors": errors,
+            "elapsed_s": round(elapsed, 3),
+            "rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+            "ttft_ms": percentiles([r.ttft for r in ok if r.ttft is not None]),
+            "inter_chunk_ms": percentiles(gaps),
+            "latency_ms": percentiles([r.latency for r in ok if r.latency is not None]),
+            "chunks_per_s": round(sum(r.chunks for r in ok) / elapsed, 3) if elapsed else 0.0,
+            "peak_inflight": self.peak_inflight,
+        }
+        if sampler.pid:
+            report.update({
+                "cpu_ms_per_stream": round(cpu_used * 1000 / max(1, len(ok)), 3),
+                "rss_kb_per_stream": round((sampler.peak_rss_kb - sampler.baseline_rss_kb) / max(1, self.peak_inflight), 1),
+                "peak_rss_mb": round(sampler.peak_rss_kb / 1024, 1),
+            })
+        return report
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_comparison(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    rows: List[Tuple[str, Any, Any]] = [("rps", baseline["results"].get("rps"), current["results"].get("rps"))]
+    for group in ("ttft_ms", "inter_chunk_ms", "latency_ms"):
+        for q in ("p50", "p95", "p99"):
+            rows.append((f"{group}.{q}", baseline["results"][group].get(q), current["results"][group].get(q)))
+    for key in ("cpu_ms_per_stream", "rss_kb_per_stream"):
+        rows.append((key, baseline["results"].get(key), current["results"].get(key)))
+
+    print(f"\n对比基线 {baseline.get('commit')} -> {current.get('commit')}")
+    for name, old, new in rows:
+        if old in (None, 0) or new is None:
+            print(f"  {name:<22} {old!s:>10} -> {new!s:>10}")
+        else:
+            print(f"  {name:<22} {old:>10} -> {new:>10} ({(new - old) / old * 100:+.1f}%)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test /v1/chat/completions")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--api-key", default=os.getenv("AUTH_TOKEN", "sk-your-api-key"))
+    parser.add_argument("--scenario", default="mix", choices=sorted(list(SCENARIOS) + ["mix"]))
+    parser.add_argument("--concurrency", type=int, default=8, help="closed-loop concurrent sessions")
+    parser.add_argument("--rate", type=float, default=0.0, help="open-loop session arrival rate per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--requests", type=int, default=0, help="stop after N requests (0 = duration only)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--server-pid", type=int, default=None, help="pid of the proxy (CPU/RSS sampling)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--compare", help="baseline JSON results to compare against")
+    args = parser.parse_args()
+
+    results = asyncio.run(LoadGenerator(args).run())
+    document = {
+        "schema": RESULT_SCHEMA,
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "scenario": args.scenario,
+        "config": {
+            "concurrency": None if args.rate else args.concurrency,
+            "rate": args.rate or None,
+            "duration": args.duration,
+            "requests": args.requests or None,
+        },
+        "results": results,
+    }
+
+    print(json.dumps(document, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(document, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            _print_comparison(document, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Microbenchmarks for per-token and per-request hot paths
+
+用法：
+    python -m benchmarks.micro                     # 运行并与基线对比，超过阈值的退化以非零状态退出
+    python -m benchmarks.micro --filter sse        # 只运行名称包含 sse 的用例
+    python -m benchmarks.micro --update-baseline   # 重新生成基线（建议加 --rounds 9）
+
+为了让基线在不同机器间可比，每个用例的耗时都会除以一个固定纯 Python 负载的校准耗时后再比较。
+单次测量受调度与 CPU 频率波动影响较大，因此：
+- 测量分多轮进行，每轮依次测校准负载与各用例（各取 best-of-N），用例的归一化耗时取各轮比值的中位数
+- 超过阈值的用例会重新测量 --confirm 次，每次都仍超过阈值才算退化
+- 只用多轮测量的结果更新基线，不要用单次运行的结果覆盖
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import timeit
+from typing import Any, Callable, Dict, List, Tuple
+
+import requests
+
+from app.core.config import settings
+from app.core.response_handlers import create_openai_response_chunk
+from app.models.schemas import Delta, OpenAIRequest, UpstreamData
+from app.utils.helpers import get_browser_headers, transform_thinking_content
+from app.utils.sse_parser import SSEParser
+from app.utils.tools import (
+    extract_tool_invocations,
+    generate_tool_prompt,
+    process_messages_with_tools,
+    remove_tool_json_content,
+)
+from app.utils.tool_registry import ToolRegistry
+from app.utils.upstream_builder import build_upstream_payload
+from benchmarks.mock_upstream import MockProfile, build_zai_events, plan_answer
+from benchmarks.scenarios import SEARCH_TOOL, WEATHER_TOOL
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "micro.json")
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_ROUNDS = 5
+DEFAULT_CONFIRM = 2
+
+
+# ---------------------------------------------------------------------------
+# Fixtures
+# ---------------------------------------------------------------------------
+
+def _sse_body(events: List[Dict[str, Any]]) -> bytes:
+    return "".join(f"data: {json.dumps(e, ensure_ascii=False)}\n\n" for e in events).encode("utf-8")
+
+
+def _response(body: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(body)
+    return response
+
+
+def _make_tools(count: int) -> List[Dict[str, Any]]:
+    tools = []
+    for i in range(count):
+        base = WEATHER_TOOL if i % 2 == 0 else SEARCH_TOOL
+        tool = json.loads(json.dumps(base))
+        tool["function"]["name"] = f"{tool['function']['name']}_{i}"
+        tools.append(tool)
+    return tools
+
+
+def _history(length: int, tool_output_chars: int) -> List[Dict[str, Any]]:
+    messages: List[Dict[str, Any]] = [{"role": "system", "content": "You are an agent."}]
+    for i in range(length - 1):
+        kind = i % 4
+        if kind == 0:
+            messages.append({"role": "user", "content": [{"type": "text", "text": f"question {i} " * 20}]})
+        elif kind == 1:
+            messages.append({"role": "assistant", "content": f"answer {i} " * 40})
+        elif kind == 2:
+            messages.append({"role": "tool", "name": "search_docs", "content": "x" * tool_output_chars})
+        else:
+            messages.append({"role": "user", "content": f"follow up {i}"})
+    return messages
+
+
+class Fixtures:
+    """Realistic inputs shared by the benchmarks"""
+
+    def __init__(self, seed: int = 7):
+        rng = random.Random(seed)
+        profile = MockProfile(thinking_tokens=3000, answer_tokens=1000)
+        thinking, answer = plan_answer(profile, rng, thinking=True, tool_name=None)
+        self.stream_body = _sse_body(build_zai_events(thinking, answer, edit_content=True))
+
+        # 长思考链（约 20k 字符）与单个思考增量
+        self.thinking_trace = '<details type="reasoning" done="false">\n> ' + "".join(thinking) + "\n</details>"
+        self.thinking_delta = thinking[5]
+
+        # 200k 字符的工具输出（最坏情况：整段扫描但没有工具调用）
+        self.tool_output = ('{"items": [' + ", ".join(f'{{"id": {i}, "v": "value-{i}"}}' for i in range(8000)) + "]}")[:200_000]
+        self.tool_answer = 'Let me check.\n```json\n{"tool_calls": [{"id": "call_1", "type": "function", ' \
+                           '"function": {"name": "get_weather", "arguments": "{\\"city\\": \\"上海\\"}"}}]}\n```'
+
+        self.tools = _make_tools(20)
+        self.tools_50 = _make_tools(50)
+        self.tool_registry = ToolRegistry()
+        self.history = _history(50, tool_output_chars=4000)
+        self.request = OpenAIRequest(model=settings.PRIMARY_MODEL, messages=self.history, tools=self.tools, tool_choice="auto")
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+def build_benchmarks(fx: Fixtures) -> Dict[str, Callable[[], Any]]:
+    def sse_iter_events():
+        with SSEParser(_response(fx.stream_body)) as parser:
+            for _ in parser.iter_events():
+                pass
+
+    def sse_iter_json_data_upstream():
+        with SSEParser(_response(fx.stream_body)) as parser:
+            for _ in parser.iter_json_data(UpstreamData):
+                pass
+
+    def chunk_model_dump_json():
+        create_openai_response_chunk(model=settings.PRIMARY_MODEL, delta=Delta(content="token")).model_dump_json()
+
+    return {
+        "sse_iter_events": sse_iter_events,
+        "sse_iter_json_data_upstream": sse_iter_json_data_upstream,
+        "chunk_model_dump_json": chunk_model_dump_json,
+        "transform_thinking_delta": lambda: transform_thinking_content(fx.thinking_delta),
+        "transform_thinking_trace": lambda: transform_thinking_content(fx.thinking_trace),
+        "extract_tool_invocations_answer": lambda: extract_tool_invocations(fx.tool_answer),
+        "extract_tool_invocations_200k": lambda: extract_tool_invocations(fx.tool_output),
+        "remove_tool_json_content_200k": lambda: remove_tool_json_content(fx.tool_output),
+        "process_messages_with_tools_50": lambda: process_messages_with_tools(fx.history, fx.tools, "auto"),
+        "generate_tool_prompt_20": lambda: generate_tool_prompt(fx.tools),
+        "tool_registry_lookup_50": lambda: fx.tool_registry.compile(fx.tools_50),
+        "build_upstream_payload_50": lambda: build_upstream_payload(fx.request, "chat-id", "msg-id"),
+        "get_browser_headers": lambda: get_browser_headers("1234-5678"),
+    }
+
+
+def _calibration() -> int:
+    data = {"k": list(range(50)), "s": "abc" * 20}
+    total = 0
+    for i in range(2000):
+        total += len(json.dumps(data)) + i % 7
+    return total
+
+
+class Measurement:
+    """Best-of-N timing of one callable, with the loop count fixed up front"""
+
+    def __init__(self, func: Callable[[], Any], repeat: int = 3, min_time: float = 0.1):
+        self.timer = timeit.Timer(func)
+        number, _ = self.timer.autorange()
+        self.number = max(1, int(number * min_time / 0.2))
+        self.repeat = repeat
+
+    def sample(self) -> float:
+        """Best-of-N seconds per call"""
+        return min(self.timer.repeat(repeat=self.repeat, number=self.number)) / self.number
+
+
+def run(names: List[str], benchmarks: Dict[str, Callable[[], Any]],
+        rounds: int = DEFAULT_ROUNDS) -> Tuple[float, Dict[str, float], Dict[str, float]]:
+    """(median calibration seconds, median seconds per call, median normalized time) per benchmark
+
+    每轮紧接着测校准负载与各用例，比值在同一轮内计算，抵消机器负载在轮与轮之间的变化。
+    """
+    calibration = Measurement(_calibration)
+    measurements = {name: Measurement(benchmarks[name]) for name in names}
+    calibrations: List[float] = []
+    times: Dict[str, List[float]] = {name: [] for name in names}
+    ratios: Dict[str, List[float]] = {name: [] for name in names}
+    for _ in range(max(1, rounds)):
+        cal = calibration.sample()
+        calibrations.append(cal)
+        for name in names:
+            elapsed = measurements[name].sample()
+            times[name].append(elapsed)
+            ratios[name].append(elapsed / cal)
+    return (statistics.median(calibrations),
+            {name: statistics.median(times[name]) for name in names},
+            {name: statistics.median(ratios[name]) for name in names})
+
+
+def _format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f} {unit}"
+    return f"{seconds / 1e-9:8.1f} ns"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Hot-path microbenchmarks")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown that counts as a regression (0.25 = 25%%)")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="measurement rounds (median is used)")
+    parser.add_argument("--confirm", type=int, default=DEFAULT_CONFIRM,
+                        help="re-measure regressions this many times; fail only if every re-run regresses")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    # 基准测试不应被调试输出干扰
+    settings.DEBUG_LOGGING = False
+
+    benchmarks = build_benchmarks(Fixtures())
+    names = [n for n in benchmarks if args.filter in n]
+    calibration, results, normalized_times = run(names, benchmarks, args.rounds)
+
+    baseline: Dict[str, Any] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    regressions = []
+    print(f"{'benchmark':<34}{'time':>12}{'normalized':>12}{'baseline':>12}{'change':>10}")
+    for name in names:
+        normalized = normalized_times[name]
+        base = baseline.get("benchmarks", {}).get(name)
+        change = ""
+        if base:
+            ratio = normalized / base - 1
+            change = f"{ratio * 100:+.1f}%"
+            if ratio > args.threshold:
+                regressions.append(name)
+                change += " !"
+        print(f"{name:<34}{_format_time(results[name]):>12}{normalized:>12.5g}"
+              f"{(f'{base:.5g}' if base else '-'):>12}{change:>10}")
+
+    if args.update_baseline:
+        merged = dict(baseline.get("benchmarks", {}))
+        merged.update({name: float(f"{normalized_times[name]:.6g}") for name in names})
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"calibration_s": calibration, "benchmarks": merged}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\n基线已更新: {args.baseline}")
+        return 0
+
+    for attempt in range(args.confirm):
+        if not regressions:
+            break
+        # 重新测量超过阈值的用例，排除偶发的噪声
+        print(f"\n重新测量 ({attempt + 1}/{args.confirm}): {', '.join(regressions)}")
+        _, _, rerun = run(regressions, benchmarks, args.rounds)
+        confirmed = []
+        for name in regressions:
+            ratio = rerun[name] / baseline["benchmarks"][name] - 1
+            print(f"{name:<34}{ratio * 100:+.1f}%")
+            if ratio > args.threshold:
+                confirmed.append(name)
+        regressions = confirmed
+
+    if regressions:
+        print(f"\n性能退化超过 {args.threshold * 100:.0f}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+"""
+Synthetic mock upstream for offline load testing
+
+模拟 chat.z.ai 的站点SSE流（StreamResponseHandler 解析的 UpstreamData 格式）、
+OpenAI 兼容的 chunk 流以及 /api/v1/auths/ 匿名token端点，无需网络即可压测代理。
+
+用法：
+    python -m benchmarks.mock_upstream --port 9090 --tokens-per-second 300 --thinking-tokens 400
+    API_ENDPOINT=http://127.0.0.1:9090/api/chat/completions ZAI_ORIGIN=http://127.0.0.1:9090 python main.py
+
+请求体中 features.enable_thinking 为 true 时生成思考阶段；系统提示词中包含工具定义时
+回答为工具调用 JSON。也可通过请求头 X-Mock-Profile（JSON）覆盖单次请求的参数。
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+# 中英混合词表，近似真实输出的 token 分布
+_VOCAB = [
+    "the ", "model ", "answer ", "is ", "based ", "on ", "context", ", ", ". ", "and ",
+    "we ", "should ", "consider ", "data ", "result ", "because ", "in ", "this ", "case ",
+    "我们", "需要", "考虑", "这个", "问题", "的", "结果", "，", "。", "因此", "首先", "然后",
+    "\n", "- ", "1. ", "**", "code", "`", "value ", "function ",
+]
+
+TOOL_PROMPT_MARKER = "AVAILABLE FUNCTIONS"
+COMPACT_TOOL_PROMPT_MARKER = "# FUNCTIONS\n"
+
+
+class MockProfile(BaseModel):
+    """Knobs controlling the synthetic upstream stream"""
+
+    tokens_per_second: float = 200.0  # 0 表示不限速
+    tokens_per_event: int = 1
+    ttfb_ms: float = 50.0
+    thinking_tokens: int = 400  # 请求开启思考时的思考阶段长度
+    answer_tokens: int = 200
+    edit_content: bool = True  # 回答阶段首个事件使用 edit_content（站点实际行为）
+    tool_calls: str = "auto"  # auto: 请求包含工具提示词时输出工具调用；always；never
+    error_rate: float = 0.0
+    error_mode: str = "payload"  # payload: SSE 内的错误负载；http: 直接返回错误状态码
+    error_code: int = 429
+    stall_rate: float = 0.0
+    stall_seconds: float = 5.0
+    disconnect_rate: float = 0.0
+    seed: Optional[int] = None
+
+
+def _tokens(rng: random.Random, count: int) -> List[str]:
+    return [rng.choice(_VOCAB) for _ in range(count)]
+
+
+def _group(tokens: List[str], size: int) -> List[str]:
+    size = max(1, size)
+    return ["".join(tokens[i:i + size]) for i in range(0, len(tokens), size)]
+
+
+def _tool_call_text(rng: random.Random, tool_name: str) -> str:
+    call = {
+        "tool_calls": [
+            {
+                "id": f"call_{rng.randrange(10**9)}",
+                "type": "function",
+                "function": {"name": tool_name, "arguments": json.dumps({"query": "mock"})},
+            }
+        ]
+    }
+    return "```json\n" + json.dumps(call, ensure_ascii=False, indent=2) + "\n```"
+
+
+def _split_text(text: str, size: int = 4) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def plan_answer(
+    profile: MockProfile, rng: random.Random, thinking: bool, tool_name: Optional[str]
+) -> Tuple[List[str], List[str]]:
+    """Return (thinking_pieces, answer_pieces); each piece is one upstream event"""
+    thinking_pieces = _group(_tokens(rng, profile.thinking_tokens), profile.tokens_per_event) if thinking else []
+    if tool_name:
+        answer_pieces = _split_text(_tool_call_text(rng, tool_name), 4 * profile.tokens_per_event)
+    else:
+        answer_pieces = _group(_tokens(rng, profile.answer_tokens), profile.tokens_per_event)
+    return thinking_pieces, answer_pieces
+
+
+def build_zai_events(thinking_pieces: List[str], answer_pieces: List[str], edit_content: bool) -> List[Dict[str, Any]]:
+    """Build Z.AI site SSE payloads (UpstreamData shaped dicts)"""
+    events: List[Dict[str, Any]] = []
+    for i, piece in enumerate(thinking_pieces):
+        content = ('<details type="reasoning" done="false">\n> ' + piece) if i == 0 else piece
+        events.append({"type": "chat:completion", "data": {"delta_content": content, "phase": "thinking"}})
+
+    answers = list(answer_pieces)
+    if thinking_pieces:
+        if edit_content and answers:
+            first = answers.pop(0)
+            events.append({
+                "type": "chat:completion",
+                "data": {
+                    "edit_index": len(thinking_pieces),
+                    "edit_content": '\n</details>\n' + first,
+                    "phase": "answer",
+                },
+            })
+        else:
+            events.append({"type": "chat:completion", "data": {"delta_content": "\n</details>\n", "phase": "thinking"}})
+
+    for piece in answers:
+        events.append({"type": "chat:completion", "data": {"delta_content": piece, "phase": "answer"}})
+
+    completion = len(thinking_pieces) + len(answer_pieces)
+    events.append({
+        "type": "chat:completion",
+        "data": {
+            "delta_content": "",
+            "phase": "done",
+            "done": True,
+            "usage": {"prompt_tokens": 0, "completion_tokens": completion, "total_tokens": completion},
+        },
+    })
+    return events
+
+
+def build_openai_events(thinking_pieces: List[str], answer_pieces: List[str], model: str) -> List[Dict[str, Any]]:
+    """Build OpenAI-compatible chat.completion.chunk payloads"""
+    created = int(time.time())
+    base = {"id": f"chatcmpl-mock-{created}", "object": "chat.completion.chunk", "created": created, "model": model}
+
+    def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> Dict[str, Any]:
+        return dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": finish_reason}])
+
+    events = [chunk({"role": "assistant"})]
+    events.extend(chunk({"reasoning_content": piece}) for piece in thinking_pieces)
+    events.extend(chunk({"content": piece}) for piece in answer_pieces)
+    events.append(chunk({}, "stop"))
+    return events
+
+
+def _detect_tool_name(body: Dict[str, Any]) -> Optional[str]:
+    if body.get("tools"):
+        return ((body["tools"][0] or {}).get("function") or {}).get("name", "unknown")
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if message.get("role") != "system" or not isinstance(content, str):
+            continue
+        if TOOL_PROMPT_MARKER in content:
+            after = content.split(TOOL_PROMPT_MARKER, 1)[1]
+            for line in after.splitlines():
+                if line.startswith("## "):
+                    return line[3:].strip()
+            return "unknown"
+        if COMPACT_TOOL_PROMPT_MARKER in content:
+            # TOOL_PROMPT_MODE=compact：首行形如 "- name(params): description"
+            first = content.split(COMPACT_TOOL_PROMPT_MARKER, 1)[1].split("\n", 1)[0]
+            return first[2:].split("(", 1)[0].strip() or "unknown"
+    return None
+
+
+class MidStreamDisconnect(Exception):
+    """Raised inside the body iterator to drop the connection mid-stream"""
+
+
+def create_app(default_profile: MockProfile) -> FastAPI:
+    """Create the mock upstream FastAPI application"""
+    app = FastAPI(title="Mock Z.AI Upstream")
+    token_counter = itertools.count(1)
+    request_counter = itertools.count(1)
+    seed_rng = random.Random(default_profile.seed)
+
+    @app.get("/api/v1/auths/")
+    async def anonymous_auth():
+        n = next(token_counter)
+        return {"id": f"guest-{n}", "token": f"mock-anon-token-{n}", "role": "guest"}
+
+    @app.post("/{path:path}")
+    async def completions(path: str, request: Request):
+        try:
+            body = json.loads(await request.body() or b"{}")
+        except json.JSONDecodeError:
+            return JSONResponse(status_code=400, content={"detail": "invalid json"})
+
+        profile = default_profile
+        override = request.headers.get("X-Mock-Profile")
+        if override:
+            profile = default_profile.model_copy(update=json.loads(override))
+
+        rng = random.Random(seed_rng.random() if profile.seed is not None else None)
+        is_zai = "features" in body or "chat_id" in body
+        stream = True if is_zai else bool(body.get("stream", False))
+
+        if rng.random() < profile.error_rate and profile.error_mode == "http":
+            return JSONResponse(status_code=profile.error_code, content={"detail": "mock upstream error"})
+
+        features = body.get("features") or {}
+        thinking = bool(features.get("enable_thinking")) or body.get("model", "").endswith("Thinking")
+        tool_name = None
+        if profile.tool_calls == "always":
+            tool_name = _detect_tool_name(body) or "mock_tool"
+        elif profile.tool_calls == "auto":
+            tool_name = _detect_tool_name(body)
+
+        thinking_pieces, answer_pieces = plan_answer(profile, rng, thinking, tool_name)
+        model = body.get("model", "GLM-4.5")
+
+        if is_zai:
+            events = build_zai_events(thinking_pieces, answer_pieces, profile.edit_content)
+            if rng.random() < profile.error_rate:
+                events.insert(len(events) // 2, {
+                    "type": "chat:completion",
+                    "data": {"error": {"detail": "mock upstream error", "code": profile.error_code}},
+                })
+        else:
+            events = build_openai_events(thinking_pieces, answer_pieces, model)
+
+        if profile.ttfb_ms > 0:
+            await asyncio.sleep(profile.ttfb_ms / 1000)
+
+        if not stream:
+            content = "".join(answer_pieces)
+            reasoning = "".join(thinking_pieces)
+            message: Dict[str, Any] = {"role": "assistant", "content": content}
+            if reasoning:
+                message["reasoning_content"] = reasoning
+            return JSONResponse(content={
+                "id": f"chatcmpl-mock-{next(request_counter)}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(thinking_pieces) + len(answer_pieces),
+                          "total_tokens": len(thinking_pieces) + len(answer_pieces)},
+            })
+
+        stall_at = rng.randrange(len(events)) if rng.random() < profile.stall_rate else -1
+        disconnect_at = rng.randrange(len(events)) if rng.random() < profile.disconnect_rate else -1
+        interval = profile.tokens_per_event / profile.tokens_per_second if profile.tokens_per_second > 0 else 0.0
+
+        async def generate():
+            start = time.perf_counter()
+            for i, event in enumerate(events):
+                if i == disconnect_at:
+                    raise MidStreamDisconnect(f"mock disconnect at event {i}")
+                if i == stall_at:
+                    await asyncio.sleep(profile.stall_seconds)
+                    start += profile.stall_seconds
+                if interval:
+                    # 按绝对时间对齐节奏，避免 sleep 误差累积
+                    delay = start + i * interval - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            if not is_zai:
+                yield "data: [DONE]\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Synthetic Z.AI / OpenAI mock upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9090)
+    for name, field in MockProfile.model_fields.items():
+        flag = "--" + name.replace("_", "-")
+        if field.annotation is bool:
+            parser.add_argument(flag, type=lambda v: v.lower() == "true", default=field.default)
+        elif name == "seed":
+            parser.add_argument(flag, type=int, default=None)
+        else:
+            parser.add_argument(flag, type=type(field.default), default=field.default)
+    args = parser.parse_args()
+
+    profile = MockProfile(**{name: getattr(args, name) for name in MockProfile.model_fields})
+    print(f"[MOCK] 启动模拟上游: {profile.model_dump()}")
+
+    import uvicorn
+
+    uvicorn.run(create_app(profile), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Replay server for recorded upstream captures
+
+用法：
+    # 1. 录制：RECORD_DIR=recordings python main.py，然后正常发起请求
+    # 2. 回放：
+    python -m benchmarks.replay_server --captures recordings --port 9090 --time-scale 1.0
+    # 3. 将代理指向回放服务器（zai 与 openai 两种上游类型均可）：
+    API_ENDPOINT=http://127.0.0.1:9090/api/chat/completions ANONYMOUS_MODE=false python main.py
+
+--time-scale 控制回放节奏：1.0 为原始时序，0.5 为两倍速，0 为不等待直接输出。
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.utils.recorder import iter_capture_paths, load_capture
+
+
+def _messages_key(body: Any) -> Optional[str]:
+    """Hash of the request messages, used to match a request to its capture"""
+    if not isinstance(body, dict) or "messages" not in body:
+        return None
+    raw = json.dumps(body["messages"], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _capture_kind(body: Any, upstream_type: str) -> Tuple[str, bool]:
+    """Classify a request body as (upstream_type, stream)"""
+    stream = True
+    if isinstance(body, dict):
+        stream = bool(body.get("stream", True))
+    return upstream_type, stream
+
+
+def _detect_upstream_type(body: Any) -> str:
+    # zai 站点请求体带有 features/chat_id 等字段；OpenAI 兼容请求体没有
+    if isinstance(body, dict) and ("features" in body or "chat_id" in body):
+        return "zai"
+    return "openai"
+
+
+class CaptureStore:
+    """In-memory index of captures with exact-match and round-robin selection"""
+
+    def __init__(self, captures: List[Dict[str, Any]]):
+        self.by_name: Dict[str, Dict[str, Any]] = {}
+        self.by_messages: Dict[Tuple[str, bool, str], Dict[str, Any]] = {}
+        self.pools: Dict[Tuple[str, bool], List[Dict[str, Any]]] = {}
+        self._cursors: Dict[Tuple[str, bool], Any] = {}
+
+        for capture in captures:
+            body = capture["request"]["body"]
+            kind = _capture_kind(body, capture["upstream_type"])
+            self.by_name[capture["path"].rsplit("/", 1)[-1]] = capture
+            self.pools.setdefault(kind, []).append(capture)
+            key = _messages_key(body)
+            if key:
+                self.by_messages.setdefault((kind[0], kind[1], key), capture)
+
+        for kind, pool in self.pools.items():
+            self._cursors[kind] = itertools.cycle(pool)
+
+    @classmethod
+    def from_directory(cls, directory: str) -> "CaptureStore":
+        return cls([load_capture(path) for path in iter_capture_paths(directory)])
+
+    def select(self, body: Any, name: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        if name:
+            return self.by_name.get(name)
+        kind = _capture_kind(body, _detect_upstream_type(body))
+        key = _messages_key(body)
+        if key and (kind[0], kind[1], key) in self.by_messages:
+            return self.by_messages[(kind[0], kind[1], key)]
+        cursor = self._cursors.get(kind)
+        return next(cursor) if cursor else None
+
+    def __len__(self) -> int:
+        return len(self.by_name)
+
+
+def create_app(store: CaptureStore, time_scale: float = 1.0) -> FastAPI:
+    """Create the replay FastAPI application"""
+    app = FastAPI(title="Upstream Replay Server")
+
+    async def replay_chunks(capture: Dict[str, Any]):
+        previous = 0.0
+        for offset, chunk in capture["chunks"]:
+            delay = (offset - previous) * time_scale
+            previous = offset
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield chunk
+
+    @app.get("/replay/captures")
+    async def list_captures():
+        return {
+            "count": len(store),
+            "captures": [
+                {
+                    "name": name,
+                    "upstream_type": c["upstream_type"],
+                    "status": c["status"],
+                    "chunks": len(c["chunks"]),
+                }
+                for name, c in sorted(store.by_name.items())
+            ],
+        }
+
+    @app.post("/{path:path}")
+    async def replay(path: str, request: Request):
+        raw = await request.body()
+        try:
+            body = json.loads(raw) if raw else {}
+        except json.JSONDecodeError:
+            body = {}
+
+        capture = store.select(body, request.headers.get("X-Replay-Capture"))
+        if capture is None:
+            return JSONResponse(status_code=404, content={"detail": "no matching capture"})
+
+        if capture.get("ttfb") and time_scale > 0:
+            await asyncio.sleep(capture["ttfb"] * time_scale)
+
+        media_type = capture["response_headers"].get("Content-Type", "text/event-stream")
+        return StreamingResponse(
+            replay_chunks(capture),
+            status_code=capture["status"] or 200,
+            media_type=media_type,
+        )
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay recorded upstream SSE captures")
+    parser.add_argument("--captures", default="recordings", help="capture directory (RECORD_DIR)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9090)
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="multiplier for recorded delays (0 = no delay)")
+    args = parser.parse_args()
+
+    store = CaptureStore.from_directory(args.captures)
+    print(f"[REPLAY] 已加载 {len(store)} 个录制文件: {args.captures}")
+
+    import uvicorn
+
+    uvicorn.run(create_app(store, args.time_scale), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
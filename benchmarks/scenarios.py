@@ -0,0 +1,142 @@
+"""
+Load-test scenario definitions
+
+每个场景构造一个“会话”：按顺序发送的一组 /v1/chat/completions 请求体。
+单轮场景的会话只有一个请求；工具调用 agent 场景会逐轮增长历史消息。
+"""
+
+import json
+import random
+from typing import Any, Callable, Dict, List
+
+Session = List[Dict[str, Any]]
+
+PRIMARY_MODEL = "GLM-4.5"
+THINKING_MODEL = "GLM-4.5-Thinking"
+
+WEATHER_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "get_weather",
+        "description": "查询指定城市的天气信息",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "city": {"type": "string", "description": "城市名称"},
+                "date": {"type": "string", "description": "查询日期（可选）"},
+            },
+            "required": ["city"],
+        },
+    },
+}
+
+SEARCH_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "search_docs",
+        "description": "Search internal documentation and return matching passages",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "search query"},
+                "top_k": {"type": "integer", "description": "number of passages"},
+            },
+            "required": ["query"],
+        },
+    },
+}
+
+_QUESTIONS = [
+    "用一句话介绍一下你自己",
+    "What is the capital of France?",
+    "解释一下 TCP 三次握手",
+    "Write a haiku about autumn.",
+    "列出三种常见的排序算法",
+]
+
+
+def short_chat(rng: random.Random) -> Session:
+    return [{
+        "model": PRIMARY_MODEL,
+        "messages": [{"role": "user", "content": rng.choice(_QUESTIONS)}],
+        "stream": True,
+    }]
+
+
+def long_thinking(rng: random.Random) -> Session:
+    return [{
+        "model": THINKING_MODEL,
+        "messages": [
+            {"role": "system", "content": "You are a careful reasoning assistant."},
+            {"role": "user", "content": "Prove that there are infinitely many primes, step by step. " + rng.choice(_QUESTIONS)},
+        ],
+        "stream": True,
+    }]
+
+
+def non_stream(rng: random.Random) -> Session:
+    return [{
+        "model": PRIMARY_MODEL,
+        "messages": [{"role": "user", "content": rng.choice(_QUESTIONS)}],
+        "stream": False,
+    }]
+
+
+def tool_agent_loop(rng: random.Random, turns: int = 4, tool_output_chars: int = 4000) -> Session:
+    """Agent loop whose history grows by one tool call + tool result per turn"""
+    history: List[Dict[str, Any]] = [
+        {"role": "system", "content": "You are an agent. Use tools when needed."},
+        {"role": "user", "content": "查一下北京、上海和广州的天气，然后总结差异"},
+    ]
+    session: Session = []
+    for turn in range(turns):
+        session.append({
+            "model": PRIMARY_MODEL,
+            "messages": [dict(m) for m in history],
+            "tools": [WEATHER_TOOL, SEARCH_TOOL],
+            "tool_choice": "auto",
+            "stream": True,
+        })
+        call_id = f"call_{turn}_{rng.randrange(10**6)}"
+        history.append({
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": call_id,
+                "type": "function",
+                "function": {"name": "get_weather", "arguments": json.dumps({"city": f"city-{turn}"})},
+            }],
+        })
+        history.append({
+            "role": "tool",
+            "tool_call_id": call_id,
+            "name": "get_weather",
+            "content": json.dumps({"city": f"city-{turn}", "report": "晴 " * (tool_output_chars // 2)}, ensure_ascii=False),
+        })
+    return session
+
+
+SCENARIOS: Dict[str, Callable[[random.Random], Session]] = {
+    "short_chat": short_chat,
+    "long_thinking": long_thinking,
+    "tool_agent_loop": tool_agent_loop,
+    "non_stream": non_stream,
+}
+
+# mix 场景中各子场景的权重
+MIX_WEIGHTS: Dict[str, int] = {
+    "short_chat": 5,
+    "long_thinking": 2,
+    "tool_agent_loop": 2,
+    "non_stream": 1,
+}
+
+
+def build_session(name: str, rng: random.Random) -> Session:
+    """Build one session for a scenario name (``mix`` picks a weighted sub-scenario)"""
+    if name == "mix":
+        names = list(MIX_WEIGHTS)
+        name = rng.choices(names, weights=[MIX_WEIGHTS[n] for n in names])[0]
+    if name not in SCENARIOS:
+        raise ValueError(f"unknown scenario: {name} (available: {', '.join(list(SCENARIOS) + ['mix'])})")
+    return SCENARIOS[name](rng)
@@ -0,0 +1,151 @@
+"""
+Startup benchmark: time-to-ready and time-to-first-completion
+
+用法：
+    python -m benchmarks.startup --trials 5
+    python -m benchmarks.startup --env WARMUP_MODE=blocking --env HEADER_PROFILE_SOURCE=snapshot
+    python -m benchmarks.startup --importtime 15     # 同时输出导入耗时最高的模块
+
+每轮启动一个本地模拟上游和一个全新的代理进程，测量：
+- time_to_ready: 进程启动到 GET / 返回 200
+- time_to_first_completion: 进程启动到第一个 /v1/chat/completions 请求成功返回
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import requests
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until(url: str, deadline: float, method: str = "GET", **kwargs) -> Optional[float]:
+    while time.perf_counter() < deadline:
+        try:
+            response = requests.request(method, url, timeout=5.0, **kwargs)
+            if response.status_code == 200:
+                return time.perf_counter()
+        except requests.RequestException:
+            pass
+        time.sleep(0.005)
+    return None
+
+
+def run_trial(command: List[str], env: Dict[str, str], port: int, timeout: float) -> Dict[str, Any]:
+    started = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = started + timeout
+        ready_at = _wait_until(f"http://127.0.0.1:{port}/", deadline)
+        completion_at = None
+        if ready_at is not None:
+            completion_at = _wait_until(
+                f"http://127.0.0.1:{port}/v1/chat/completions",
+                deadline,
+                method="POST",
+                headers={"Authorization": f"Bearer {env.get('AUTH_TOKEN', 'sk-your-api-key')}"},
+                json={"model": "GLM-4.5", "messages": [{"role": "user", "content": "hi"}], "stream": False},
+            )
+        return {
+            "time_to_ready": round(ready_at - started, 4) if ready_at else None,
+            "time_to_first_completion": round(completion_at - started, 4) if completion_at else None,
+        }
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def import_times(top: int) -> List[Dict[str, Any]]:
+    """Top modules by cumulative import time (python -X importtime)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        capture_output=True, text=True, env=dict(os.environ, DEBUG_LOGGING="false"),
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue  # 表头行
+        rows.append({"module": parts[2].strip(), "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000})
+    rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+    return rows[:top]
+
+
+def _summary(values: List[Optional[float]]) -> Dict[str, Optional[float]]:
+    ok = [v for v in values if v is not None]
+    if not ok:
+        return {"median": None, "min": None, "max": None}
+    return {"median": round(statistics.median(ok), 4), "min": min(ok), "max": max(ok)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure proxy cold-start latency")
+    parser.add_argument("--trials", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--command", help="proxy command; {port} is substituted (default: uvicorn main:app)")
+    parser.add_argument("--env", action="append", default=[], help="extra KEY=VALUE for the proxy")
+    parser.add_argument("--importtime", type=int, default=0, help="also report the N slowest imports")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    mock_port = _free_port()
+    mock = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.mock_upstream", "--port", str(mock_port), "--tokens-per-second", "0"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_until(f"http://127.0.0.1:{mock_port}/api/v1/auths/", time.perf_counter() + 30)
+        trials = []
+        for _ in range(args.trials):
+            port = _free_port()
+            env = dict(
+                os.environ,
+                API_ENDPOINT=f"http://127.0.0.1:{mock_port}/api/chat/completions",
+                ZAI_ORIGIN=f"http://127.0.0.1:{mock_port}",
+                LISTEN_PORT=str(port),
+                DEBUG_LOGGING="false",
+            )
+            env.update(item.split("=", 1) for item in args.env)
+            command = (args.command or f"{sys.executable} -m uvicorn main:app --port {{port}}").format(port=port).split()
+            trials.append(run_trial(command, env, port, args.timeout))
+    finally:
+        mock.terminate()
+        mock.wait(timeout=10)
+
+    report: Dict[str, Any] = {
+        "trials": trials,
+        "time_to_ready": _summary([t["time_to_ready"] for t in trials]),
+        "time_to_first_completion": _summary([t["time_to_first_completion"] for t in trials]),
+        "env": args.env,
+    }
+    if args.importtime:
+        report["slowest_imports"] = import_times(args.importtime)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
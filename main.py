@@ -2,19 +2,31 @@
 Main application entry point
 """
 
+import time
+
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import settings
-from app.core import openai
+from app.core import batch, health, openai
+from app.core.lifecycle import DrainMiddleware
+from app.core.startup import lifespan, startup_report
+
+startup_report["import_seconds"] = round(time.perf_counter() - _import_started, 4)
 
 # Create FastAPI app
 app = FastAPI(
     title="OpenAI Compatible API Server",
     description="An OpenAI-compatible API server for Z.AI chat service",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
+# 排空期间拒绝新的 API 请求
+app.add_middleware(DrainMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -26,6 +38,8 @@ app.add_middleware(
 
 # Include API routers
 app.include_router(openai.router)
+app.include_router(batch.router)
+app.include_router(health.router)
 
 
 @app.options("/")
@@ -41,6 +55,12 @@ async def root():
 
 
 if __name__ == "__main__":
-    import uvicorn
+    if settings.SERVER_RELOAD:
+        import uvicorn
+
+        # 仅用于开发：单进程自动重载，不经过 worker 监督与排空
+        uvicorn.run("main:app", host=settings.LISTEN_HOST, port=settings.LISTEN_PORT, reload=True)
+    else:
+        import serve
 
-    uvicorn.run("main:app", host="0.0.0.0", port=settings.LISTEN_PORT, reload=True)
+        serve.main()
@@ -0,0 +1,301 @@
+"""
+Production server entry point
+
+多进程 uvicorn 启动器：
+- worker 数默认按可用 CPU（含 cgroup 配额与 CPU 亲和性）自动设置，可用 WORKERS 覆盖
+- 优先使用 uvloop 与 httptools，设置 backlog 与 keep-alive 超时
+- 父进程只负责绑定端口与监督，worker 以 spawn 方式启动并各自执行 lifespan 预热，
+  不会从父进程继承半初始化的 token 池或连接池；异常退出的 worker 会按退避策略重启
+- SIGTERM/SIGINT 时各 worker 先排空进行中的流（见 app.core.lifecycle）再退出；
+  SIGHUP 触发滚动重启：逐个启动新 worker，等它开始接受连接后再让对应的旧 worker 排空退出，
+  新 worker 未能就绪时保留旧 worker 并停止本次重启；
+  监听 socket 始终由父进程持有，新连接在 backlog 中等待而不会被拒绝
+- 每个 worker 进程有唯一的 WORKER_INDEX（0-255，编码在流 ID 中），替换的新进程使用新的序号。
+  启用可接续流（STREAM_REPLAY_MAX_BYTES）且多 worker 时，每个 worker 另外监听一个私有 Unix socket，
+  落到其他 worker 的断线重连经它转给持有重放缓冲区的 worker（见 app.core.resumable）；
+  排空中的旧 worker 保留该 socket，滚动重启期间的重连同样可以接续
+"""
+
+import importlib.util
+import math
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import uvicorn
+
+from app.core.config import settings
+from app.core.lifecycle import DrainingServer
+from app.core.resumable import worker_socket
+
+
+def available_cpus() -> int:
+    """CPUs this process may actually use (affinity and cgroup quota aware)"""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+
+    quota: Optional[float] = None
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            limit, period = f.read().split()
+        if limit != "max":
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                limit_us = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period_us = int(f.read())
+            if limit_us > 0:
+                quota = limit_us / period_us
+        except (OSError, ValueError):
+            pass
+
+    if quota is not None:
+        count = min(count, max(1, math.ceil(quota)))
+    return max(1, count)
+
+
+def resolve_workers() -> int:
+    return settings.WORKERS if settings.WORKERS > 0 else available_cpus()
+
+
+def _pick(preferred: str, module: str, fallback: str) -> str:
+    return preferred if importlib.util.find_spec(module) is not None else fallback
+
+
+def build_config(workers: int) -> uvicorn.Config:
+    loop = settings.SERVER_LOOP
+    if loop == "auto":
+        loop = _pick("uvloop", "uvloop", "asyncio")
+    http = settings.SERVER_HTTP
+    if http == "auto":
+        http = _pick("httptools", "httptools", "h11")
+
+    return uvicorn.Config(
+        "main:app",
+        host=settings.LISTEN_HOST,
+        port=settings.LISTEN_PORT,
+        workers=workers,
+        loop=loop,
+        http=http,
+        backlog=settings.SERVER_BACKLOG,
+        timeout_keep_alive=settings.SERVER_KEEPALIVE_TIMEOUT,
+        timeout_graceful_shutdown=settings.SERVER_SHUTDOWN_TIMEOUT,
+        access_log=settings.DEBUG_LOGGING,
+        proxy_headers=True,
+        forwarded_allow_ips="*",
+    )
+
+
+def run_worker(config: uvicorn.Config, sockets: List[socket.socket], ready) -> None:
+    """Worker process entry point: serve the app on the sockets inherited from the supervisor"""
+    config.configure_logging()
+    DrainingServer(config=config, ready=ready).run(sockets=sockets)
+
+
+class Supervisor:
+    """Spawn workers on a shared socket and restart the ones that die"""
+
+    # worker 在启动后该时间内退出视为“快速失败”，按指数退避重启
+    FAST_FAILURE_WINDOW = 10.0
+    MAX_BACKOFF = 30.0
+    # 滚动重启时等待新 worker 开始接受连接的上限（含 lifespan 预热）
+    READY_TIMEOUT = 120.0
+    # WORKER_INDEX 的取值范围，见 app.utils.ids
+    MAX_WORKER_IDS = 256
+
+    def __init__(self, config: uvicorn.Config, workers: int):
+        self.config = config
+        self.workers = workers
+        self.processes: Dict[int, object] = {}
+        # 槽位 -> 当前进程的 WORKER_INDEX
+        self.worker_ids: Dict[int, int] = {}
+        self.started_at: Dict[int, float] = {}
+        self.failures: Dict[int, int] = {}
+        self.restart_at: Dict[int, float] = {}
+        self.should_exit = threading.Event()
+        self.should_reload = threading.Event()
+        self.sockets: List = []
+        # 各 worker 私有的 Unix socket，仅在需要转发断线重连时创建
+        self.socket_dir: Optional[str] = None
+        self.worker_sockets: Dict[int, socket.socket] = {}
+        # 滚动重启时被替换、正在排空的旧 worker 及其 WORKER_INDEX
+        self.retiring: List[Tuple[object, int]] = []
+        self._context = multiprocessing.get_context("spawn")
+
+    def _new_worker_id(self) -> int:
+        in_use = set(self.worker_ids.values()) | {worker_id for _, worker_id in self.retiring}
+        return min(i for i in range(self.MAX_WORKER_IDS) if i not in in_use)
+
+    def _bind_worker_socket(self, worker_id: int) -> Optional[socket.socket]:
+        if self.socket_dir is None:
+            return None
+        path = worker_socket(worker_id, self.socket_dir)
+        if os.path.exists(path):
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.listen(self.config.backlog)
+        sock.set_inheritable(True)
+        self.worker_sockets[worker_id] = sock
+        return sock
+
+    def _release_worker_id(self, worker_id: int) -> None:
+        # worker 退出后其重放缓冲区随之丢失，删除 socket 让转发立即得到 410
+        sock = self.worker_sockets.pop(worker_id, None)
+        if sock is not None:
+            sock.close()
+            os.unlink(worker_socket(worker_id, self.socket_dir))
+
+    def _spawn(self, index: int):
+        worker_id = self._new_worker_id()
+        private = self._bind_worker_socket(worker_id)
+        sockets = self.sockets + ([private] if private is not None else [])
+        # spawn 出的子进程会复制当前环境变量，借此告知 worker 自己的序号
+        os.environ["WORKER_INDEX"] = str(worker_id)
+        ready = self._context.Event()
+        # spawn 启动的子进程重新导入应用，监听 socket 通过 multiprocessing 传给子进程
+        process = self._context.Process(
+            target=run_worker, args=(self.config, sockets, ready), name=f"worker-{worker_id}"
+        )
+        process.start()
+        process.ready = ready
+        self.processes[index] = process
+        self.worker_ids[index] = worker_id
+        self.started_at[index] = time.monotonic()
+        print(f"[SERVE] worker {index} 已启动 (pid={process.pid}，WORKER_INDEX={worker_id})")
+        return process
+
+    def _wait_ready(self, process) -> bool:
+        deadline = time.monotonic() + self.READY_TIMEOUT
+        while not process.ready.wait(0.5):
+            if not process.is_alive() or self.should_exit.is_set() or time.monotonic() >= deadline:
+                return False
+        return True
+
+    def _enable_worker_sockets(self) -> None:
+        if settings.STREAM_REPLAY_MAX_BYTES <= 0 or self.workers <= 1:
+            return
+        self.socket_dir = tempfile.mkdtemp(prefix="z-ai2api-")
+        # worker 以 spawn 方式启动并复制环境变量，借此得知其他 worker 的 socket 位置
+        os.environ["WORKER_SOCKET_DIR"] = self.socket_dir
+
+    def _handle_exit(self, signum, frame) -> None:
+        self.should_exit.set()
+
+    def _handle_reload(self, signum, frame) -> None:
+        self.should_reload.set()
+
+    def _rolling_restart(self) -> None:
+        """Replace workers one by one: start a new one, wait until it is ready, then drain the old one"""
+        print("[SERVE] 开始滚动重启")
+        for index in sorted(self.processes):
+            old, old_id, old_started = self.processes[index], self.worker_ids[index], self.started_at[index]
+            if not old.is_alive():
+                # 已退出的 worker 由 _check_workers 按退避策略重启
+                continue
+            new = self._spawn(index)
+            if not self._wait_ready(new):
+                print(f"[SERVE] 新 worker {index} 未能就绪 (pid={new.pid})，保留旧 worker 并停止滚动重启")
+                new.terminate()
+                new.join(settings.SERVER_SHUTDOWN_TIMEOUT)
+                if new.is_alive():
+                    new.kill()
+                    new.join()
+                self._release_worker_id(self.worker_ids[index])
+                self.processes[index], self.worker_ids[index], self.started_at[index] = old, old_id, old_started
+                return
+            old.terminate()
+            self.retiring.append((old, old_id))
+        print("[SERVE] 滚动重启完成")
+
+    def _reap_retiring(self) -> None:
+        for process, worker_id in list(self.retiring):
+            if not process.is_alive():
+                process.join()
+                self.retiring.remove((process, worker_id))
+                self._release_worker_id(worker_id)
+                print(f"[SERVE] 旧 worker 已排空退出 (pid={process.pid})")
+
+    def _check_workers(self) -> None:
+        now = time.monotonic()
+        for index, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            if index not in self.restart_at:
+                lifetime = now - self.started_at[index]
+                if lifetime < self.FAST_FAILURE_WINDOW:
+                    self.failures[index] = self.failures.get(index, 0) + 1
+                else:
+                    self.failures[index] = 0
+                delay = min(self.MAX_BACKOFF, 0.5 * (2 ** self.failures[index]) if self.failures[index] else 0.0)
+                self.restart_at[index] = now + delay
+                self._release_worker_id(self.worker_ids[index])
+                print(f"[SERVE] worker {index} 退出 (exitcode={process.exitcode})，{delay:.1f}s 后重启")
+            if now >= self.restart_at[index]:
+                del self.restart_at[index]
+                self._spawn(index)
+
+    def _stop_workers(self) -> None:
+        processes = list(self.processes.values()) + [process for process, _ in self.retiring]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        # worker 先排空进行中的流，再执行常规关闭
+        deadline = time.monotonic() + settings.DRAIN_GRACE + settings.DRAIN_TIMEOUT + settings.SERVER_SHUTDOWN_TIMEOUT
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def run(self) -> None:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self._handle_exit)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self._handle_reload)
+
+        self.sockets = [self.config.bind_socket()]
+        self._enable_worker_sockets()
+        print(f"[SERVE] 监听 {self.config.host}:{self.config.port}，workers={self.workers}，"
+              f"loop={self.config.loop}，http={self.config.http}")
+        for index in range(self.workers):
+            self._spawn(index)
+
+        while not self.should_exit.wait(0.5):
+            if self.should_reload.is_set():
+                self.should_reload.clear()
+                self._rolling_restart()
+            self._check_workers()
+            self._reap_retiring()
+
+        print("[SERVE] 收到退出信号，正在停止 worker")
+        self._stop_workers()
+        for sock in self.sockets + list(self.worker_sockets.values()):
+            sock.close()
+        if self.socket_dir is not None:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+
+def main() -> None:
+    workers = resolve_workers()
+    if settings.SHARED_STATE_BACKEND == "auto":
+        # worker 以 spawn 方式启动并重新读取环境变量，多 worker 时共享同一个 SQLite 状态
+        os.environ["SHARED_STATE_BACKEND"] = "sqlite" if workers > 1 else "memory"
+    config = build_config(workers)
+    Supervisor(config, workers).run()
+
+
+if __name__ == "__main__":
+    main()
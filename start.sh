@@ -13,5 +13,5 @@ export DEBUG_LOGGING=true
 # Enable render deployment mode
 export RENDER_DEPLOYMENT=true
 
-# Start the application
-exec uvicorn main:app --host 0.0.0.0 --port $PORT --workers 1
\ No newline at end of file
+# Start the application (workers auto-sized to available CPUs; override with WORKERS)
+exec python serve.py
@@ -0,0 +1,112 @@
+"""测试共用的 fixture"""
+
+import json
+import threading
+from typing import Any, Callable, List, NamedTuple, Optional
+
+import pytest
+
+from app.core import response_handlers
+from app.core.config import settings
+
+
+class FakeUpstream:
+    """逐行产出 zai SSE 的上游响应，记录被读取的行数"""
+
+    status_code = 200
+
+    def __init__(self, deltas, phase="answer"):
+        self.lines = [
+            "data: " + json.dumps({"type": "chat:completion", "data": {"delta_content": d, "phase": phase}})
+            for d in deltas
+        ]
+        self.lines.append("data: " + json.dumps({"type": "chat:completion", "data": {"phase": "done", "done": True}}))
+        self.consumed = 0
+        self.aborted = False
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for line in self.lines:
+            if self.aborted:
+                raise ConnectionError("aborted")
+            self.consumed += 1
+            yield line.encode("utf-8") + b"\n"
+
+    def iter_lines(self):
+        # 与 requests 相同，基于 iter_content 读取
+        for chunk in self.iter_content():
+            yield chunk[:-1]
+
+    def close(self):
+        pass
+
+
+class UpstreamCall(NamedTuple):
+    body: Any
+    token: str
+    endpoint: Optional[str]
+    timeout: Any
+
+
+class FakeUpstreamAPI:
+    """替代 call_upstream_api：按脚本依次返回响应（最后一个重复使用），并记录每次调用
+
+    - fake_upstream(deltas) 安装一个逐行产出 zai SSE 的 FakeUpstream
+    - fake_upstream.script(a, b) 依次返回给定的响应，用于首字节前重试
+    - fake_upstream.respond(factory) 每次调用返回 factory(body) 的结果，用于按请求内容构造响应
+    """
+
+    def __init__(self):
+        self.calls: List[UpstreamCall] = []
+        self._script: List[Any] = []
+        self._next = 0
+        self._respond: Optional[Callable[[Any], Any]] = None
+        self._lock = threading.Lock()
+
+    def __call__(self, deltas, phase="answer") -> FakeUpstream:
+        return self.script(FakeUpstream(deltas, phase))
+
+    def script(self, *responses):
+        with self._lock:
+            self._script, self._next, self._respond = list(responses), 0, None
+        return responses[0]
+
+    def respond(self, factory: Callable[[Any], Any]) -> None:
+        with self._lock:
+            self._respond = factory
+
+    def call(self, body, chat_id, token, downstream_key=None, endpoint=None, timeout=None):
+        with self._lock:
+            self.calls.append(UpstreamCall(body, token, endpoint, timeout))
+            respond = self._respond
+            if respond is None:
+                response = self._script[min(self._next, len(self._script) - 1)]
+                self._next += 1
+        return respond(body) if respond is not None else response
+
+
+def _fake_abort(response):
+    # 与 abort_upstream_response 相同，最终关闭响应
+    response.aborted = True
+    response.close()
+
+
+@pytest.fixture
+def fake_upstream(monkeypatch):
+    """Route handler upstream calls to a FakeUpstreamAPI (zai upstream by default)"""
+    monkeypatch.setattr(settings, "UPSTREAM_TYPE", "zai")
+    api = FakeUpstreamAPI()
+    monkeypatch.setattr(response_handlers, "call_upstream_api", api.call)
+    monkeypatch.setattr(response_handlers, "abort_upstream_response", _fake_abort)
+    return api
+
+
+def _stream_chunks(handler):
+    events = [line[6:].strip() for line in handler.handle() if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    return [json.loads(e) for e in events[:-1]]
+
+
+@pytest.fixture
+def stream_chunks():
+    """Parsed chunks of a streaming handler (asserting it ends with [DONE])"""
+    return _stream_chunks
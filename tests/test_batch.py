@@ -0,0 +1,167 @@
+"""测试批量补全：有限并发、按完成顺序输出与续跑"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.core import batch, openai, response_handlers
+from app.core.batch import BatchResultStore, BatchRun, batch_results, parse_batch_lines, result_store
+from app.core.config import settings
+from app.utils import shared_state
+
+
+class EchoUpstream:
+    """回显最后一条用户消息的 zai 上游，内容中的第一个数字作为延迟（毫秒）"""
+
+    status_code = 200
+
+    def __init__(self, text):
+        self.text = text
+        self.aborted = False
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        delay = re.search(r"\d+", self.text)
+        time.sleep(int(delay.group()) / 1000 if delay else 0)
+        yield ("data: " + json.dumps({"type": "chat:completion", "data": {"delta_content": f"echo {self.text}", "phase": "answer"}}) + "\n").encode()
+        yield b'data: {"type":"chat:completion","data":{"phase":"done","done":true}}\n'
+
+    def iter_lines(self):
+        for chunk in self.iter_content():
+            yield chunk[:-1]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def upstream(fake_upstream, monkeypatch):
+    """回显上游；返回的统计记录同时进行中的请求峰值"""
+    stats = {"active": 0, "peak": 0}
+    lock = threading.Lock()
+
+    def echo(body):
+        text = json.loads(body)["messages"][-1]["content"]
+        with lock:
+            stats["active"] += 1
+            stats["peak"] = max(stats["peak"], stats["active"])
+        return EchoUpstream(text)
+
+    original_handle = response_handlers.NonStreamResponseHandler.handle
+
+    def counting_handle(self):
+        try:
+            return original_handle(self)
+        finally:
+            with lock:
+                stats["active"] -= 1
+
+    fake_upstream.respond(echo)
+    monkeypatch.setattr(settings, "CONTEXT_TOKEN_BUDGET", 0)
+    monkeypatch.setattr(openai, "get_auth_token", lambda key=None: "token")
+    monkeypatch.setattr(response_handlers.NonStreamResponseHandler, "handle", counting_handle)
+    return stats
+
+
+def _jsonl(prompts):
+    """text 为 None 时生成缺少 messages 的无效请求"""
+    lines = []
+    for cid, text in prompts:
+        body = {"model": "GLM-4.5"}
+        if text is not None:
+            body["messages"] = [{"role": "user", "content": text}]
+        lines.append(json.dumps({"custom_id": cid, "body": body}))
+    return "\n".join(lines).encode()
+
+
+def test_parse_batch_lines_reports_bad_lines():
+    data = b'{"custom_id": "a", "body": {}}\nnot json\n\n{"body": {}}\n{"custom_id": "a", "body": {}}\n' \
+           b'{"custom_id": "b", "url": "/v1/embeddings", "body": {}}'
+    items = parse_batch_lines(data)
+    assert [(cid, error) for cid, _, error in items] == [
+        ("a", None),
+        ("line-2", "Invalid JSON"),
+        ("line-4", "Missing custom_id"),
+        ("a", "Duplicate custom_id"),
+        ("b", "Unsupported url: /v1/embeddings"),
+    ]
+
+
+def test_results_stream_in_completion_order_with_bounded_concurrency(upstream):
+    items = parse_batch_lines(_jsonl([("slow", "wait 300"), ("bad", None)] + [(f"q{i}", f"fast {i}") for i in range(8)]))
+    results = [json.loads(line) for line in BatchRun(items, None, concurrency=3).run()]
+
+    by_id = {r["custom_id"]: r for r in results}
+    assert len(results) == 10
+    assert by_id["q3"]["response"]["body"]["choices"][0]["message"]["content"] == "echo fast 3"
+    assert by_id["bad"]["response"] is None and by_id["bad"]["error"]["code"] == "400"
+    # 慢请求最后完成，不阻塞后面的条目
+    assert results[-1]["custom_id"] == "slow"
+    assert 1 < upstream["peak"] <= 3
+
+
+def test_resubmission_skips_completed_ids(upstream, fake_upstream, tmp_path):
+    store_path = str(tmp_path / "job.jsonl")
+    items = parse_batch_lines(_jsonl([(f"q{i}", f"prompt {i}") for i in range(5)]))
+    with open(store_path, "w") as f:
+        f.write(batch._result_line("q0", {"choices": []}))
+        f.write(batch._result_line("q1", status_code=502, message="Upstream error"))
+        f.write('{"custom_id": "q2", "resp')  # 中断时写了一半的行
+
+    store = BatchResultStore(store_path)
+    completed = store.completed_ids()
+    assert completed == {"q0"}
+
+    pending = [item for item in items if item[0] not in completed]
+    list(BatchRun(pending, None, concurrency=2, store=store).run())
+
+    assert len(fake_upstream.calls) == 4
+    assert BatchResultStore(store_path).completed_ids() == {"q0", "q1", "q2", "q3", "q4"}
+
+
+def test_each_item_counts_against_the_rate_limit(upstream, fake_upstream, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_PER_MINUTE", 3)
+    monkeypatch.setattr(shared_state, "_state", shared_state.MemorySharedState())
+    items = parse_batch_lines(_jsonl([(f"q{i}", f"prompt {i}") for i in range(5)]))
+    results = [json.loads(line) for line in BatchRun(items, "sk-batch", concurrency=1).run()]
+
+    assert [r["error"]["code"] if r["error"] else "ok" for r in results] == ["ok", "ok", "ok", "429", "429"]
+    assert len(fake_upstream.calls) == 3
+
+
+def test_items_with_several_choices_are_rejected(upstream, fake_upstream):
+    line = json.dumps({"custom_id": "n2", "body": {"model": "GLM-4.5", "n": 2,
+                                                   "messages": [{"role": "user", "content": "hi"}]}})
+    (result,) = [json.loads(line) for line in BatchRun(parse_batch_lines(line.encode()), None, 1).run()]
+    assert result["error"]["code"] == "400" and not fake_upstream.calls
+
+
+def test_results_are_isolated_per_key(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "BATCH_RESULTS_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "SKIP_AUTH_TOKEN", True)
+    owner = result_store("job", "sk-owner")
+    owner.append(batch._result_line("q0", {"choices": []}))
+    owner.close()
+
+    # 其他 key 使用相同的 batch_id 既不会跳过条目，也下载不到结果
+    assert result_store("job", "sk-other").completed_ids() == set()
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(batch_results("job", authorization="Bearer sk-other"))
+    assert error.value.status_code == 404
+
+    response = asyncio.run(batch_results("job", authorization="Bearer sk-owner"))
+    assert response.path == owner.path
+    assert "sk-owner" not in owner.path
+
+
+def test_closing_the_stream_aborts_in_flight_items(upstream):
+    items = parse_batch_lines(_jsonl([("fast", "now")] + [(f"s{i}", f"wait 200 {i}") for i in range(10)]))
+    run = BatchRun(items, None, concurrency=2)
+    stream = run.run()
+    assert json.loads(next(stream))["custom_id"] == "fast"
+    stream.close()
+    assert run.aborted
@@ -0,0 +1,90 @@
+"""测试按 token 预算裁剪对话历史"""
+
+import pytest
+
+from app.core.config import settings
+from app.models.schemas import OpenAIRequest
+from app.utils.context_window import apply_context_window, parse_budgets, truncate_middle
+from app.utils.tokens import estimate_tokens
+
+
+@pytest.fixture(autouse=True)
+def window_settings(monkeypatch):
+    monkeypatch.setattr(settings, "CONTEXT_TOKEN_BUDGET", 0)
+    monkeypatch.setattr(settings, "CONTEXT_TOKEN_BUDGETS", "")
+    monkeypatch.setattr(settings, "TOOL_RESULT_MAX_TOKENS", 0)
+
+
+def _conversation(turns: int, size: int = 400):
+    messages = [{"role": "system", "content": "你是助手"}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"问题 {i} " + "x" * size})
+        messages.append({"role": "assistant", "content": None, "tool_calls": [{"id": f"call_{i}"}]})
+        messages.append({"role": "tool", "content": "y" * size})
+        messages.append({"role": "assistant", "content": f"回答 {i}"})
+    return OpenAIRequest(model="GLM-4.5", messages=messages)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd" * 100) == 100
+    assert estimate_tokens("你好世界") == 4
+    assert estimate_tokens("ab你好") == 3
+
+
+def test_disabled_by_default():
+    request = _conversation(10)
+    assert apply_context_window(request) == (request, None)
+
+
+def test_keeps_system_and_newest_whole_turns(monkeypatch):
+    monkeypatch.setattr(settings, "CONTEXT_TOKEN_BUDGET", 700)
+    request = _conversation(10)
+
+    trimmed, window = apply_context_window(request)
+
+    assert trimmed.messages[0].role == "system"
+    assert trimmed.messages[1].role == "user"
+    assert trimmed.messages[-1].content == "回答 9"
+    # 每轮 4 条消息，整轮丢弃
+    assert window.dropped_messages % 4 == 0 and window.dropped_messages > 0
+    assert len(trimmed.messages) == 1 + 40 - window.dropped_messages
+    assert window.tokens_after <= 700 < window.tokens_before
+    assert window.headers()["X-Context-Trimmed-Messages"] == str(window.dropped_messages)
+    # 原请求不被修改
+    assert len(request.messages) == 41
+
+
+def test_newest_turn_kept_even_over_budget(monkeypatch):
+    monkeypatch.setattr(settings, "CONTEXT_TOKEN_BUDGET", 10)
+    trimmed, window = apply_context_window(_conversation(3))
+    assert [m.role for m in trimmed.messages] == ["system", "user", "assistant", "tool", "assistant"]
+    assert window.tokens_after > 10
+
+
+def test_per_model_budget(monkeypatch):
+    monkeypatch.setattr(settings, "CONTEXT_TOKEN_BUDGET", 100000)
+    monkeypatch.setattr(settings, "CONTEXT_TOKEN_BUDGETS", "GLM-4.5-Air=500, bad, GLM-4.5=x")
+    assert parse_budgets("GLM-4.5-Air=500, bad, GLM-4.5=x") == {"GLM-4.5-Air": 500}
+
+    request = _conversation(10)
+    assert not apply_context_window(request)[1].trimmed
+    air = request.model_copy(update={"model": "GLM-4.5-Air"})
+    assert apply_context_window(air)[1].dropped_messages > 0
+
+
+def test_tool_result_middle_truncation(monkeypatch):
+    monkeypatch.setattr(settings, "TOOL_RESULT_MAX_TOKENS", 50)
+    request = OpenAIRequest(model="GLM-4.5", messages=[
+        {"role": "user", "content": "读文件"},
+        {"role": "tool", "content": "HEAD" + "z" * 2000 + "TAIL"},
+    ])
+
+    trimmed, window = apply_context_window(request)
+
+    content = trimmed.messages[1].content
+    assert content.startswith("HEAD") and content.endswith("TAIL")
+    assert "已省略" in content
+    assert window.truncated_messages == 1 and window.dropped_messages == 0
+    assert window.trimmed_tokens > 400
+    assert truncate_middle("short", 50) == "short"
@@ -0,0 +1,124 @@
+"""测试上游分阶段超时：时间轮、首字节 / 空闲 / 总时长截止与首字节前重试"""
+
+import json
+import threading
+import time
+
+import pytest
+
+from app.core import response_handlers
+from app.core.config import settings
+from app.utils.deadlines import UpstreamDeadlines, UpstreamTimeout, request_deadline
+from app.utils.timer_wheel import TimerWheel
+
+
+class StallingUpstream:
+    """按计划输出数据块的上游；None 表示停滞直到连接被关闭，异常实例表示读取时抛出"""
+
+    status_code = 200
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.closed = threading.Event()
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for item in self.plan:
+            if item is None:
+                self.closed.wait(5)
+                raise ConnectionError("connection closed")
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def iter_lines(self):
+        for chunk in self.iter_content():
+            yield chunk.rstrip(b"\n")
+
+    def close(self):
+        self.closed.set()
+
+
+def _zai(text):
+    return ("data: " + json.dumps({"type": "chat:completion", "data": {"delta_content": text, "phase": "answer"}}) + "\n").encode()
+
+
+_DONE = b'data: {"type":"chat:completion","data":{"phase":"done","done":true}}\n'
+
+
+@pytest.fixture
+def phases(monkeypatch):
+    monkeypatch.setattr(settings, "UPSTREAM_FIRST_BYTE_TIMEOUT", 0.2)
+    monkeypatch.setattr(settings, "UPSTREAM_IDLE_TIMEOUT", 0.2)
+    monkeypatch.setattr(settings, "UPSTREAM_TOTAL_TIMEOUT", 0)
+
+
+def test_timer_wheel_fires_in_order_and_skips_cancelled():
+    wheel = TimerWheel(tick=0.01, slots=4)
+    fired = []
+    wheel.schedule(0.15, lambda: fired.append("late"))  # 超过一圈
+    wheel.schedule(0.02, lambda: fired.append("early"))
+    wheel.schedule(0.05, lambda: fired.append("cancelled")).cancel()
+    time.sleep(0.3)
+    assert fired == ["early", "late"]
+    assert wheel.pending == 0
+
+
+def test_request_deadline_takes_the_earlier_limit(monkeypatch):
+    monkeypatch.setattr(settings, "UPSTREAM_TOTAL_TIMEOUT", 30)
+    assert request_deadline("5") - time.monotonic() == pytest.approx(5, abs=0.1)
+    assert request_deadline("bogus") - time.monotonic() == pytest.approx(30, abs=0.1)
+    monkeypatch.setattr(settings, "UPSTREAM_TOTAL_TIMEOUT", 0)
+    assert request_deadline(None) is None
+
+
+def test_first_byte_timeout(phases):
+    with pytest.raises(UpstreamTimeout) as e:
+        UpstreamDeadlines().watch(StallingUpstream([None]))
+    assert e.value.phase == "first_byte"
+
+
+def test_failed_first_read_releases_the_connection(phases):
+    upstream = StallingUpstream([ConnectionError("reset")])
+    with pytest.raises(ConnectionError):
+        UpstreamDeadlines().watch(upstream)
+    assert upstream.closed.is_set()
+
+
+def test_idle_gap_aborts_a_stalled_stream(phases):
+    response = UpstreamDeadlines().watch(StallingUpstream([b"a", b"b", None]))
+    received = []
+    with pytest.raises(UpstreamTimeout) as e:
+        for chunk in response.iter_content():
+            received.append(chunk)
+    assert received == [b"a", b"b"] and e.value.phase == "idle"
+
+
+def test_total_deadline(phases):
+    deadlines = UpstreamDeadlines(time.monotonic() + 0.1)
+    response = deadlines.watch(StallingUpstream([b"a", None]))
+    with pytest.raises(UpstreamTimeout) as e:
+        list(response.iter_content())
+    assert e.value.phase == "total"
+
+
+def test_stream_retries_on_another_token_and_endpoint_before_first_byte(phases, fake_upstream, monkeypatch):
+    monkeypatch.setattr(settings, "UPSTREAM_RETRIES", 1)
+    monkeypatch.setattr(settings, "UPSTREAM_FALLBACK_ENDPOINTS", "http://backup/api")
+    stalled = fake_upstream.script(StallingUpstream([None]), StallingUpstream([_zai("hi"), _DONE]))
+    monkeypatch.setattr(response_handlers, "get_auth_token", lambda key=None: "fresh")
+
+    handler = response_handlers.StreamResponseHandler(b"{}", "chat", "first")
+    text = "".join(handler.handle())
+    assert '"content":"hi"' in text
+    assert [(call.token, call.endpoint) for call in fake_upstream.calls] == [
+        ("first", settings.API_ENDPOINT), ("fresh", "http://backup/api")
+    ]
+    # 每次尝试都带首字节截止时间作为读超时，失败的尝试已关闭
+    assert all(call.timeout is not None for call in fake_upstream.calls)
+    assert stalled.closed.is_set()
+
+
+def test_stalled_stream_reports_idle_timeout(phases, fake_upstream):
+    fake_upstream.script(StallingUpstream([_zai("partial"), None]))
+    text = "".join(response_handlers.StreamResponseHandler(b"{}", "chat", "token").handle())
+    assert "partial" in text and "Upstream idle timeout" in text and text.endswith("data: [DONE]\n\n")
@@ -0,0 +1,124 @@
+"""测试 n > 1 的并发候选：合并流式与非流式响应"""
+
+import asyncio
+import itertools
+import json
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.core import openai, scheduler
+from app.core.config import settings
+from app.core.fanout import FanOut
+from app.core.openai import PreparedCompletion
+from app.models.schemas import OpenAIRequest
+
+
+class SlowUpstream:
+    """每个候选延迟 delay 秒后返回两段内容"""
+
+    status_code = 200
+
+    def __init__(self, name, delay):
+        self.name = name
+        self.delay = delay
+        self.aborted = False
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        time.sleep(self.delay)
+        for text in (self.name, "!"):
+            if self.aborted:
+                raise ConnectionError("aborted")
+            yield ("data: " + json.dumps({"type": "chat:completion", "data": {"delta_content": text, "phase": "answer"}}) + "\n").encode()
+        yield b'data: {"type":"chat:completion","data":{"phase":"done","done":true}}\n'
+
+    def iter_lines(self):
+        for chunk in self.iter_content():
+            yield chunk[:-1]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def upstream(fake_upstream, monkeypatch):
+    names = itertools.count(1)
+    fake_upstream.respond(lambda body: SlowUpstream(f"c{next(names)}", 0.2))
+    monkeypatch.setattr(settings, "CONTEXT_TOKEN_BUDGET", 0)
+    monkeypatch.setattr(openai, "get_auth_token", lambda key=None: "token")
+    return fake_upstream
+
+
+def _fanout(n, stream):
+    request = OpenAIRequest(model=settings.PRIMARY_MODEL, messages=[{"role": "user", "content": "hi"}], stream=stream, n=n)
+    first = PreparedCompletion(request, None)
+    return FanOut(n, first, lambda index: PreparedCompletion(request, None, index))
+
+
+def test_stream_merges_choices_with_indexes(upstream):
+    started = time.monotonic()
+    lines = list(_fanout(3, True).stream())
+    elapsed = time.monotonic() - started
+
+    events = [line[6:].strip() for line in lines if line.startswith("data: ")]
+    assert events.count("[DONE]") == 1 and events[-1] == "[DONE]"
+    chunks = [json.loads(e) for e in events[:-1]]
+
+    contents = {}
+    for chunk in chunks:
+        choice = chunk["choices"][0]
+        contents.setdefault(choice["index"], "")
+        contents[choice["index"]] += choice["delta"].get("content") or ""
+    assert sorted(contents) == [0, 1, 2]
+    assert sorted(contents.values()) == ["c1!", "c2!", "c3!"]
+    # 各候选使用独立的 chat_id，并发执行：总耗时接近单个候选
+    assert len({json.loads(call.body)["chat_id"] for call in upstream.calls}) == 3
+    # 所有候选属于同一个响应
+    assert len({chunk["id"] for chunk in chunks}) == 1
+    assert elapsed < 0.5
+
+
+def test_non_stream_merges_choices(upstream):
+    started = time.monotonic()
+    body = json.loads(_fanout(4, False).complete().body)
+    elapsed = time.monotonic() - started
+
+    assert [choice["index"] for choice in body["choices"]] == [0, 1, 2, 3]
+    assert sorted(choice["message"]["content"] for choice in body["choices"]) == ["c1!", "c2!", "c3!", "c4!"]
+    assert elapsed < 0.6
+
+
+def test_closing_the_stream_aborts_all_choices(upstream):
+    fanout = _fanout(3, True)
+    stream = fanout.stream()
+    next(stream)
+    stream.close()
+    assert fanout.aborted
+
+
+def test_endpoint_with_fewer_slots_than_choices(upstream, monkeypatch):
+    # 名额少于 n 时按上限一次申请，候选不再各自排队而互相等待
+    monkeypatch.setattr(settings, "SKIP_AUTH_TOKEN", True)
+    monkeypatch.setattr(settings, "UPSTREAM_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "UPSTREAM_QUEUE_TIMEOUT", 1)
+    monkeypatch.setattr(scheduler, "_scheduler", None)
+    request = OpenAIRequest(model=settings.PRIMARY_MODEL, messages=[{"role": "user", "content": "hi"}], n=2)
+
+    async def call():
+        return await openai.chat_completions(request, authorization="Bearer k", x_priority=None,
+                                             last_event_id=None, x_request_timeout=None)
+
+    body = json.loads(asyncio.run(call()).body)
+    assert [choice["index"] for choice in body["choices"]] == [0, 1]
+    assert scheduler.get_scheduler().stats()["in_use"] == 0
+
+
+def test_endpoint_rejects_out_of_range_n(monkeypatch):
+    monkeypatch.setattr(settings, "SKIP_AUTH_TOKEN", True)
+    for n in (0, settings.MAX_CHOICES + 1):
+        request = OpenAIRequest(model=settings.PRIMARY_MODEL, messages=[{"role": "user", "content": "hi"}], n=n)
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(openai.chat_completions(request, authorization="Bearer k", x_priority=None,
+                                                last_event_id=None, x_request_timeout=None))
+        assert error.value.status_code == 400
@@ -0,0 +1,74 @@
+"""测试浏览器请求头画像池"""
+
+import random
+from collections import Counter
+
+from app.utils import header_profiles
+from app.utils.header_profiles import (
+    BROWSER_WEIGHTS, HeaderProfilePool, build_profile_headers, detect_browser, load_snapshot_user_agents
+)
+
+EDGE_UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+           "Chrome/139.0.0.0 Safari/537.36 Edg/139.0.0.0")
+SAFARI_UA = ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+             "Version/17.5 Safari/605.1.15")
+FIREFOX_UA = "Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0"
+
+
+def test_profile_headers_are_consistent():
+    edge = build_profile_headers(EDGE_UA)
+    assert '"Microsoft Edge";v="139"' in edge["sec-ch-ua"]
+    assert edge["sec-ch-ua-platform"] == '"Windows"'
+
+    # 非 Chromium 浏览器不发送 Client Hints
+    for ua in (SAFARI_UA, FIREFOX_UA):
+        headers = build_profile_headers(ua)
+        assert "sec-ch-ua" not in headers
+        assert "sec-ch-ua-platform" not in headers
+
+
+def test_sticky_assignment_per_token():
+    pool = HeaderProfilePool([EDGE_UA, SAFARI_UA, FIREFOX_UA], rng=random.Random(1))
+    first = pool.headers(pool.index_for_token("token-a"))
+    for _ in range(20):
+        assert pool.headers(pool.index_for_token("token-a")) == first
+
+    pool.bind("token-b", 2)
+    assert pool.headers(pool.index_for_token("token-b"))["User-Agent"] == FIREFOX_UA
+
+
+def test_sticky_capacity_is_bounded():
+    pool = HeaderProfilePool([EDGE_UA, SAFARI_UA], sticky_capacity=3)
+    for i in range(10):
+        pool.index_for_token(f"t{i}")
+    assert pool.sticky_count() == 3
+
+
+def test_bundled_snapshot_loads():
+    user_agents = load_snapshot_user_agents()
+    pool = HeaderProfilePool(user_agents)
+    assert len(pool) > 0
+    headers = pool.headers(pool.choose_index())
+    assert headers["User-Agent"] in user_agents
+
+
+def test_family_mix_follows_weights_regardless_of_profile_counts():
+    user_agents = load_snapshot_user_agents()
+    assert len(user_agents) == len(set(user_agents))
+    # 快照中各家族的画像数量不同，家族占比仍按 BROWSER_WEIGHTS
+    assert len(set(Counter(detect_browser(ua) for ua in user_agents).values())) > 1
+
+    pool = HeaderProfilePool(user_agents, rng=random.Random(7))
+    draws = 70000
+    families = Counter(detect_browser(pool.headers(pool.choose_index())["User-Agent"]) for _ in range(draws))
+    total = sum(BROWSER_WEIGHTS.values())
+    for family, weight in BROWSER_WEIGHTS.items():
+        assert abs(families[family] / draws - weight / total) < 0.01
+
+
+def test_snapshot_skips_duplicate_user_agents(tmp_path, monkeypatch):
+    collected = [EDGE_UA, SAFARI_UA, EDGE_UA, FIREFOX_UA, SAFARI_UA]
+    monkeypatch.setattr(header_profiles, "collect_fake_useragent_user_agents", lambda count: collected)
+    path = str(tmp_path / "profiles.json")
+    assert header_profiles.write_snapshot(path) == 3
+    assert load_snapshot_user_agents(path) == [EDGE_UA, SAFARI_UA, FIREFOX_UA]
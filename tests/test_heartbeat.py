@@ -0,0 +1,54 @@
+"""测试 SSE 心跳：长时间无输出时插入 ": ping"，有输出时不发送"""
+
+import time
+
+from app.core.config import settings
+from app.core.heartbeat import PING
+from app.core.read_ahead import ReadAheadBuffer
+from app.core.resumable import StreamReplayRegistry
+
+
+def _paced(events, gap):
+    for event in events:
+        time.sleep(gap)
+        yield event
+
+
+def test_silent_stream_gets_pings_between_events(monkeypatch):
+    monkeypatch.setattr(settings, "HEARTBEAT_INTERVAL", 0.2)
+    events = ["data: a\n\n", "data: b\n\n"]
+    buffer = ReadAheadBuffer(_paced(events, 0.7), lambda: None, max_bytes=1 << 20).start()
+
+    body = b"".join(buffer.read()).decode()
+    assert body.replace(PING, "") == "".join(events)
+    assert body.count(PING) >= 4
+    assert body.startswith(PING)
+    assert buffer.heartbeat.sent >= body.count(PING)
+
+
+def test_busy_stream_gets_no_pings(monkeypatch):
+    monkeypatch.setattr(settings, "HEARTBEAT_INTERVAL", 0.3)
+    events = [f"data: {i}\n\n" for i in range(20)]
+    buffer = ReadAheadBuffer(_paced(events, 0.05), lambda: None, max_bytes=1 << 20).start()
+
+    assert b"".join(buffer.read()).decode() == "".join(events)
+    assert buffer.heartbeat.sent == 0
+
+
+def test_disabled_heartbeat(monkeypatch):
+    monkeypatch.setattr(settings, "HEARTBEAT_INTERVAL", 0)
+    buffer = ReadAheadBuffer(_paced(["data: a\n\n"], 0.3), lambda: None, max_bytes=1 << 20).start()
+    assert b"".join(buffer.read()) == b"data: a\n\n"
+    assert buffer.heartbeat is None
+
+
+def test_replay_pings_are_not_buffered(monkeypatch):
+    monkeypatch.setattr(settings, "HEARTBEAT_INTERVAL", 0.2)
+    registry = StreamReplayRegistry(1 << 20, 1 << 20, 60)
+    buffer = registry.start(_paced(["data: a\n\n", "data: b\n\n"], 0.5), owner="k")
+
+    live = "".join(buffer.read())
+    assert PING in live
+    assert buffer.last_seq == 2
+    # 接续时只补发事件，不重放心跳
+    assert PING not in "".join(buffer.read(0))
@@ -0,0 +1,61 @@
+"""测试请求与 chunk ID：并发唯一、单调递增，同一个流的 chunk 共用一个 id"""
+
+import threading
+
+from app.core.response_handlers import StreamResponseHandler
+from app.utils.helpers import generate_request_ids
+from app.utils.ids import IdGenerator, completion_id, new_id, worker_index, worker_of
+
+
+def test_ids_are_fixed_width_and_increasing():
+    ids = [new_id() for _ in range(10000)]
+    assert len({len(i) for i in ids}) == 1
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert completion_id().startswith("chatcmpl-")
+
+
+def test_concurrent_ids_do_not_collide():
+    results = []
+
+    def worker():
+        results.append([new_id() for _ in range(5000)])
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ids = [i for batch in results for i in batch]
+    assert len(set(ids)) == len(ids)
+    # 每个线程取到的 ID 仍按生成顺序递增
+    assert all(batch == sorted(batch) for batch in results)
+
+
+def test_workers_use_distinct_nodes():
+    first, second, restarted = IdGenerator(1), IdGenerator(2), IdGenerator(1)
+    assert first.next()[-8:-6] == "01" and second.next()[-8:-6] == "02"
+    # 滚动重启时同一序号的新旧 worker 并存，随机部分区分两者
+    assert first.node != restarted.node
+
+
+def test_worker_is_recoverable_from_the_id():
+    assert worker_of(IdGenerator(3).next()) == 3
+    assert worker_of(f"chatcmpl-{IdGenerator(17).next()}") == 17
+    assert worker_of(new_id()) == worker_index()
+    assert worker_of("s") is None and worker_of("x" * 22) is None
+
+
+def test_request_ids_differ_within_the_same_second():
+    chat_ids = {generate_request_ids()[0] for _ in range(100)}
+    assert len(chat_ids) == 100
+
+
+def test_stream_chunks_share_one_id(fake_upstream, stream_chunks):
+    fake_upstream(["a", "b", "c"])
+    first = stream_chunks(StreamResponseHandler(b"{}", "chat", "token"))
+    fake_upstream(["d"])
+    second = stream_chunks(StreamResponseHandler(b"{}", "chat", "token"))
+    assert len({chunk["id"] for chunk in first}) == 1
+    assert len({chunk["created"] for chunk in first}) == 1
+    assert first[0]["id"] != second[0]["id"]
@@ -0,0 +1,59 @@
+"""测试流排空控制"""
+
+import asyncio
+
+from app.core import lifecycle
+from app.core.lifecycle import DrainController
+
+
+def test_track_counts_in_flight_streams():
+    controller = DrainController()
+    stream = controller.track(iter(["a", "b"]), abort=lambda: None)
+    assert controller.active_count() == 0
+    assert next(stream) == "a"
+    assert controller.active_count() == 1
+    assert list(stream) == ["b"]
+    assert controller.active_count() == 0
+
+
+def test_force_close_aborts_remaining_streams():
+    controller = DrainController()
+    aborted = []
+    streams = [controller.track(iter(["x"] * 3), abort=lambda i=i: aborted.append(i)) for i in range(3)]
+    for stream in streams[:2]:
+        next(stream)
+
+    controller.start_drain()
+    assert asyncio.run(controller.wait_idle(0.2)) is False
+    assert controller.force_close() == 2
+    assert sorted(aborted) == [0, 1]
+    assert controller.status() == {"draining": True, "active_streams": 2, "force_closed_streams": 2}
+
+    for stream in streams[:2]:
+        stream.close()
+    assert asyncio.run(controller.wait_idle(0.2)) is True
+
+
+def test_draining_refuses_new_requests_but_not_forwarded_resumes(monkeypatch):
+    monkeypatch.setattr(lifecycle, "drain_controller", DrainController())
+    lifecycle.drain_controller.start_drain()
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    def status(server, headers):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "path": "/v1/chat/completions", "server": server, "headers": headers}
+        asyncio.run(lifecycle.DrainMiddleware(app)(scope, None, send))
+        return sent[0]["status"]
+
+    resume = [(b"last-event-id", b"0000000000000001000000:3")]
+    assert status(("127.0.0.1", 8080), []) == 503
+    assert status(("127.0.0.1", 8080), resume) == 503
+    # 其他 worker 经私有 Unix socket 转发来的断线重连
+    assert status(None, resume) == 200
+    assert status(None, []) == 503
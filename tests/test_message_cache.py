@@ -0,0 +1,78 @@
+"""测试多轮对话的消息前缀缓存"""
+
+import json
+
+import pytest
+
+from app.models.schemas import OpenAIRequest
+from app.utils import upstream_builder
+from app.utils.message_cache import MessagePrefixCache
+
+TOOL = {"type": "function", "function": {"name": "search", "description": "搜索", "parameters": {}}}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = MessagePrefixCache(max_bytes=1 << 20)
+    monkeypatch.setattr(upstream_builder, "get_message_cache", lambda: cache)
+    return cache
+
+
+def _agent_turns(turns: int):
+    messages = [{"role": "user", "content": "查一下天气"}]
+    for i in range(turns):
+        yield OpenAIRequest(model="GLM-4.5", messages=list(messages), tools=[TOOL], tool_choice="auto")
+        messages.append({"role": "assistant", "content": f"调用工具 {i}"})
+        messages.append({"role": "tool", "content": json.dumps({"result": i})})
+        messages.append({"role": "user", "content": f"继续 {i}"})
+
+
+def test_cached_encoding_matches_uncached(cache):
+    for request in _agent_turns(6):
+        expected = json.loads(upstream_builder._encode(upstream_builder.upstream_messages(request)))
+        assert json.loads(upstream_builder.encode_messages(request)) == expected
+    # 第一轮只有一条消息不查缓存，第二轮未命中，之后每轮都命中上一轮的前缀
+    assert cache.misses == 1
+    assert cache.hits == 4
+    # 被延续的旧前缀保留，但排在淘汰队列的最前面
+    assert len(cache) == 5
+    assert list(cache._entries)[-1] == max(cache._entries, key=lambda k: len(cache._entries[k]))
+
+
+def test_sibling_branches_share_the_extended_prefix(cache):
+    history = [{"role": "user", "content": "写一首诗"}, {"role": "assistant", "content": "第一版"}]
+    for follow_up in ("再改改", "换个风格"):
+        messages = history + [{"role": "user", "content": follow_up}, {"role": "assistant", "content": follow_up},
+                              {"role": "user", "content": "继续"}]
+        upstream_builder.encode_messages(OpenAIRequest(model="GLM-4.5", messages=history + [{"role": "user", "content": "?"}]))
+        upstream_builder.encode_messages(OpenAIRequest(model="GLM-4.5", messages=messages))
+    # 第二个分支的两个请求都命中第一个分支留下的共同前缀
+    assert cache.misses == 1 and cache.hits == 3
+
+
+def test_replaced_prefix_is_evicted_first():
+    cache = MessagePrefixCache(max_bytes=1000)
+    cache.store(1, b"x" * 200)
+    cache.store(2, b"y" * 200)
+    cache.store(3, b"z" * 200, replaces=2)
+    cache.store(4, b"w" * 200)
+    assert cache.longest_prefix([2]) == (0, b"")
+    assert cache.longest_prefix([1]) == (1, b"x" * 200)
+
+
+def test_tool_change_does_not_reuse_prefix(cache):
+    messages = [{"role": "system", "content": "s"}, {"role": "user", "content": "a"}, {"role": "user", "content": "b"}]
+    upstream_builder.encode_messages(OpenAIRequest(model="GLM-4.5", messages=messages, tools=[TOOL]))
+    other = OpenAIRequest(model="GLM-4.5", messages=messages)
+    encoded = json.loads(upstream_builder.encode_messages(other))
+    assert encoded[0]["content"] == "s"
+    assert cache.hits == 0
+
+
+def test_lru_is_bounded_by_bytes():
+    cache = MessagePrefixCache(max_bytes=1000)
+    for key in range(10):
+        cache.store(key, b"x" * 200)
+    assert cache.size <= 1000
+    assert cache.longest_prefix([0]) == (0, b"")
+    assert cache.longest_prefix([8, 9]) == (2, b"x" * 200)
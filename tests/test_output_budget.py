@@ -0,0 +1,59 @@
+"""测试本地执行 max_tokens 并提前关闭上游"""
+
+import json
+
+from app.core.response_handlers import NonStreamResponseHandler, StreamResponseHandler
+from app.utils.tokens import OutputBudget, estimate_tokens
+
+
+def test_budget_matches_whole_text_estimate():
+    budget = OutputBudget(1000)
+    text = "hello 世界, streaming tokens 逐块 counted"
+    for char in text:
+        assert budget.take(char) == char
+    assert budget.used == estimate_tokens(text)
+
+
+def test_budget_truncates_last_delta():
+    budget = OutputBudget(3)
+    assert budget.take("abcd") == "abcd"
+    assert budget.take("你好世界") == "你好"
+    assert budget.exhausted
+    assert budget.take("more") == ""
+
+
+def test_reasoning_not_counted_by_default():
+    budget = OutputBudget(1)
+    assert budget.take("long thinking " * 10, reasoning=True) == "long thinking " * 10
+    assert not budget.exhausted
+    assert OutputBudget(1, count_reasoning=True).take("long thinking", reasoning=True) == "long"
+
+
+def test_stream_stops_at_max_tokens(fake_upstream, stream_chunks):
+    response = fake_upstream(["abcd"] * 50)
+    handler = StreamResponseHandler(b"{}", "chat", "token", max_tokens=5)
+
+    chunks = stream_chunks(handler)
+
+    content = "".join(c["choices"][0]["delta"].get("content") or "" for c in chunks)
+    assert content == "abcd" * 5
+    assert chunks[-1]["choices"][0]["finish_reason"] == "length"
+    assert response.aborted
+    assert response.consumed == 5
+
+
+def test_stream_without_max_tokens_runs_to_completion(fake_upstream, stream_chunks):
+    response = fake_upstream(["abcd"] * 50)
+    chunks = stream_chunks(StreamResponseHandler(b"{}", "chat", "token"))
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+    assert not response.aborted
+
+
+def test_non_stream_stops_at_max_tokens(fake_upstream):
+    response = fake_upstream(["你好"] * 50)
+    result = NonStreamResponseHandler(b"{}", "chat", "token", max_tokens=7).handle()
+
+    choice = json.loads(result.body)["choices"][0]
+    assert choice["message"]["content"] == "你好" * 3 + "你"
+    assert choice["finish_reason"] == "length"
+    assert response.aborted
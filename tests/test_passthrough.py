@@ -0,0 +1,96 @@
+"""测试 OpenAI 兼容上游的直通模式：原样转发字节，仅改写 model 字段"""
+
+import json
+
+import pytest
+
+from app.core.config import settings
+from app.core.response_handlers import NonStreamResponseHandler, StreamResponseHandler, rewrite_model
+
+
+def _chunk(content, model="upstream-model", finish_reason=None):
+    return json.dumps({
+        "id": "chatcmpl-up", "object": "chat.completion.chunk", "model": model,
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}],
+    }, ensure_ascii=False)
+
+
+class OpenAIUpstream:
+    status_code = 200
+
+    def __init__(self, lines=None, content=b"", chunks=None):
+        self.lines = lines or []
+        self.content = content
+        self.chunks = chunks
+        self.closed = False
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        if self.chunks is not None:
+            yield from self.chunks
+            return
+        for line in self.lines:
+            yield line.encode("utf-8") + b"\n"
+        if not self.lines:
+            yield self.content
+
+    def iter_lines(self):
+        for chunk in self.iter_content():
+            yield chunk[:-1]
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def upstream(fake_upstream, monkeypatch):
+    monkeypatch.setattr(settings, "UPSTREAM_TYPE", "openai")
+    monkeypatch.setattr(settings, "OPENAI_PASSTHROUGH", True)
+    return lambda **kwargs: fake_upstream.script(OpenAIUpstream(**kwargs))
+
+
+def test_rewrite_model_only_touches_the_model_field():
+    data = b'{"model":"up","choices":[{"delta":{"content":"\\"model\\":\\"x\\""}}]}'
+    rewritten = rewrite_model(data, "GLM-4.5")
+    assert rewritten == data.replace(b'"model":"up"', b'"model":"GLM-4.5"')
+    assert rewrite_model(rewritten, "GLM-4.5") is rewritten
+
+
+def test_rewrite_model_skips_nested_model_fields():
+    data = b'{"meta":{"model":"inner"},"items":["model"],"model" : "up"}'
+    assert rewrite_model(data, "GLM-4.5") == data.replace(b'"up"', b'"GLM-4.5"')
+    assert rewrite_model(b'{"meta":{"model":"inner"}}', "GLM-4.5") == b'{"meta":{"model":"inner"}}'
+    assert rewrite_model(b'not json "model":"x"', "GLM-4.5") == b'not json "model":"x"'
+
+
+def test_stream_forwards_upstream_events_verbatim(upstream):
+    lines = [f"data: {_chunk('你好')}", "", f"data: {_chunk('!', finish_reason='stop')}", "", ": comment", "",
+             "data: [DONE]", ""]
+    response = upstream(lines=lines)
+    events = list(StreamResponseHandler(b"{}", "chat", "token", max_tokens=1, stop="x").handle())
+
+    expected = "\n".join(lines).replace('"upstream-model"', f'"{settings.PRIMARY_MODEL}"') + "\n"
+    assert all(isinstance(e, bytes) for e in events)
+    assert b"".join(events).decode("utf-8") == expected
+    assert len(events) == 4 and response.closed
+
+
+def test_stream_keeps_upstream_framing_across_chunk_boundaries(upstream):
+    first = b'data: {"meta":{"model":"inner"},"model":"upstream-model"}\r\n\r\n'
+    second = b'data: {"model":"upstream-model","x":1}\r\n\r\ndata: [DONE]\r\n\r\n'
+    body = first + second
+    # 在 model 字段中间切块
+    split = len(first) + 12
+    upstream(chunks=[body[:20], body[20:split], body[split:]])
+    events = list(StreamResponseHandler(b"{}", "chat", "token").handle())
+
+    model = f'"{settings.PRIMARY_MODEL}"'.encode()
+    assert b"".join(events) == body.replace(b'"model":"upstream-model"', b'"model":' + model)
+    assert b'{"model":"inner"}' in events[0]
+
+
+def test_non_stream_returns_upstream_body_with_model_rewritten(upstream):
+    body = json.dumps({"id": "up", "model": "upstream-model", "choices": [{"message": {"content": "hi"}}]}).encode()
+    upstream(content=body)
+    response = NonStreamResponseHandler(b"{}", "chat", "token").handle()
+    assert json.loads(response.body)["model"] == settings.PRIMARY_MODEL
+    assert response.body == body.replace(b'"upstream-model"', f'"{settings.PRIMARY_MODEL}"'.encode())
@@ -0,0 +1,86 @@
+"""测试预读缓冲：上游全速读取、慢客户端合并读取与溢出策略"""
+
+import threading
+import time
+
+from app.core.read_ahead import ReadAheadBuffer
+
+
+def _events(count, size=10):
+    return [f"data: {i:0{size}d}\n\n" for i in range(count)]
+
+
+class Source:
+    """记录读取进度的上游流"""
+
+    def __init__(self, events):
+        self.events = events
+        self.read = 0
+        self.done = threading.Event()
+
+    def __iter__(self):
+        for event in self.events:
+            self.read += 1
+            yield event
+        self.done.set()
+
+
+def _aborter():
+    calls = []
+    return calls, lambda: calls.append(True)
+
+
+def test_upstream_is_drained_before_the_client_reads():
+    source = Source(_events(50))
+    calls, abort = _aborter()
+    buffer = ReadAheadBuffer(iter(source), abort, max_bytes=1 << 20).start()
+    assert source.done.wait(1)
+
+    chunks = list(buffer.read())
+    # 客户端落后时已缓冲的事件合并为一次写入
+    assert len(chunks) < 50
+    assert b"".join(chunks).decode() == "".join(source.events)
+    assert not calls
+
+
+def test_drop_policy_aborts_and_disconnects_slow_clients():
+    source = Source(_events(50))
+    calls, abort = _aborter()
+    buffer = ReadAheadBuffer(iter(source), abort, max_bytes=200, overflow="drop").start()
+    # 客户端尚未读取，缓冲区超出上限后生产线程结束
+    deadline = time.monotonic() + 1
+    while not buffer.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    received = b"".join(buffer.read())
+
+    assert buffer.overflowed and calls
+    assert source.read < 50
+    assert "".join(source.events).encode().startswith(received)
+
+
+def test_spill_policy_keeps_every_event_in_order(tmp_path):
+    source = Source(_events(200))
+    calls, abort = _aborter()
+    buffer = ReadAheadBuffer(iter(source), abort, max_bytes=200, overflow="spill", spill_dir=str(tmp_path)).start()
+    assert source.done.wait(1)
+
+    assert b"".join(buffer.read()).decode() == "".join(source.events)
+    assert buffer.spilled > 0 and buffer.peak <= 200
+    assert not calls
+
+
+def test_client_disconnect_aborts_upstream():
+    gate = threading.Event()
+
+    def source():
+        yield "data: 1\n\n"
+        gate.wait(1)
+        yield "data: 2\n\n"
+
+    calls, abort = _aborter()
+    buffer = ReadAheadBuffer(source(), abort, max_bytes=1 << 20).start()
+    reader = buffer.read()
+    assert next(reader) == b"data: 1\n\n"
+    reader.close()
+    gate.set()
+    assert calls and buffer.closed
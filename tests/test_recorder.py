@@ -0,0 +1,61 @@
+"""测试上游录制文件的写入与读取"""
+
+import io
+
+import requests
+
+from app.utils.recorder import REDACTED, UpstreamRecorder, iter_capture_paths, load_capture
+
+
+def _make_response(body: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "text/event-stream"
+    response.raw = io.BytesIO(body)
+    return response
+
+
+def test_record_and_load_roundtrip(tmp_path):
+    body = (
+        b'data: {"type":"chat:completion","data":{"delta_content":"hi","phase":"answer"}}\n\n'
+        b'data: {"type":"chat:completion","data":{"phase":"done","done":true}}\n\n'
+    )
+    recorder = UpstreamRecorder(
+        str(tmp_path),
+        upstream_type="zai",
+        endpoint="https://chat.z.ai/api/chat/completions",
+        payload={"model": "0727-360B-API", "messages": [{"role": "user", "content": "hi"}]},
+        headers={"Authorization": "Bearer secret-token", "Accept": "*/*"},
+        secrets=["secret-token"],
+    )
+    response = recorder.attach(_make_response(body))
+
+    lines = [line for line in response.iter_lines() if line]
+    response.close()
+
+    assert len(lines) == 2
+    paths = iter_capture_paths(str(tmp_path))
+    assert len(paths) == 1
+
+    capture = load_capture(paths[0])
+    assert capture["upstream_type"] == "zai"
+    assert capture["status"] == 200
+    assert capture["request"]["headers"]["Authorization"] == REDACTED
+    assert capture["request"]["body"]["messages"][0]["content"] == "hi"
+    assert b"".join(chunk for _, chunk in capture["chunks"]) == body
+    offsets = [offset for offset, _ in capture["chunks"]]
+    assert offsets == sorted(offsets)
+
+
+def test_recorder_redacts_secrets_in_stream(tmp_path):
+    recorder = UpstreamRecorder(
+        str(tmp_path), "openai", "http://x", payload=b'{"a":1}', headers={}, secrets=["tok123"]
+    )
+    response = recorder.attach(_make_response(b'data: {"echo":"tok123"}\n\n'))
+    assert response.content
+    response.close()
+
+    capture = load_capture(iter_capture_paths(str(tmp_path))[0])
+    data = b"".join(chunk for _, chunk in capture["chunks"])
+    assert b"tok123" not in data
+    assert capture["request"]["body"] == {"a": 1}
@@ -0,0 +1,152 @@
+"""测试可接续流：重放缓冲区、Last-Event-ID 接续与淘汰"""
+
+import asyncio
+import re
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.resumable import (
+    ReplayBuffer, StreamGone, StreamReplayRegistry, forward_resume, resume_owner, worker_socket
+)
+from app.utils.ids import IdGenerator, worker_index
+
+
+def _event(text):
+    return f"data: {text}\n\n"
+
+
+def _seqs(chunks):
+    return [int(seq) for seq in re.findall(r"^id: \w+:(\d+)$", "".join(chunks), re.M)]
+
+
+def _slow_source(count, gate):
+    for i in range(1, count + 1):
+        if i == 3:
+            gate.wait(2)
+        yield _event(i)
+
+
+def test_events_carry_stream_id_and_sequence():
+    registry = StreamReplayRegistry(1 << 20, 1 << 20, 60)
+    buffer = registry.start(iter([_event("a"), _event("b")]), owner="k")
+    events = "".join(buffer.read())
+    assert events.startswith(f"id: {buffer.stream_id}:1\ndata: a\n\n")
+    assert _seqs([events]) == [1, 2]
+
+
+def test_reconnect_continues_the_running_stream():
+    registry = StreamReplayRegistry(1 << 20, 1 << 20, 60)
+    gate = threading.Event()
+    buffer = registry.start(_slow_source(5, gate), owner="k")
+
+    first = buffer.read()
+    received = []
+    while _seqs(received)[-1:] != [2]:
+        received.append(next(first))
+    first.close()  # 客户端断线，上游继续
+
+    resumed, after = registry.resume(f"{buffer.stream_id}:2", "k")
+    assert resumed is buffer and after == 2
+    gate.set()
+    assert _seqs(resumed.read(after)) == [3, 4, 5]
+    assert registry.resumed == 1
+
+
+def test_resume_rejects_other_keys_and_unknown_ids():
+    registry = StreamReplayRegistry(1 << 20, 1 << 20, 60)
+    buffer = registry.start(iter([_event("a")]), owner="k")
+    list(buffer.read())
+    for last_event_id, owner in ((f"{buffer.stream_id}:1", "other"), ("missing:1", "k"), (buffer.stream_id, "k")):
+        with pytest.raises(StreamGone):
+            registry.resume(last_event_id, owner)
+
+
+def test_ring_buffer_drops_oldest_events_past_the_cap():
+    buffer = ReplayBuffer("s", None, max_bytes=100)
+    for i in range(20):
+        buffer.append(_event(i))
+    buffer.finish()
+    assert buffer.size <= 100 and buffer.first_seq > 1
+    with pytest.raises(StreamGone):
+        buffer.check(0)
+    buffer.check(buffer.first_seq - 1)
+    assert _seqs(buffer.read(buffer.first_seq - 1))[-1] == 20
+
+
+def test_finished_streams_are_evicted_by_ttl_and_total_bytes():
+    registry = StreamReplayRegistry(max_bytes=300, stream_bytes=300, ttl=60)
+    buffers = []
+    for _ in range(4):
+        buffer = registry.start(iter([_event("x" * 60)]), owner=None)
+        list(buffer.read())
+        buffers.append(buffer)
+        time.sleep(0.01)
+    registry.evict()
+    # 合计超出上限时从最早结束的流开始淘汰
+    assert registry.stats()["bytes"] <= 300
+    with pytest.raises(StreamGone):
+        registry.resume(f"{buffers[0].stream_id}:1", None)
+    registry.resume(f"{buffers[-1].stream_id}:1", None)
+
+    registry.ttl = 0
+    registry.evict()
+    assert registry.stats()["streams"] == 0
+
+
+class _OwnerWorker(BaseHTTPRequestHandler):
+    """持有缓冲区的 worker：回显收到的 Last-Event-ID"""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers["Authorization"] != "Bearer k":
+            self.send_response(410)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"detail":"gone"}')
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("X-Stream-Id", self.headers["Last-Event-ID"].partition(":")[0])
+        self.end_headers()
+        self.wfile.write(f"id: {self.headers['Last-Event-ID']}\ndata: resumed\n\n".encode())
+
+    def log_message(self, *args):
+        pass
+
+
+async def _body(response):
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+def test_reconnects_are_forwarded_to_the_owning_worker(tmp_path, monkeypatch):
+    monkeypatch.setenv("WORKER_SOCKET_DIR", str(tmp_path))
+    other = (worker_index() + 1) % 256
+    stream_id = IdGenerator(other).next()
+    # 本 worker 的流以及非 serve.py 生成的 ID 在本地接续
+    assert resume_owner(f"{IdGenerator(worker_index()).next()}:3") is None
+    assert resume_owner("missing:1") is None
+    path = resume_owner(f"{stream_id}:3")
+    assert path == worker_socket(other, str(tmp_path))
+
+    server = socketserver.UnixStreamServer(path, _OwnerWorker)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        response = forward_resume(path, b"{}", {"Authorization": "Bearer k", "Last-Event-ID": f"{stream_id}:3"})
+        assert response.status_code == 200 and response.headers["x-stream-id"] == stream_id
+        assert asyncio.run(_body(response)) == f"id: {stream_id}:3\ndata: resumed\n\n".encode()
+
+        response = forward_resume(path, b"{}", {"Authorization": "Bearer other", "Last-Event-ID": f"{stream_id}:3"})
+        assert response.status_code == 410 and response.body == b'{"detail":"gone"}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # 对方 worker 已不存在时缓冲区随之丢失
+    with pytest.raises(HTTPException) as error:
+        forward_resume(str(tmp_path / "worker-99.sock"), b"{}", {})
+    assert error.value.status_code == 410
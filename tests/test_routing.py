@@ -0,0 +1,91 @@
+"""测试按首字节时间自动降级模型：降级、探测恢复与请求替换"""
+
+import json
+
+from app.core import openai, routing
+from app.core.config import settings
+from app.core.openai import PreparedCompletion
+from app.core.routing import ModelRouter, get_model_router
+from app.models.schemas import OpenAIRequest
+from app.utils.helpers import key_digest
+
+FALLBACKS = {"GLM-4.5-Thinking": "GLM-4.5", "GLM-4.5": "GLM-4.5-Air"}
+
+
+def _observe(router, key, model, ttft, times=1):
+    for _ in range(times):
+        router.route(key, model).observe(ttft)
+
+
+def test_router_reads_fallbacks_from_settings(monkeypatch):
+    monkeypatch.setattr(settings, "DEGRADE_TTFT_SLO", 2.0)
+    monkeypatch.setattr(settings, "DEGRADE_MODELS", " A=B, C = D ,bad,E=")
+    monkeypatch.setattr(routing, "_router", None)
+    assert get_model_router().fallbacks == {"A": "B", "C": "D"}
+
+
+def test_degrades_after_sustained_slow_first_bytes():
+    router = ModelRouter(slo=2.0, fallbacks=FALLBACKS, probe_interval=60)
+    _observe(router, "k", "GLM-4.5", 5.0, times=2)
+    assert not router.route("k", "GLM-4.5").substituted
+
+    _observe(router, "k", "GLM-4.5", 5.0)
+    route = router.route("k", "GLM-4.5")
+    assert route.model == "GLM-4.5-Air"
+    assert route.headers() == {"X-Model-Substituted": "GLM-4.5-Air"}
+    # 按 key 与模型分别统计
+    assert not router.route("other", "GLM-4.5").substituted
+    assert not router.route("k", "GLM-4.5-Thinking").substituted
+
+    stats = router.stats()
+    assert stats["degradations"] == 1
+    assert stats["models"]["GLM-4.5"]["substituted"] == 1
+    assert stats["degraded"][0]["fallback"] == "GLM-4.5-Air"
+    # 统计中不出现 key 本身或其前缀
+    assert stats["degraded"][0]["key"] == key_digest("k")[:12]
+
+
+def test_models_without_fallback_are_never_substituted():
+    router = ModelRouter(slo=1.0, fallbacks=FALLBACKS, probe_interval=60)
+    _observe(router, "k", "GLM-4.5-Air", 9.0, times=5)
+    assert not router.route("k", "GLM-4.5-Air").substituted
+
+
+def test_probe_recovers_once_the_model_is_fast_again():
+    router = ModelRouter(slo=2.0, fallbacks=FALLBACKS, probe_interval=0)
+    _observe(router, "k", "GLM-4.5-Thinking", 4.0, times=3)
+
+    # 探测间隔为 0 时每个请求都是探测；慢探测保持降级
+    probe = router.route("k", "GLM-4.5-Thinking")
+    assert probe.probe and not probe.substituted
+    probe.observe(3.0)
+    assert router.stats()["models"]["GLM-4.5-Thinking"]["degraded"] == 1
+
+    router.route("k", "GLM-4.5-Thinking").observe(0.5)
+    assert router.recoveries == 1
+    assert not router.route("k", "GLM-4.5-Thinking").probe
+
+
+def test_substituted_requests_do_not_affect_the_original_model():
+    router = ModelRouter(slo=2.0, fallbacks=FALLBACKS, probe_interval=60)
+    _observe(router, "k", "GLM-4.5", 5.0, times=3)
+    route = router.route("k", "GLM-4.5")
+    assert route.substituted
+    route.observe(0.1)
+    assert router.route("k", "GLM-4.5").substituted
+
+
+def test_prepared_completion_uses_the_substitute(monkeypatch):
+    monkeypatch.setattr(settings, "UPSTREAM_TYPE", "zai")
+    monkeypatch.setattr(settings, "CONTEXT_TOKEN_BUDGET", 0)
+    monkeypatch.setattr(openai, "get_auth_token", lambda key=None: "token")
+    router = ModelRouter(slo=1.0, fallbacks=FALLBACKS, probe_interval=60)
+    monkeypatch.setattr(routing, "_router", router)
+    _observe(router, "k", settings.THINKING_MODEL, 3.0, times=3)
+
+    request = OpenAIRequest(model=settings.THINKING_MODEL, messages=[{"role": "user", "content": "hi"}])
+    prepared = PreparedCompletion(request, "k")
+    body = json.loads(prepared.upstream_body)
+    assert prepared.extra_headers["X-Model-Substituted"] == settings.PRIMARY_MODEL
+    assert body["features"]["enable_thinking"] is False
+    assert prepared.non_stream_handler().route is prepared.route
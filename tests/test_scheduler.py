@@ -0,0 +1,147 @@
+"""测试上游加权公平调度"""
+
+import asyncio
+import gc
+import threading
+
+import pytest
+
+from app.core import scheduler as scheduler_module
+from app.core.config import settings
+from app.core.scheduler import SchedulerTimeout, UpstreamScheduler, parse_weights, traffic_class
+
+
+def _queue(scheduler, requests):
+    """按顺序排队 (key, 类别)，返回记录放行顺序的列表"""
+    order = []
+    for key, name in requests:
+        waiter = scheduler._enqueue(key, name, lambda key=key, name=name: order.append((key, name)))
+        assert waiter is not None
+    return order
+
+
+def test_weighted_round_robin_across_classes():
+    scheduler = UpstreamScheduler(1, {"interactive": 3, "batch": 1})
+    holder = scheduler.acquire("x", "interactive")
+    order = _queue(scheduler, [("b", "batch")] * 4 + [("i", "interactive")] * 8)
+
+    for _ in range(8):
+        scheduler._release()
+
+    classes = [name for _, name in order]
+    # batch 先到先服务一次，之后每放行 3 个 interactive 放行 1 个 batch
+    assert classes == ["batch", "interactive", "interactive", "interactive", "batch",
+                       "interactive", "interactive", "interactive"]
+    holder.release()
+
+
+def test_round_robin_across_keys_within_class():
+    scheduler = UpstreamScheduler(1, {"interactive": 1})
+    scheduler.acquire("x", "interactive")
+    order = _queue(scheduler, [("heavy", "interactive")] * 5 + [("light1", "interactive"), ("light2", "interactive")])
+    for _ in range(4):
+        scheduler._release()
+    assert [key for key, _ in order] == ["heavy", "light1", "light2", "heavy"]
+
+
+def test_free_slots_are_taken_without_queueing():
+    scheduler = UpstreamScheduler(2, {"interactive": 1})
+    first = scheduler.acquire("a", "interactive")
+    second = scheduler.acquire("a", "interactive")
+    assert scheduler.stats()["in_use"] == 2
+    with pytest.raises(SchedulerTimeout):
+        scheduler.acquire("a", "interactive", timeout=0.05)
+    assert scheduler.stats()["classes"]["interactive"]["queued"] == 0
+
+    first.release()
+    first.release()  # 重复释放无效
+    third = scheduler.acquire("a", "interactive", timeout=1)
+    assert scheduler.stats()["in_use"] == 2
+    second.release()
+    third.release()
+    assert scheduler.stats()["in_use"] == 0
+
+
+def test_blocked_thread_is_granted_on_release():
+    scheduler = UpstreamScheduler(1, {"interactive": 1})
+    holder = scheduler.acquire("a", "interactive")
+    acquired = []
+    thread = threading.Thread(target=lambda: acquired.append(scheduler.acquire("b", "interactive", timeout=5)))
+    thread.start()
+    threading.Timer(0.05, holder.release).start()
+    thread.join(2)
+    assert acquired and acquired[0].wait_ms >= 40
+    assert acquired[0].headers()["X-Queue-Wait-Ms"] == str(int(acquired[0].wait_ms))
+
+
+def test_async_acquire_and_cancel():
+    scheduler = UpstreamScheduler(1, {"interactive": 1})
+
+    async def scenario():
+        holder = await scheduler.acquire_async("a", "interactive")
+        waiting = asyncio.ensure_future(scheduler.acquire_async("b", "interactive"))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        holder.release()
+        slot = await scheduler.acquire_async("c", "interactive", timeout=1)
+        slot.release()
+
+    asyncio.run(scenario())
+    assert scheduler.stats()["in_use"] == 0
+
+
+def test_unstarted_held_stream_releases_on_collection():
+    scheduler = UpstreamScheduler(1, {"interactive": 1})
+    stream = scheduler.acquire("a", "interactive").hold(iter(["data"]))
+    assert scheduler.stats()["in_use"] == 1
+    del stream
+    gc.collect()
+    assert scheduler.stats()["in_use"] == 0
+
+
+def test_priority_header_can_only_downgrade(monkeypatch):
+    monkeypatch.setattr(settings, "UPSTREAM_CONCURRENCY", 4)
+    monkeypatch.setattr(settings, "SCHEDULER_KEY_CLASSES", "sk-eval=batch")
+    monkeypatch.setattr(scheduler_module, "_scheduler", UpstreamScheduler(4, parse_weights("interactive=8,batch=1")))
+
+    assert traffic_class("sk-user") == "interactive"
+    assert traffic_class("sk-user", "batch") == "batch"
+    assert traffic_class("sk-eval") == "batch"
+    assert traffic_class("sk-eval", "interactive") == "batch"
+    assert traffic_class(None, "unknown") == "interactive"
+
+
+def test_multi_slot_requests_wait_for_all_slots_without_holding_any():
+    scheduler = UpstreamScheduler(2, {"interactive": 1})
+    holder = scheduler.acquire("x", "interactive")
+    granted = []
+    waiter = scheduler._enqueue("a", "interactive", lambda: granted.append("a"), count=2)
+    # 单个名额的请求排在后面，不能抢走正在累积的名额
+    scheduler._enqueue("b", "interactive", lambda: granted.append("b"))
+    assert waiter is not None and waiter.held == 1
+    holder.release()
+    assert granted == ["a"] and scheduler.stats()["in_use"] == 2
+    scheduler._release(2)
+    assert granted == ["a", "b"]
+
+
+def test_multi_slot_count_is_capped_at_capacity():
+    scheduler = UpstreamScheduler(1, {"interactive": 1})
+    slot = scheduler.acquire("a", "interactive", timeout=0.5, count=3)
+    assert slot.count == 1
+    slot.release()
+    assert scheduler.stats()["in_use"] == 0
+
+
+def test_cancelled_multi_slot_waiter_returns_its_slots():
+    scheduler = UpstreamScheduler(2, {"interactive": 1})
+    holder = scheduler.acquire("x", "interactive")
+    with pytest.raises(SchedulerTimeout):
+        scheduler.acquire("a", "interactive", timeout=0.05, count=2)
+    assert scheduler.stats()["in_use"] == 1
+    second = scheduler.acquire("b", "interactive", timeout=0.5)
+    holder.release()
+    second.release()
+    assert scheduler.stats()["in_use"] == 0
@@ -0,0 +1,88 @@
+"""测试多 worker 共享状态后端"""
+
+import multiprocessing
+import time
+
+import pytest
+
+from app.utils.shared_state import MemorySharedState, SharedState, SqliteSharedState
+from app.utils.token_pool import AnonymousTokenPool
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def state(request, tmp_path):
+    if request.param == "sqlite":
+        return SqliteSharedState(str(tmp_path / "state.db"))
+    return MemorySharedState()
+
+
+def test_token_lease_is_fifo_and_skips_expired(state):
+    now = time.time()
+    assert state.token_push("stale", now - 120, max_size=3)
+    assert state.token_push("a", now, max_size=3)
+    assert state.token_push("b", now, max_size=3)
+    assert not state.token_push("c", now, max_size=3)
+    assert state.token_lease(now - 60) == "a"
+    assert state.token_lease(now - 60) == "b"
+    assert state.token_lease(now - 60) is None
+
+
+def test_counter_resets_per_window(state):
+    assert state.incr("k", window=3600) == 1
+    assert state.incr("k", amount=2, window=3600) == 3
+    assert state.incr("other", window=3600) == 1
+
+
+def test_expired_tokens_do_not_count_against_the_cap(state):
+    now = time.time()
+    assert state.token_push("stale", now - 120, max_size=1)
+    assert not state.token_push("fresh", now, max_size=1)
+    assert state.token_push("fresh", now, max_size=1, min_fetched_at=now - 60)
+    assert state.token_items(0) == [("fresh", now)]
+
+
+def test_backends_implement_the_whole_interface():
+    with pytest.raises(TypeError):
+        SharedState()
+    assert not MemorySharedState.__abstractmethods__ and not SqliteSharedState.__abstractmethods__
+
+
+def test_token_pool_on_shared_state(state):
+    fetched = iter(["t1", "t2", "t3"])
+    pool = AnonymousTokenPool(lambda: next(fetched), size=2, ttl=60, state=state)
+    assert pool.fill() == 2
+    assert len(pool) == 2
+    assert pool.acquire() == "t1"
+
+
+def _lease_all(path, results):
+    state = SqliteSharedState(path)
+    leased = []
+    while True:
+        token = state.token_lease(0)
+        if token is None:
+            break
+        leased.append(token)
+    for _ in range(50):
+        state.incr("hits", window=3600)
+    results.put(leased)
+
+
+def test_sqlite_lease_and_incr_are_atomic_across_processes(tmp_path):
+    path = str(tmp_path / "state.db")
+    state = SqliteSharedState(path)
+    for i in range(200):
+        state.token_push(f"tok-{i}", time.time(), max_size=1000)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_lease_all, args=(path, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    leased = [token for _ in workers for token in results.get(timeout=60)]
+    for worker in workers:
+        worker.join()
+
+    # 每个token只被一个进程取到，计数不丢失
+    assert sorted(leased) == sorted(f"tok-{i}" for i in range(200))
+    assert state.incr("hits", amount=0, window=3600) == 200
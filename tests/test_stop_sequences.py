@@ -0,0 +1,109 @@
+"""测试流式停止序列匹配"""
+
+import json
+import random
+
+import pytest
+
+from app.core.response_handlers import NonStreamResponseHandler, StreamResponseHandler
+from app.models.schemas import OpenAIRequest
+from app.utils.stop_sequences import StopSequenceMatcher, normalize_stop
+
+
+def _stream(matcher, deltas):
+    out = []
+    for delta in deltas:
+        text, hit = matcher.feed(delta)
+        out.append(text)
+        if hit:
+            return "".join(out), True
+    out.append(matcher.flush())
+    return "".join(out), False
+
+
+def _reference(text, stops):
+    ends = [(text.find(s) + len(s), -len(s)) for s in stops if s in text]
+    if not ends:
+        return text, False
+    end, neg_length = min(ends)
+    return text[:end + neg_length], True
+
+
+def test_normalize_stop():
+    assert normalize_stop(None) == []
+    assert normalize_stop("END") == ["END"]
+    assert normalize_stop(["a", "", "a", "b"]) == ["a", "b"]
+    assert OpenAIRequest(model="m", messages=[], stop="x").stop == "x"
+
+
+def test_match_spanning_deltas():
+    matcher = StopSequenceMatcher(["</answer>"])
+    assert matcher.feed("final value 4</") == ("final value 4", False)
+    assert matcher.held == "</"
+    assert matcher.feed("ans") == ("", False)
+    assert matcher.feed("wer> trailing") == ("", True)
+
+
+def test_holds_back_only_possible_prefix():
+    matcher = StopSequenceMatcher(["abcd"])
+    assert matcher.feed("xxabc") == ("xx", False)
+    # "abcx" 不能再构成停止序列，扣留的内容全部放行
+    assert matcher.feed("x") == ("abcx", False)
+    assert matcher.held == ""
+    assert matcher.feed("ab") == ("", False)
+    assert matcher.flush() == "ab"
+
+
+def test_overlapping_sequences_stop_at_first_end():
+    assert _stream(StopSequenceMatcher(["abcd", "bc"]), ["a", "bcd"]) == ("a", True)
+    assert _stream(StopSequenceMatcher(["she", "he", "hers"]), ["us", "hers"]) == ("u", True)
+    assert _stream(StopSequenceMatcher(["aab"]), ["aaa", "ab"]) == ("aa", True)
+
+
+def test_matches_reference_on_random_streams():
+    rng = random.Random(7)
+    for _ in range(500):
+        stops = ["".join(rng.choice("ab\n") for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 3))]
+        text = "".join(rng.choice("abc\n") for _ in range(rng.randint(0, 40)))
+        cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, 6))))
+        deltas = [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+        assert _stream(StopSequenceMatcher(stops), deltas) == _reference(text, stops), (stops, deltas)
+
+
+def test_stream_handler_truncates_and_aborts(fake_upstream, stream_chunks):
+    response = fake_upstream(["Answer: 42", "\n\nObs", "ervation: extra", " text"] + ["more"] * 20)
+    handler = StreamResponseHandler(b"{}", "chat", "token", stop=["\n\nObservation:", "STOP"])
+
+    chunks = stream_chunks(handler)
+
+    content = "".join(c["choices"][0]["delta"].get("content") or "" for c in chunks)
+    assert content == "Answer: 42"
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+    assert response.aborted
+    assert response.consumed == 3
+
+
+def test_stream_handler_releases_held_text_at_end(fake_upstream, stream_chunks):
+    response = fake_upstream(["done\n\nObs"])
+    chunks = stream_chunks(StreamResponseHandler(b"{}", "chat", "token", stop="\n\nObservation:"))
+    content = "".join(c["choices"][0]["delta"].get("content") or "" for c in chunks)
+    assert content == "done\n\nObs"
+    assert not response.aborted
+
+
+def test_non_stream_handler(fake_upstream):
+    response = fake_upstream(["第一句。", "第二句", "。###", "多余"])
+    result = NonStreamResponseHandler(b"{}", "chat", "token", stop=["###"]).handle()
+    choice = json.loads(result.body)["choices"][0]
+    assert choice["message"]["content"] == "第一句。第二句。"
+    assert choice["finish_reason"] == "stop"
+    assert response.aborted
+
+
+@pytest.mark.parametrize("max_tokens, expected", [(2, "ab, cd, "), (100, "ab, cd, ef")])
+def test_stop_combined_with_max_tokens(fake_upstream, stream_chunks, max_tokens, expected):
+    fake_upstream(["ab, ", "cd, ", "ef|END|", "gh"])
+    handler = StreamResponseHandler(b"{}", "chat", "token", max_tokens=max_tokens, stop="|END|")
+    chunks = stream_chunks(handler)
+    content = "".join(c["choices"][0]["delta"].get("content") or "" for c in chunks)
+    assert content == expected
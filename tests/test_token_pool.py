@@ -0,0 +1,32 @@
+"""测试匿名token预取池"""
+
+import itertools
+import time
+
+from app.utils.token_pool import AnonymousTokenPool
+
+
+def _counter_fetch():
+    counter = itertools.count(1)
+    return lambda: f"tok-{next(counter)}"
+
+
+def test_tokens_are_single_use():
+    pool = AnonymousTokenPool(_counter_fetch(), size=3, ttl=60)
+    assert pool.fill() == 3
+    tokens = {pool.acquire() for _ in range(6)}
+    assert len(tokens) == 6
+
+
+def test_expired_tokens_are_skipped():
+    pool = AnonymousTokenPool(_counter_fetch(), size=2, ttl=60)
+    pool.put("stale", fetched_at=time.time() - 120)
+    pool.put("fresh")
+    assert pool.acquire() == "fresh"
+
+
+def test_snapshot_restore_drops_expired():
+    pool = AnonymousTokenPool(_counter_fetch(), size=4, ttl=60)
+    restored = pool.restore([("a", time.time()), ("b", time.time() - 300)])
+    assert restored == 1
+    assert [t for t, _ in pool.snapshot()] == ["a"]
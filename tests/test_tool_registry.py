@@ -0,0 +1,56 @@
+"""测试工具集注册表与紧凑提示词渲染"""
+
+import copy
+
+from app.utils.tool_registry import ToolRegistry, render_compact_prompt
+from app.utils.tools import generate_tool_prompt
+
+
+def _tools(count: int):
+    tools = []
+    for i in range(count):
+        tools.append({
+            "type": "function",
+            "function": {
+                "name": f"tool_{i}",
+                "description": f"Do thing number {i} with the given inputs",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "query": {"type": "string", "description": "what to look up"},
+                        "unit": {"type": "string", "enum": ["c", "f"], "description": "unit of measure"},
+                        "ids": {"type": "array", "items": {"type": "integer"}, "description": "record ids"},
+                    },
+                    "required": ["query"],
+                },
+            },
+        })
+    return tools
+
+
+def test_toolsets_are_interned_by_content():
+    registry = ToolRegistry()
+    first = registry.compile(_tools(3))
+    assert registry.compile(copy.deepcopy(_tools(3))) is first
+    assert registry.compile(_tools(4)) is not first
+    assert len(registry) == 2
+    assert first.prompt("full") == generate_tool_prompt(_tools(3))
+
+
+def test_compact_prompt_renders_signatures():
+    prompt = render_compact_prompt(_tools(1))
+    assert '- tool_0(query: string, unit?: "c"|"f", ids?: integer[]): Do thing number 0 with the given inputs' in prompt
+    assert "tool_calls" in prompt
+
+
+def test_compact_prompt_is_much_shorter_for_large_toolsets():
+    stats = ToolRegistry().compile(_tools(60)).stats()
+    assert stats["functions"] == 60
+    assert stats["compact_chars"] < stats["full_chars"] * 0.6
+
+
+def test_registry_is_bounded():
+    registry = ToolRegistry(capacity=2)
+    for count in range(1, 5):
+        registry.compile(_tools(count))
+    assert len(registry) == 2
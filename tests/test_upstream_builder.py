@@ -0,0 +1,98 @@
+"""测试单次遍历的上游请求体构建与原流程结果一致"""
+
+import json
+
+import pytest
+
+from app.core.config import settings
+from app.models.schemas import Message, ModelItem, OpenAIRequest, UpstreamRequest
+from app.utils.tools import content_to_string, process_messages_with_tools
+from app.utils.upstream_builder import build_upstream_payload, resolve_upstream_model
+
+WEATHER_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "get_weather",
+        "description": "查询天气",
+        "parameters": {"type": "object", "properties": {"city": {"type": "string"}}, "required": ["city"]},
+    },
+}
+
+
+def _legacy_payload(request: OpenAIRequest, chat_id: str, msg_id: str) -> dict:
+    """原 chat_completions 中的转换流程"""
+    processed = process_messages_with_tools([m.model_dump() for m in request.messages], request.tools, request.tool_choice)
+    messages = [
+        Message(role=m["role"], content=content_to_string(m.get("content")), reasoning_content=m.get("reasoning_content"))
+        for m in processed
+    ]
+    model_id, model_name = resolve_upstream_model(request.model)
+    if settings.UPSTREAM_TYPE == "openai":
+        payload = {
+            "model": model_name,
+            "messages": [m.model_dump(exclude_none=True) for m in messages],
+            "stream": bool(request.stream),
+        }
+        if request.tools:
+            payload["tools"] = request.tools
+        if request.tool_choice is not None:
+            payload["tool_choice"] = request.tool_choice
+        return payload
+    is_search = request.model == settings.SEARCH_MODEL
+    return UpstreamRequest(
+        stream=True,
+        chat_id=chat_id,
+        id=msg_id,
+        model=model_id,
+        messages=messages,
+        params={},
+        features={
+            "enable_thinking": request.model == settings.THINKING_MODEL,
+            "web_search": is_search,
+            "auto_web_search": is_search,
+        },
+        background_tasks={"title_generation": False, "tags_generation": False},
+        mcp_servers=["deep-web-search"] if is_search else [],
+        model_item=ModelItem(id=model_id, name=model_name, owned_by="openai"),
+        tool_servers=[],
+        variables={},
+    ).model_dump(exclude_none=True)
+
+
+CASES = [
+    {"model": "GLM-4.5", "messages": [{"role": "user", "content": "你好"}]},
+    {
+        "model": settings.THINKING_MODEL,
+        "messages": [
+            {"role": "system", "content": "be brief"},
+            {"role": "user", "content": [{"type": "text", "text": "part one"}, {"type": "image_url"}, {"type": "text", "text": "two"}]},
+            {"role": "assistant", "content": None, "reasoning_content": "thinking"},
+            {"role": "tool", "content": '{"temp": 21}'},
+            {"role": "user", "content": "and tomorrow?"},
+        ],
+        "tools": [WEATHER_TOOL],
+        "tool_choice": "auto",
+    },
+    {
+        "model": settings.SEARCH_MODEL,
+        "messages": [{"role": "user", "content": "查一下"}],
+        "tools": [WEATHER_TOOL],
+        "tool_choice": {"type": "function", "function": {"name": "get_weather"}},
+    },
+    {"model": settings.AIR_MODEL, "messages": [{"role": "user", "content": "x"}], "tools": [WEATHER_TOOL], "tool_choice": "none"},
+]
+
+
+@pytest.mark.parametrize("upstream_type", ["zai", "openai"])
+@pytest.mark.parametrize("case", CASES)
+def test_builder_matches_legacy_pipeline(monkeypatch, upstream_type, case):
+    monkeypatch.setattr(settings, "UPSTREAM_TYPE", upstream_type)
+    request = OpenAIRequest(**case)
+
+    built = json.loads(build_upstream_payload(request, "chat-1", "msg-1"))
+    expected = _legacy_payload(request, "chat-1", "msg-1")
+
+    if upstream_type == "zai":
+        assert set(built.pop("variables")) == {"{{USER_NAME}}", "{{USER_LOCATION}}", "{{CURRENT_DATETIME}}"}
+        expected.pop("variables")
+    assert built == expected